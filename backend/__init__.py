@@ -0,0 +1,9 @@
+# Приложение Celery загружается вместе с Django, чтобы shared_task из
+# subscriptions/tasks.py использовали его настройки. Без установленного celery
+# проект работает на django-background-tasks
+try:
+    from .celery import app as celery_app
+except ImportError:
+    celery_app = None
+
+__all__ = ('celery_app',)
@@ -3,6 +3,10 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Поток уведомлений /api/auth/notifications/stream/ (server-sent events) -
+асинхронное представление: держать тысячи открытых соединений может только
+ASGI-сервер, например ``uvicorn backend.asgi:application``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -1,6 +1,10 @@
 import os
+from pathlib import Path
+from urllib.parse import urlparse
+
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import beat_init, import_modules, worker_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
@@ -8,13 +12,72 @@ app = Celery('backend')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
+
+@worker_init.connect
+@beat_init.connect
+def check_broker(**kwargs):
+    """
+    Брокер в памяти виден только своему процессу: задачи от beat или веб-процесса
+    до воркера не дойдут, поэтому воркер и beat на нем не запускаются
+    """
+    if app.conf.broker_url.startswith('memory://'):
+        # Исключения обработчиков сигналов Celery только логирует, поэтому SystemExit
+        raise SystemExit(
+            "Брокер memory:// работает только внутри одного процесса; для воркера и beat "
+            "задайте CELERY_BROKER_URL (filesystem:// или redis://)"
+        )
+
+
+@import_modules.connect
+def create_broker_folders(**kwargs):
+    """
+    Папки файлового брокера и результатов создаются при запуске команд celery
+    (воркер, beat), до подключения к брокеру, а не при импорте настроек
+    """
+    transport_options = app.conf.broker_transport_options or {}
+    folders = [transport_options.get(key) for key in ('data_folder_in', 'data_folder_out', 'control_folder')]
+    if str(app.conf.result_backend).startswith('file://'):
+        folders.append(urlparse(app.conf.result_backend).path)
+    for folder in filter(None, folders):
+        Path(folder).mkdir(parents=True, exist_ok=True)
+
+
+# Координаторы быстрые: они только забирают работу и раздают части воркерам
 app.conf.beat_schedule = {
     'check-subscription-renewals': {
         'task': 'subscriptions.tasks.check_subscription_renewals',
-        'schedule': crontab(hour=0, minute=0),  # ежедневно в полночь
+        'schedule': 60 * 5,  # каждые 5 минут: расписание отдает только наступившие записи
+    },
+    'sweep-pending-purchases': {
+        'task': 'subscriptions.tasks.sweep_pending_purchases',
+        'schedule': 60 * 5,
+    },
+    'retry-failed-payments': {
+        'task': 'subscriptions.tasks.retry_failed_payments',
+        'schedule': 60 * 5,
+    },
+    'close-expired-subscriptions': {
+        'task': 'subscriptions.tasks.close_expired_subscriptions',
+        'schedule': crontab(minute=0),  # каждый час
     },
     'send-renewal-notifications': {
         'task': 'subscriptions.tasks.send_renewal_notifications',
         'schedule': crontab(hour=9, minute=0),  # ежедневно в 9:00
     },
-}
\ No newline at end of file
+    'update-revenue-rollup': {
+        'task': 'subscriptions.tasks.update_revenue_rollup',
+        'schedule': 60 * 10,
+    },
+    'purge-idempotency-keys': {
+        'task': 'subscriptions.tasks.purge_idempotency_keys',
+        'schedule': crontab(minute=30),  # каждый час
+    },
+    'reconcile-balances': {
+        'task': 'subscriptions.tasks.reconcile_balances',
+        'schedule': crontab(hour=3, minute=0),  # ежедневно в 3:00, вне часов нагрузки
+    },
+    'deliver-outbound-emails': {
+        'task': 'subscriptions.tasks.deliver_outbound_emails',
+        'schedule': 60,
+    },
+}
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -83,6 +84,18 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Нужно движку продлений (renewal_engine): шарды продлеваются пулами потоков,
+        # и транзакции prepare_user/settle_user сначала читают, затем пишут. SQLite
+        # блокировки не ставит (select_for_update на нем не работает), а при
+        # BEGIN DEFERRED повышение блокировки у второго писателя сразу падает с
+        # "database is locked", без ожидания timeout. BEGIN IMMEDIATE берет блокировку
+        # записи в начале atomic(), и писатели ждут очереди до timeout секунд.
+        # Цена: любой atomic() занимает блокировку записи, поэтому блоки только
+        # с чтением в atomic() не оборачиваем. На PostgreSQL настройка не нужна.
+        "OPTIONS": {
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+        },
     }
 }
 
@@ -147,18 +160,106 @@ BACKGROUND_TASK_RUN_ASYNC = True
 BACKGROUND_TASK_ASYNC_THREADS = 4
 MAX_ATTEMPTS = 3
 
-
-# # НАСТРОЙКИ CELERY
-# CELERY_BROKER_URL = 'redis://localhost:6379/0'  # Redis
-# CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
-# CELERY_ACCEPT_CONTENT = ['json']
-# CELERY_TASK_SERIALIZER = 'json'
-# CELERY_RESULT_SERIALIZER = 'json'
-# CELERY_TIMEZONE = 'Europe/Moscow'
-
-# Если Redis не установлен, альтернатива:
-# CELERY_BROKER_URL = 'memory://'
-# CELERY_RESULT_BACKEND = 'cache+memory://'
+# Движок автопродления: подписки делятся на шарды по user_id,
+# каждый шард обрабатывается своим пулом потоков
+RENEWAL_SHARD_COUNT = 4
+RENEWAL_WORKERS_PER_SHARD = 4
+RENEWAL_BATCH_SIZE = 500  # подписок в одном пакетном списании
+EXPIRY_CHUNK_SIZE = 1000  # подписок в одном UPDATE при закрытии истекших
+EXPIRY_REMINDER_HORIZONS_DAYS = (7, 3, 1)  # за сколько дней до окончания напоминать
+EXPIRY_REMINDER_CHUNK_SIZE = 500  # пользователей в одной пачке напоминаний
+NOTIFICATION_BATCH_SIZE = 500  # уведомлений в одном bulk_create
+
+# Расписание продлений: воркер читает только наступившие записи
+RENEWAL_CLAIM_SECONDS = 900  # через сколько взятая, но не продленная подписка станет видна снова
+PENDING_RENEWAL_RETRY_SECONDS = 3600  # повтор для подписок, ждущих пополнения баланса
+
+# Покупка, не завершенная за это время (упал процесс или запрос), отменяется с возвратом резерва
+PURCHASE_PENDING_TIMEOUT_SECONDS = 900
+
+# Повторы платежей, отклоненных шлюзом: задержка растет от BASE вдвое
+# с каждой попыткой (не больше MAX_DELAY), со случайным разбросом
+PAYMENT_RETRY_MAX_ATTEMPTS = 5
+PAYMENT_RETRY_BASE_SECONDS = 300
+PAYMENT_RETRY_MAX_DELAY_SECONDS = 6 * 3600
+PAYMENT_RETRY_BATCH_SIZE = 200
+PAYMENT_RETRY_CLAIM_SECONDS = 600  # аренда взятых в работу повторов
+
+# Асинхронный клиент платежного шлюза
+PAYMENT_GATEWAY_MAX_IN_FLIGHT = 100  # одновременных запросов к шлюзу
+PAYMENT_GATEWAY_TIMEOUT = 5  # секунд на один запрос
+
+# Курсорная пагинация списков API (транзакции, подписки, уведомления)
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
+# Время жизни кеша статистики админ-панели, секунд
+ADMIN_STATS_CACHE_TTL = 30
+
+# Дневная сводка выручки: отставание от текущего времени при инкрементальном
+# обновлении, секунд (чтобы не пропустить еще не закоммиченные транзакции)
+ROLLUP_SAFETY_LAG_SECONDS = 60
+
+# Ключи идемпотентности (заголовок Idempotency-Key) для покупки, пополнения,
+# возврата и продления: сколько хранится ответ и через сколько зависший
+# в работе запрос можно выполнить повторно, секунд
+IDEMPOTENCY_KEY_TTL = 24 * 3600
+IDEMPOTENCY_LOCK_TIMEOUT = 300
+
+# Сверка балансов с журналом транзакций: пользователей в одном агрегирующем запросе
+RECONCILIATION_CHUNK_SIZE = 1000
+
+# Кеш тарифов и промокодов: LRU в памяти процесса и, если задан CATALOG_CACHE_ALIAS
+# (имя кеша из CACHES, например Redis), общий кеш между процессами
+CATALOG_CACHE_SIZE = 1024
+CATALOG_CACHE_LOCAL_TTL = 60  # предел устаревания LRU при нескольких процессах, секунд
+CATALOG_CACHE_SHARED_TTL = 3600
+CATALOG_CACHE_ALIAS = None
+
+# Поток уведомлений (SSE): раз в HEARTBEAT секунд поток шлет ping и дочитывает
+# из БД уведомления, созданные другими процессами; QUEUE_SIZE - очередь одного клиента
+NOTIFICATION_STREAM_HEARTBEAT_SECONDS = 20
+NOTIFICATION_STREAM_QUEUE_SIZE = 100
+
+# Очередь исходящих писем: воркер отправляет пачку через одно SMTP-соединение,
+# не быстрее RATE писем в секунду; неудачные повторяются до MAX_ATTEMPTS раз.
+# EMAIL_QUEUE_BACKEND - бэкенд воркера (None - EMAIL_BACKEND); в разработке письма
+# выводятся в консоль, для тестов подходит filebased или locmem
+EMAIL_QUEUE_BATCH_SIZE = 100
+EMAIL_QUEUE_MAX_PER_RUN = 1000
+EMAIL_QUEUE_RATE_PER_SECOND = 10
+EMAIL_QUEUE_MAX_ATTEMPTS = 5
+EMAIL_QUEUE_RETRY_BASE_SECONDS = 60
+EMAIL_QUEUE_CLAIM_SECONDS = 300
+EMAIL_QUEUE_KEEP_SENT_DAYS = 7
+EMAIL_QUEUE_BACKEND = 'django.core.mail.backends.console.EmailBackend' if DEBUG else None
+
+
+# НАСТРОЙКИ CELERY (задачи - subscriptions/tasks.py, расписание - backend/celery.py).
+# Брокер задается переменными окружения, например redis://localhost:6379/0.
+# По умолчанию - брокер в памяти: он живет внутри одного процесса, поэтому задачи
+# (и chord) выполняются сразу при вызове (CELERY_TASK_ALWAYS_EAGER), а воркер и beat
+# на нем не запускаются. filesystem:// - несколько воркеров на одной машине
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'memory://')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'cache+memory://')
+CELERY_TASK_ALWAYS_EAGER = os.environ.get(
+    'CELERY_TASK_ALWAYS_EAGER', '1' if CELERY_BROKER_URL.startswith('memory://') else '0'
+) == '1'
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_SERIALIZER = 'json'
+CELERY_TIMEZONE = 'Europe/Moscow'
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1  # шарды долгие - не набирать их заранее
+CELERY_RETRY_FANOUT = 8  # пачек очереди повторов на один запуск
+if CELERY_BROKER_URL.startswith('filesystem://'):
+    # Очередь и результаты (нужны для chord) - в файлах рядом с проектом.
+    # Папки создают воркер и beat при запуске (backend/celery.py)
+    CELERY_BROKER_TRANSPORT_OPTIONS = {
+        'data_folder_in': str(BASE_DIR / '.celery' / 'broker'),
+        'data_folder_out': str(BASE_DIR / '.celery' / 'broker'),
+        'control_folder': str(BASE_DIR / '.celery' / 'control'),
+    }
+    CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', f"file://{BASE_DIR / '.celery' / 'results'}")
 
 
 # Настройки email
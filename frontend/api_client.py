@@ -0,0 +1,175 @@
+"""
+Загрузка списков API по страницам. Списки транзакций, подписок и уведомлений
+отдаются курсорной пагинацией ({"results": [...], "next": url}); загруженные
+страницы хранятся в st.session_state, следующая подгружается по кнопке.
+Первая страница перепроверяется на каждом перезапуске страницы условным GET:
+пока список не менялся, сервер отвечает 304, а новые записи появляются сразу.
+
+GET-запросы идут с If-None-Match: ответ хранится в st.session_state вместе с ETag,
+и при 304 сервер не пересылает и не сериализует данные заново.
+"""
+import json
+import time
+import uuid
+
+import streamlit as st
+import requests
+
+PAGE_SIZE = 50
+ETAG_CACHE_SIZE = 100
+
+
+def get_json(url, headers=None, params=None, timeout=5):
+    """
+    GET с проверкой ETag. Возвращает разобранный JSON; при 304 - сохраненный
+    ранее ответ. Ошибки HTTP выбрасываются как requests.HTTPError.
+    """
+    cache = st.session_state.setdefault('etag_cache', {})
+    token = headers.get('Authorization') if headers else None
+    key = (url, tuple(sorted((params or {}).items())), token)
+
+    request_headers = dict(headers or {})
+    if key in cache:
+        request_headers['If-None-Match'] = cache[key][0]
+
+    response = requests.get(url, headers=request_headers, params=params, timeout=timeout)
+    if response.status_code == 304 and key in cache:
+        return cache[key][1]
+    response.raise_for_status()
+
+    data = response.json()
+    etag = response.headers.get('ETag')
+    if etag:
+        cache.pop(key, None)
+        cache[key] = (etag, data)
+        # Самые старые ответы вытесняются (dict хранит порядок вставки)
+        while len(cache) > ETAG_CACHE_SIZE:
+            cache.pop(next(iter(cache)))
+    return data
+
+
+def fetch_page(url, headers, params=None, timeout=5):
+    """
+    Загружает одну страницу списка. Возвращает (записи, url следующей страницы).
+    Ответ без пагинации (обычный список) считается единственной страницей.
+    """
+    return _split_page(get_json(url, headers, params=params, timeout=timeout))
+
+
+def _split_page(data):
+    if isinstance(data, list):
+        return data, None
+    return data.get('results', []), data.get('next')
+
+
+def _state_key(key):
+    return f"paged_{key}"
+
+
+def load_list(key, url, headers, page_size=PAGE_SIZE):
+    """
+    Возвращает (записи, есть ли еще страницы) для списка key.
+    Первая страница перепроверяется по ETag при каждом обращении; если она
+    изменилась, новые записи встают в начало, подгруженные страницы сохраняются.
+    Список сбрасывается при смене пользователя (другой токен в headers).
+    """
+    state = st.session_state.get(_state_key(key))
+    token = headers.get('Authorization') if headers else None
+    first = get_json(url, headers, params={'page_size': page_size})
+    if state is None or state['token'] != token:
+        items, next_url = _split_page(first)
+        state = {'items': list(items), 'next': next_url, 'first': first, 'pages': 1, 'token': token}
+        st.session_state[_state_key(key)] = state
+    elif first != state['first']:
+        items, next_url = _split_page(first)
+        if state['pages'] == 1:
+            state['items'], state['next'] = list(items), next_url
+        else:
+            # Курсор следующей страницы остается верным: записи, сдвинутые
+            # новыми на вторую страницу, уже загружены и не теряются
+            ids = {item.get('id') for item in items}
+            state['items'] = list(items) + [item for item in state['items'] if item.get('id') not in ids]
+        state['first'] = first
+    return state['items'], state['next'] is not None
+
+
+def load_more_button(key, headers, label="Загрузить ещё"):
+    """Кнопка подгрузки следующей страницы списка key"""
+    state = st.session_state.get(_state_key(key))
+    if not state or not state['next']:
+        return
+    if st.button(label, key=f"load_more_{key}"):
+        try:
+            items, next_url = fetch_page(state['next'], headers)
+            state['items'].extend(items)
+            state['next'] = next_url
+            state['pages'] += 1
+            st.rerun()
+        except requests.RequestException as e:
+            st.error(f"Ошибка загрузки: {e}")
+
+
+def reset_list(*keys):
+    """Сбрасывает загруженные страницы (после изменения данных)"""
+    for key in keys:
+        st.session_state.pop(_state_key(key), None)
+
+
+def post_idempotent(url, headers, json=None, retries=2, timeout=10):
+    """
+    POST для платежных операций (покупка, пополнение, продление) с заголовком
+    Idempotency-Key. При таймауте или обрыве соединения запрос повторяется с тем же
+    ключом: если сервер уже выполнил его, он вернет сохраненный ответ, а не спишет
+    деньги второй раз.
+    """
+    headers = dict(headers or {}, **{'Idempotency-Key': str(uuid.uuid4())})
+    for attempt in range(retries + 1):
+        try:
+            return requests.post(url, json=json, headers=headers, timeout=timeout)
+        except (requests.Timeout, requests.ConnectionError):
+            if attempt == retries:
+                raise
+
+
+def fetch_unread_count(api_base_url, headers):
+    """Число непрочитанных уведомлений (легкий запрос к счетчику, с ETag)"""
+    data = get_json(f"{api_base_url}/subscriptions/notifications/unread-count/", headers, timeout=3)
+    return data.get('unread_count', 0)
+
+
+def unread_badge(api_base_url, headers):
+    """Значок непрочитанных уведомлений в боковой панели"""
+    try:
+        count = fetch_unread_count(api_base_url, headers)
+    except requests.RequestException:
+        return
+    st.sidebar.metric("Непрочитанные уведомления", count)
+
+
+def wait_for_notifications(api_base_url, headers, last_id=None, timeout=30):
+    """
+    Ждет новые уведомления в SSE-потоке сервера (вместо повторной загрузки списка).
+    Возвращает пришедшие уведомления, как только появится хотя бы одно, или []
+    по истечении timeout. С last_id сервер сначала отдаст пропущенные после него.
+    """
+    request_headers = {'Authorization': headers['Authorization'], 'Accept': 'text/event-stream'}
+    if last_id is not None:
+        request_headers['Last-Event-ID'] = str(last_id)
+
+    deadline = time.monotonic() + timeout
+    received = []
+    try:
+        with requests.get(f"{api_base_url}/auth/notifications/stream/", headers=request_headers,
+                          stream=True, timeout=(3, timeout)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith('data:'):
+                    received.append(json.loads(line[5:]))
+                elif not line and received:
+                    # Конец события: отдаем то, что уже пришло
+                    break
+                if time.monotonic() > deadline:
+                    break
+    except requests.Timeout:
+        pass
+    return received
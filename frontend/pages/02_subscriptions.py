@@ -2,6 +2,8 @@ import streamlit as st
 import requests
 from datetime import datetime
 
+from api_client import load_list, load_more_button, reset_list, post_idempotent, get_json
+
 API_BASE_URL = "http://127.0.0.1:8000/api"
 
 st.set_page_config(
@@ -70,9 +72,8 @@ def get_auth_headers():
 
 def fetch_subscription_plans():
     try:
-        response = requests.get(f"{API_BASE_URL}/subscriptions/plans/")
-        if response.status_code == 200:
-            return response.json()
+        return get_json(f"{API_BASE_URL}/subscriptions/plans/")
+    except requests.HTTPError:
         return []
     except Exception as e:
         st.error(f"Ошибка загрузки тарифов: {e}")
@@ -84,9 +85,8 @@ def fetch_my_subscriptions():
         return []
     
     try:
-        response = requests.get(f"{API_BASE_URL}/subscriptions/my-subscriptions/", headers=headers)
-        if response.status_code == 200:
-            return response.json()
+        return get_json(f"{API_BASE_URL}/subscriptions/my-subscriptions/", headers)
+    except requests.HTTPError:
         return []
     except Exception as e:
         st.error(f"Ошибка загрузки подписок: {e}")
@@ -98,9 +98,8 @@ def fetch_promocodes():
         return []
     
     try:
-        response = requests.get(f"{API_BASE_URL}/subscriptions/promocodes/", headers=headers)
-        if response.status_code == 200:
-            return response.json()
+        return get_json(f"{API_BASE_URL}/subscriptions/promocodes/", headers)
+    except requests.HTTPError:
         return []
     except Exception as e:
         st.error(f"Ошибка загрузки промокодов: {e}")
@@ -112,10 +111,8 @@ def fetch_transactions():
         return []
     
     try:
-        response = requests.get(f"{API_BASE_URL}/subscriptions/transactions/", headers=headers)
-        if response.status_code == 200:
-            return response.json()
-        return []
+        transactions, _ = load_list('transactions', f"{API_BASE_URL}/subscriptions/transactions/", headers)
+        return transactions
     except Exception as e:
         st.error(f"Ошибка загрузки транзакций: {e}")
         return []
@@ -130,10 +127,10 @@ def purchase_subscription(plan_id, promo_code=""):
         data["promo_code"] = promo_code
     
     try:
-        response = requests.post(
+        response = post_idempotent(
             f"{API_BASE_URL}/subscriptions/purchase/",
-            json=data,
-            headers=headers
+            headers,
+            json=data
         )
         return response
     except Exception as e:
@@ -290,6 +287,7 @@ def display_subscription_card(subscription):
                     response = cancel_subscription(subscription['id'])
                     if response and response.status_code == 200:
                         st.success("Подписка отменена")
+                        reset_list('transactions')
                         st.rerun()
                     elif response:
                         st.error(f"Ошибка: {response.status_code} - {response.text}")
@@ -426,6 +424,7 @@ def main():
                                 
                                 if 'selected_plan' in st.session_state:
                                     del st.session_state['selected_plan']
+                                reset_list('transactions')
                                 st.rerun()
                             elif response.status_code == 402:
                                 data = response.json()
@@ -506,9 +505,10 @@ def main():
                     "Описание": st.column_config.TextColumn("Описание", width="large")
                 }
             )
+            load_more_button('transactions', get_auth_headers())
             
             st.markdown("---")
-            st.subheader("Статистика")
+            st.subheader("Статистика по загруженным операциям")
             
             successful = len([t for t in transactions if t.get('status') == 'completed'])
             failed = len([t for t in transactions if t.get('status') == 'failed'])
@@ -580,6 +580,7 @@ def main():
         st.markdown("### Быстрые действия")
         
         if st.button("Обновить данные", use_container_width=True, key="refresh_btn"):
+            reset_list('transactions')
             st.rerun()
         
         if st.button("Выйти", use_container_width=True, key="logout_btn"):
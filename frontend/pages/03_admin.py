@@ -5,6 +5,8 @@ from datetime import datetime, timedelta
 import sqlite3
 import os
 
+from api_client import load_list, load_more_button, reset_list
+
 API_BASE_URL = "http://127.0.0.1:8000/api"
 
 def is_admin_user():
@@ -134,6 +136,7 @@ def main():
     
     with col2:
         if st.button("Обновить статистику"):
+            reset_list('transactions')
             st.rerun()
     
     with col3:
@@ -263,50 +266,43 @@ def main():
     with tab3:
         st.header("История транзакций")
         
-        # Загружаем транзакции
+        # Загружаем транзакции постранично
         try:
-            response = requests.get(
-                f"{API_BASE_URL}/subscriptions/transactions/",
-                headers=headers
-            )
+            transactions, has_more = load_list('transactions', f"{API_BASE_URL}/subscriptions/transactions/", headers)
             
-            if response.status_code == 200:
-                transactions = response.json()
+            if transactions:
+                # Агрегируем статистику
+                total_amount = sum(float(t.get('amount', 0)) for t in transactions)
+                completed = len([t for t in transactions if t.get('status') == 'completed'])
+                failed = len([t for t in transactions if t.get('status') == 'failed'])
                 
-                if transactions:
-                    # Агрегируем статистику
-                    total_amount = sum(float(t.get('amount', 0)) for t in transactions)
-                    completed = len([t for t in transactions if t.get('status') == 'completed'])
-                    failed = len([t for t in transactions if t.get('status') == 'failed'])
-                    
-                    col1, col2, col3 = st.columns(3)
-                    col1.metric("Всего транзакций", len(transactions))
-                    col2.metric("Успешных", completed)
-                    col3.metric("Общая сумма", f"{total_amount:.2f} RUB")
-                    
-                    # Таблица транзакций
-                    st.subheader("Последние транзакции")
-                    
-                    table_data = []
-                    for t in transactions[:20]:  # Последние 20
-                        table_data.append({
-                            'ID': t.get('id', ''),
-                            'Тип': t.get('transaction_type', '').replace('_', ' ').title(),
-                            'Сумма': f"{t.get('amount', 0)} RUB",
-                            'Статус': t.get('status', '').title(),
-                            'Дата': t.get('created_at', '')[:19],
-                            'Описание': t.get('description', '')[:50] + '...'
-                        })
-                    
-                    st.dataframe(
-                        pd.DataFrame(table_data),
-                        use_container_width=True,
-                        hide_index=True
-                    )
-                else:
-                    st.info("Нет транзакций")
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Загружено транзакций", f"{len(transactions)}+" if has_more else len(transactions))
+                col2.metric("Успешных", completed)
+                col3.metric("Общая сумма", f"{total_amount:.2f} RUB")
+                
+                # Таблица транзакций
+                st.subheader("Последние транзакции")
+                
+                table_data = []
+                for t in transactions:
+                    table_data.append({
+                        'ID': t.get('id', ''),
+                        'Тип': t.get('transaction_type', '').replace('_', ' ').title(),
+                        'Сумма': f"{t.get('amount', 0)} RUB",
+                        'Статус': t.get('status', '').title(),
+                        'Дата': t.get('created_at', '')[:19],
+                        'Описание': t.get('description', '')[:50] + '...'
+                    })
+                
+                st.dataframe(
+                    pd.DataFrame(table_data),
+                    use_container_width=True,
+                    hide_index=True
+                )
+                load_more_button('transactions', headers)
             else:
-                st.error("Ошибка загрузки транзакций")
+                st.info("Нет транзакций")
         except Exception as e:
             st.error(f"Ошибка: {e}")
     
@@ -389,6 +385,7 @@ def main():
         
         st.markdown("---")
         if st.button("Обновить страницу"):
+            reset_list('transactions')
             st.rerun()
         
         if st.button("Выйти"):
@@ -2,6 +2,8 @@ import streamlit as st
 import requests
 from datetime import datetime
 
+from api_client import load_list, load_more_button, reset_list, post_idempotent
+
 API_BASE_URL = "http://127.0.0.1:8000/api"
 
 st.set_page_config(
@@ -39,15 +41,16 @@ def main():
         if st.button("1. Создать тестовую подписку", type="primary", use_container_width=True):
             with st.spinner("Создаем подписку..."):
                 try:
-                    response = requests.post(
+                    response = post_idempotent(
                         f"{API_BASE_URL}/subscriptions/purchase/",
-                        json={"plan_id": 1},
-                        headers=headers
+                        headers,
+                        json={"plan_id": 1}
                     )
                     
                     if response.status_code == 201:
                         data = response.json()
                         st.success(f"Подписка создана! ID: {data.get('subscription_id')}")
+                        reset_list('transactions')
                         st.rerun()
                     else:
                         st.error(f"Ошибка: {response.text}")
@@ -70,15 +73,16 @@ def main():
                         
                         for sub in subscriptions:
                             # Продлеваем каждую подписку
-                            renew_response = requests.post(
+                            renew_response = post_idempotent(
                                 f"{API_BASE_URL}/subscriptions/test-renew/{sub['id']}/",
-                                headers=headers
+                                headers
                             )
                             
                             if renew_response.status_code == 200:
                                 renewed_count += 1
                         
                         st.success(f"Продлено {renewed_count} из {len(subscriptions)} подписок")
+                        reset_list('transactions')
                         st.rerun()
                     else:
                         st.error("Ошибка загрузки подписок")
@@ -119,13 +123,14 @@ def main():
                             # Кнопка продлить эту подписку
                             if st.button(f"Продлить #{sub['id']}", key=f"renew_{sub['id']}"):
                                 with st.spinner("Продление..."):
-                                    renew_response = requests.post(
+                                    renew_response = post_idempotent(
                                         f"{API_BASE_URL}/subscriptions/test-renew/{sub['id']}/",
-                                        headers=headers
+                                        headers
                                     )
                                     
                                     if renew_response.status_code == 200:
                                         st.success("Подписка продлена!")
+                                        reset_list('transactions')
                                         st.rerun()
                                     else:
                                         st.error(f"Ошибка: {renew_response.text}")
@@ -150,6 +155,7 @@ def main():
                                     
                                     if update_response.status_code == 200:
                                         st.success("Дата обновлена!")
+                                        reset_list('transactions')
                                         st.rerun()
                                     else:
                                         st.error(f"Ошибка: {update_response.text}")
@@ -164,53 +170,44 @@ def main():
     st.header("История транзакций")
     
     try:
-        response = requests.get(
-            f"{API_BASE_URL}/subscriptions/transactions/",
-            headers=headers
-        )
-        
-        if response.status_code == 200:
-            transactions = response.json()
-            
-            if not transactions:
-                st.info("Нет транзакций")
-            else:
-                # Показываем последние 10 транзакций
-                for t in transactions[:10]:
-                    if t['status'] == 'completed':
-                        color = "green"
-                    elif t['status'] == 'failed':
-                        color = "red"
-                    else:
-                        color = "orange"
-                    
-                    # Форматируем дату
-                    created_at = t['created_at']
-                    if created_at:
-                        try:
-                            dt = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                            date_str = dt.strftime("%d.%m.%Y %H:%M")
-                        except:
-                            date_str = created_at[:16]
-                    else:
-                        date_str = "Неизвестно"
-                    
-                    # Отображаем транзакцию
-                    st.markdown(f"""
-                    <div style="
-                        padding: 10px;
-                        margin: 5px 0;
-                        border-left: 4px solid {color};
-                        background-color: #f9f9f9;
-                    ">
-                        Сумма: <strong>{t['amount']} RUB</strong><br>
-                        Статус: {t['status']}<br>
-                        Дата: {date_str}<br>
-                        <small>{t['description']}</small>
-                    </div>
-                    """, unsafe_allow_html=True)
+        transactions, _ = load_list('transactions', f"{API_BASE_URL}/subscriptions/transactions/", headers)
+        if not transactions:
+            st.info("Нет транзакций")
         else:
-            st.error("Ошибка загрузки транзакций")
+            for t in transactions:
+                if t['status'] == 'completed':
+                    color = "green"
+                elif t['status'] == 'failed':
+                    color = "red"
+                else:
+                    color = "orange"
+                
+                # Форматируем дату
+                created_at = t['created_at']
+                if created_at:
+                    try:
+                        dt = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+                        date_str = dt.strftime("%d.%m.%Y %H:%M")
+                    except:
+                        date_str = created_at[:16]
+                else:
+                    date_str = "Неизвестно"
+                
+                # Отображаем транзакцию
+                st.markdown(f"""
+                <div style="
+                    padding: 10px;
+                    margin: 5px 0;
+                    border-left: 4px solid {color};
+                    background-color: #f9f9f9;
+                ">
+                    Сумма: <strong>{t['amount']} RUB</strong><br>
+                    Статус: {t['status']}<br>
+                    Дата: {date_str}<br>
+                    <small>{t['description']}</small>
+                </div>
+                """, unsafe_allow_html=True)
+            load_more_button('transactions', headers)
     except Exception as e:
         st.error(f"Ошибка: {e}")
     
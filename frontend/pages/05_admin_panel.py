@@ -4,6 +4,8 @@ import pandas as pd
 from datetime import datetime, timedelta
 import time
 
+from api_client import fetch_page, load_list, load_more_button, reset_list
+
 API_BASE_URL = "http://127.0.0.1:8000/api"
 
 def is_admin_user():
@@ -53,27 +55,59 @@ def fetch_all_users(headers):
         st.error(f"Ошибка: {e}")
         return []
 
-def fetch_all_subscriptions(headers):
+def fetch_admin_stats(headers, refresh=False):
+    """Сводная статистика, посчитанная на сервере"""
     try:
-        response = requests.get(f"{API_BASE_URL}/subscriptions/admin-subscriptions/", headers=headers, timeout=5)
+        params = {'refresh': 1} if refresh else None
+        response = requests.get(f"{API_BASE_URL}/subscriptions/admin-stats/", headers=headers, params=params, timeout=5)
         
         if response.status_code == 200:
             return response.json()
         elif response.status_code == 403:
-            return []
-        else:
-            return []
+            st.error("У вас нет прав для просмотра статистики")
+        return None
+    except:
+        return None
+
+def fetch_revenue_by_day(headers):
+    """Выручка по дням за последние 30 дней (из дневной сводки)"""
+    try:
+        response = requests.get(f"{API_BASE_URL}/subscriptions/admin-analytics/", headers=headers, timeout=5)
+        if response.status_code == 200:
+            return response.json().get('days', [])
+        return []
     except:
         return []
 
-def fetch_all_transactions(headers):
+def fetch_revenue_csv(headers):
     try:
-        response = requests.get(f"{API_BASE_URL}/subscriptions/admin-transactions/", headers=headers, timeout=5)
-        
+        response = requests.get(f"{API_BASE_URL}/subscriptions/admin-analytics/", headers=headers, params={'export': 'csv'}, timeout=10)
         if response.status_code == 200:
-            return response.json()
-        else:
-            return []
+            return response.content
+        return None
+    except:
+        return None
+
+def fetch_recent_transactions(headers, count=5):
+    try:
+        transactions, _ = fetch_page(f"{API_BASE_URL}/subscriptions/admin-transactions/", headers, params={'page_size': count})
+        return transactions
+    except:
+        return []
+
+def fetch_all_subscriptions(headers):
+    """Загруженные страницы подписок (следующие - по кнопке)"""
+    try:
+        subscriptions, _ = load_list('admin_subscriptions', f"{API_BASE_URL}/subscriptions/admin-subscriptions/", headers)
+        return subscriptions
+    except:
+        return []
+
+def fetch_all_transactions(headers):
+    """Загруженные страницы транзакций (следующие - по кнопке)"""
+    try:
+        transactions, _ = load_list('admin_transactions', f"{API_BASE_URL}/subscriptions/admin-transactions/", headers)
+        return transactions
     except:
         return []
 
@@ -140,6 +174,7 @@ def main():
                     )
                     if response.status_code == 200:
                         result = response.json()
+                        reset_list('admin_subscriptions', 'admin_transactions')
                         st.success(f"Проверено: {result.get('checked', 0)} подписок")
                         st.success(f"Продлено: {result.get('renewed', 0)}")
                         if result.get('failed', 0) > 0:
@@ -182,6 +217,8 @@ def main():
     
     with col3:
         if st.button("Обновить статистику", use_container_width=True):
+            reset_list('admin_subscriptions', 'admin_transactions')
+            st.session_state['admin_stats_refresh'] = True
             st.rerun()
     
     with col4:
@@ -194,6 +231,7 @@ def main():
                         headers=headers
                     )
                     if response.status_code == 201:
+                        reset_list('admin_subscriptions', 'admin_transactions')
                         st.success("Тестовая подписка создана!")
                     else:
                         st.warning(f"Не удалось создать подписку: {response.status_code}")
@@ -214,42 +252,79 @@ def main():
         st.header("Дашборд системы")
         
         with st.spinner("Загружаем статистику..."):
-            users = fetch_all_users(headers)
-            subscriptions = fetch_all_subscriptions(headers)
-            transactions = fetch_all_transactions(headers)
+            stats = fetch_admin_stats(headers, refresh=st.session_state.pop('admin_stats_refresh', False))
+            transactions = fetch_recent_transactions(headers)
         
         col1, col2, col3, col4 = st.columns(4)
         
-        with col1:
-            st.metric("Всего пользователей", len(users) if users else "N/A")
-        with col2:
-            active_subs = len([s for s in subscriptions if s.get('status') == 'active']) if subscriptions else 0
-            st.metric("Активных подписок", active_subs)
-        with col3:
-            if transactions:
-                total_amount = 0
-                for t in transactions:
-                    if t.get('status') == 'completed':
-                        try:
-                            amount = t.get('amount', 0)
-                            if isinstance(amount, str):
-                                amount = float(amount)
-                            total_amount += amount
-                        except:
-                            pass
-                st.metric("Выручка", f"{total_amount:.0f} RUB")
-            else:
-                st.metric("Выручка", "N/A")
-        with col4:
-            if users and subscriptions:
-                conversion = (len(subscriptions) / len(users)) * 100 if users else 0
-                st.metric("Конверсия", f"{conversion:.1f}%")
+        if stats:
+            col1.metric("Всего пользователей", stats['users']['total'])
+            col2.metric("Активных подписок", stats['subscriptions']['active'])
+            col3.metric("Выручка", f"{float(stats['revenue']['total']):.0f} RUB")
+            col4.metric("Конверсия", f"{stats['users']['conversion_percent']:.1f}%")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.subheader("Активные подписки по тарифам")
+                if stats['subscriptions']['active_by_plan']:
+                    st.dataframe(
+                        pd.DataFrame([
+                            {'Тариф': row['plan_name'], 'Активных': row['count']}
+                            for row in stats['subscriptions']['active_by_plan']
+                        ]),
+                        use_container_width=True,
+                        hide_index=True
+                    )
+                else:
+                    st.info("Нет активных подписок")
+            with col2:
+                st.subheader("Операции по типам")
+                if stats['revenue']['by_type']:
+                    st.dataframe(
+                        pd.DataFrame([
+                            {'Тип': transaction_type, 'Количество': row['count'], 'Сумма': f"{float(row['amount']):.2f} RUB"}
+                            for transaction_type, row in stats['revenue']['by_type'].items()
+                        ]),
+                        use_container_width=True,
+                        hide_index=True
+                    )
+                else:
+                    st.info("Нет операций")
+            
+            st.caption(f"Возвраты: {float(stats['revenue']['refunded']):.2f} RUB, "
+                       f"чистая выручка: {float(stats['revenue']['net']):.2f} RUB. "
+                       f"Обновлено: {format_date(stats['generated_at'])}")
+            
+            st.subheader("Выручка по дням")
+            revenue_days = fetch_revenue_by_day(headers)
+            if revenue_days:
+                df_revenue = pd.DataFrame([
+                    {'День': row['day'], 'Выручка': float(row['revenue']), 'Возвраты': float(row['refunds'])}
+                    for row in revenue_days
+                ]).set_index('День')
+                st.line_chart(df_revenue)
+                
+                if st.button("Экспорт сводки в CSV", key="export_rollup_csv"):
+                    csv = fetch_revenue_csv(headers)
+                    if csv:
+                        st.download_button(
+                            label="Скачать CSV",
+                            data=csv,
+                            file_name=f"revenue_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                            mime="text/csv",
+                            key="download_rollup_csv"
+                        )
+                    else:
+                        st.error("Не удалось выгрузить сводку")
             else:
-                st.metric("Конверсия", "N/A")
+                st.info("Сводка выручки пока пуста")
+        else:
+            for col, label in zip((col1, col2, col3, col4), ("Всего пользователей", "Активных подписок", "Выручка", "Конверсия")):
+                col.metric(label, "N/A")
         
         st.subheader("Последние события")
         if transactions:
-            for t in transactions[:5]:
+            for t in transactions:
                 if isinstance(t, dict):
                     user_data = t.get('user', {})
                     if isinstance(user_data, dict):
@@ -358,7 +433,7 @@ def main():
             
             if filtered_subs:
                 df_data = []
-                for sub in filtered_subs[:50]:
+                for sub in filtered_subs:
                     plan_price = sub.get('plan', {}).get('price', 0)
                     try:
                         if isinstance(plan_price, str):
@@ -379,6 +454,7 @@ def main():
                 
                 df = pd.DataFrame(df_data)
                 st.dataframe(df, use_container_width=True, hide_index=True)
+                load_more_button('admin_subscriptions', headers)
                 
                 st.subheader("Ручное управление")
                 selected_id = st.number_input("ID подписки для управления", min_value=1, value=1, key="sub_id_input")
@@ -393,6 +469,7 @@ def main():
                             )
                             if response.status_code == 200:
                                 st.success("Подписка продлена!")
+                                reset_list('admin_subscriptions', 'admin_transactions')
                                 st.rerun()
                             else:
                                 st.error(f"Ошибка: {response.text}")
@@ -433,7 +510,7 @@ def main():
                     except:
                         pass
             
-            col1.metric("Всего транзакций", len(transactions))
+            col1.metric("Загружено транзакций", len(transactions))
             col2.metric("Успешных", completed)
             col3.metric("Общая сумма", f"{total_amount:.2f} RUB")
             
@@ -451,7 +528,7 @@ def main():
             
             if filtered_trans:
                 df_data = []
-                for t in filtered_trans[:100]:
+                for t in filtered_trans:
                     user_data = t.get('user', {})
                     if isinstance(user_data, dict):
                         username = user_data.get('username', 'Unknown')
@@ -477,6 +554,7 @@ def main():
                 
                 df = pd.DataFrame(df_data)
                 st.dataframe(df, use_container_width=True, hide_index=True)
+                load_more_button('admin_transactions', headers)
                 
                 if st.button("Экспорт в CSV", key="export_csv"):
                     csv = df.to_csv(index=False).encode('utf-8')
@@ -556,6 +634,7 @@ def main():
         
         st.markdown("---")
         if st.button("Обновить все"):
+            reset_list('admin_subscriptions', 'admin_transactions')
             st.rerun()
         
         if st.button("Выйти"):
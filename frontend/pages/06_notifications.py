@@ -2,6 +2,8 @@ import streamlit as st
 import requests
 from datetime import datetime
 
+from api_client import load_list, load_more_button, reset_list, fetch_unread_count, unread_badge, wait_for_notifications
+
 API_BASE_URL = "http://127.0.0.1:8000/api"
 
 def get_auth_headers():
@@ -26,119 +28,129 @@ def main():
         return
     
     headers = get_auth_headers()
+    unread_badge(API_BASE_URL, headers)
     
     st.title("Мои уведомления")
     st.markdown("---")
     
-    # Загружаем уведомления пользователя
+    # Загружаем уведомления пользователя постранично
     try:
-        response = requests.get(
-            f"{API_BASE_URL}/subscriptions/notifications/",
-            headers=headers
-        )
+        notifications, has_more = load_list('notifications', f"{API_BASE_URL}/subscriptions/notifications/", headers)
+        
+        # Новые уведомления приходят из SSE-потока, список целиком не перезагружается
+        if st.button("Ждать новые уведомления"):
+            last_id = max((n.get('id', 0) for n in notifications), default=None)
+            with st.spinner("Ожидание уведомлений..."):
+                new_notifications = wait_for_notifications(API_BASE_URL, headers, last_id=last_id)
+            if new_notifications:
+                notifications[:0] = reversed(new_notifications)
+                st.rerun()
+            else:
+                st.info("Новых уведомлений нет")
         
-        if response.status_code == 200:
-            notifications = response.json()
+        if notifications:
+            # Фильтры
+            col1, col2 = st.columns(2)
+            with col1:
+                show_read = st.checkbox("Показывать прочитанные", value=False)
+            with col2:
+                notification_type = st.selectbox("Тип уведомления", ["Все", "payment_success", "payment_failed", "subscription_expiring"])
             
-            if notifications:
-                # Фильтры
-                col1, col2 = st.columns(2)
-                with col1:
-                    show_read = st.checkbox("Показывать прочитанные", value=False)
-                with col2:
-                    notification_type = st.selectbox("Тип уведомления", ["Все", "payment_success", "payment_failed", "subscription_expiring"])
+            # Применяем фильтры
+            filtered_notifications = notifications
+            if not show_read:
+                filtered_notifications = [n for n in filtered_notifications if not n.get('is_read')]
+            if notification_type != "Все":
+                filtered_notifications = [n for n in filtered_notifications if n.get('notification_type') == notification_type]
+            
+            # Счетчики: непрочитанные считает сервер, без загрузки всего списка
+            unread_count = fetch_unread_count(API_BASE_URL, headers)
+            total_text = f"{len(notifications)}+" if has_more else len(notifications)
+            st.info(f"У вас {unread_count} непрочитанных уведомлений (загружено {total_text})")
+            
+            # Отображаем уведомления
+            for notification in filtered_notifications:
+                # Определяем цвет и заголовок по типу
+                type_config = {
+                    'payment_success': {'color': '#4CAF50', 'title': 'Успешный платеж'},
+                    'payment_failed': {'color': '#F44336', 'title': 'Ошибка платежа'},
+                    'subscription_expiring': {'color': '#FF9800', 'title': 'Истечение подписки'},
+                    'subscription_canceled': {'color': '#9E9E9E', 'title': 'Отмена подписки'},
+                    'refund_processed': {'color': '#2196F3', 'title': 'Возврат средств'}
+                }
                 
-                # Применяем фильтры
-                filtered_notifications = notifications
-                if not show_read:
-                    filtered_notifications = [n for n in filtered_notifications if not n.get('is_read')]
-                if notification_type != "Все":
-                    filtered_notifications = [n for n in filtered_notifications if n.get('notification_type') == notification_type]
+                config = type_config.get(notification.get('notification_type', ''), {'color': '#757575', 'title': 'Уведомление'})
                 
-                # Счетчики
-                unread_count = len([n for n in notifications if not n.get('is_read')])
-                st.info(f"У вас {unread_count} непрочитанных уведомлений из {len(notifications)}")
+                # Стиль для уведомления
+                border_color = config['color']
+                background = '#FFFFFF' if notification.get('is_read') else '#F5F5F5'
                 
-                # Отображаем уведомления
-                for notification in filtered_notifications:
-                    # Определяем цвет и заголовок по типу
-                    type_config = {
-                        'payment_success': {'color': '#4CAF50', 'title': 'Успешный платеж'},
-                        'payment_failed': {'color': '#F44336', 'title': 'Ошибка платежа'},
-                        'subscription_expiring': {'color': '#FF9800', 'title': 'Истечение подписки'},
-                        'subscription_canceled': {'color': '#9E9E9E', 'title': 'Отмена подписки'},
-                        'refund_processed': {'color': '#2196F3', 'title': 'Возврат средств'}
-                    }
-                    
-                    config = type_config.get(notification.get('notification_type', ''), {'color': '#757575', 'title': 'Уведомление'})
-                    
-                    # Стиль для уведомления
-                    border_color = config['color']
-                    background = '#FFFFFF' if notification.get('is_read') else '#F5F5F5'
-                    
-                    col1, col2 = st.columns([6, 1])
-                    
-                    with col1:
-                        st.markdown(f"""
-                        <div style="
-                            border-left: 4px solid {border_color};
-                            background-color: {background};
-                            padding: 15px;
-                            margin: 10px 0;
-                            border-radius: 5px;
-                        ">
-                            <div style="display: flex; justify-content: space-between; align-items: center;">
-                                <div>
-                                    <strong style="color: {border_color};">{config['title']}</strong>
-                                    <p style="margin: 5px 0;">{notification.get('message', '')}</p>
-                                    <small style="color: #666;">
-                                        {datetime.fromisoformat(notification.get('created_at', '').replace('Z', '+00:00')).strftime('%d.%m.%Y %H:%M')}
-                                    </small>
-                                </div>
-                                {'<span style="color: #666; font-size: 12px;">Прочитано</span>' if notification.get('is_read') else ''}
+                col1, col2 = st.columns([6, 1])
+                
+                with col1:
+                    st.markdown(f"""
+                    <div style="
+                        border-left: 4px solid {border_color};
+                        background-color: {background};
+                        padding: 15px;
+                        margin: 10px 0;
+                        border-radius: 5px;
+                    ">
+                        <div style="display: flex; justify-content: space-between; align-items: center;">
+                            <div>
+                                <strong style="color: {border_color};">{config['title']}</strong>
+                                <p style="margin: 5px 0;">{notification.get('message', '')}</p>
+                                <small style="color: #666;">
+                                    {datetime.fromisoformat(notification.get('created_at', '').replace('Z', '+00:00')).strftime('%d.%m.%Y %H:%M')}
+                                </small>
                             </div>
+                            {'<span style="color: #666; font-size: 12px;">Прочитано</span>' if notification.get('is_read') else ''}
                         </div>
-                        """, unsafe_allow_html=True)
-                    
-                    with col2:
-                        if not notification.get('is_read'):
-                                if st.button("Прочитать", key=f"read_{notification.get('id')}"):
-                                    try:
-                                        # ИСПРАВЛЕНО: изменен путь на 'mark-as-read'
-                                        mark_response = requests.post(
-                                            f"{API_BASE_URL}/subscriptions/notifications/{notification.get('id')}/mark-as-read/",
-                                            headers=headers
-                                        )
-                                        if mark_response.status_code == 200:
-                                            st.rerun() # Страница обновится и уведомление станет "прочитанным"
-                                        else:
-                                            st.error(f"Ошибка: {mark_response.status_code}")
-                                    except Exception as e:
-                                        st.error(f"Ошибка соединения: {e}")
+                    </div>
+                    """, unsafe_allow_html=True)
                 
-                # Кнопки действий
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button("Отметить все как прочитанные", use_container_width=True):
-                        try:
-                            # ИСПРАВЛЕНО: маршурт mark-all-as-read 
-                            res = requests.post(
-                                f"{API_BASE_URL}/subscriptions/notifications/mark-all-as-read/",
-                                headers=headers
-                            )
-                            if res.status_code == 200:
-                                st.success("Все уведомления прочитаны")
-                                st.rerun()
-                        except Exception as e:
-                            st.error(f"Ошибка: {e}")    
                 with col2:
-                    if st.button("Удалить прочитанные", use_container_width=True):
-                        st.info("Функция будет реализована")
-            else:
-                st.success("У вас нет непрочитанных уведомлений!")
-                st.info("Здесь будут появляться уведомления о статусе ваших подписок и платежей.")
+                    if not notification.get('is_read'):
+                            if st.button("Прочитать", key=f"read_{notification.get('id')}"):
+                                try:
+                                    # ИСПРАВЛЕНО: изменен путь на 'mark-as-read'
+                                    mark_response = requests.post(
+                                        f"{API_BASE_URL}/subscriptions/notifications/{notification.get('id')}/mark-as-read/",
+                                        headers=headers
+                                    )
+                                    if mark_response.status_code == 200:
+                                        # Загруженные страницы не перечитываем - меняем запись на месте
+                                        notification['is_read'] = True
+                                        st.rerun() # Страница обновится и уведомление станет "прочитанным"
+                                    else:
+                                        st.error(f"Ошибка: {mark_response.status_code}")
+                                except Exception as e:
+                                    st.error(f"Ошибка соединения: {e}")
+            
+            load_more_button('notifications', headers)
+            
+            # Кнопки действий
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("Отметить все как прочитанные", use_container_width=True):
+                    try:
+                        # ИСПРАВЛЕНО: маршурт mark-all-as-read 
+                        res = requests.post(
+                            f"{API_BASE_URL}/subscriptions/notifications/mark-all-as-read/",
+                            headers=headers
+                        )
+                        if res.status_code == 200:
+                            st.success("Все уведомления прочитаны")
+                            reset_list('notifications')
+                            st.rerun()
+                    except Exception as e:
+                        st.error(f"Ошибка: {e}")    
+            with col2:
+                if st.button("Удалить прочитанные", use_container_width=True):
+                    st.info("Функция будет реализована")
         else:
-            st.error("Ошибка загрузки уведомлений")
+            st.success("У вас нет непрочитанных уведомлений!")
+            st.info("Здесь будут появляться уведомления о статусе ваших подписок и платежей.")
     except Exception as e:
         st.error(f"Ошибка: {e}")
     
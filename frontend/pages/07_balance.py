@@ -2,6 +2,8 @@ import streamlit as st
 import requests
 from datetime import datetime
 
+from api_client import load_list, load_more_button, reset_list, post_idempotent
+
 API_BASE_URL = "http://127.0.0.1:8000/api"
 
 def get_auth_headers():
@@ -114,9 +116,9 @@ def main():
                     else:
                         with st.spinner("Обработка платежа..."):
                             # ИСПРАВЛЕННЫЙ ПУТЬ: /auth/deposit/ вместо /users/deposit/
-                            deposit_response = requests.post(
+                            deposit_response = post_idempotent(
                                 f"{API_BASE_URL}/auth/deposit/",
-                                headers=headers,
+                                headers,
                                 json={"amount": float(amount)}
                             )
                             
@@ -132,6 +134,7 @@ def main():
                                     st.info(f"ID транзакции: `{deposit_data.get('transaction_id')}`")
                                 
                                 # Обновляем страницу
+                                reset_list('transactions')
                                 st.rerun()
                             else:
                                 try:
@@ -236,87 +239,78 @@ def main():
             # История транзакций
             st.subheader("История операций")
             
-            # Получаем транзакции
-            transactions_response = requests.get(
-                f"{API_BASE_URL}/subscriptions/transactions/",
-                headers=headers
-            )
+            # Получаем транзакции постранично
+            transactions, _ = load_list('transactions', f"{API_BASE_URL}/subscriptions/transactions/", headers)
             
-            if transactions_response.status_code == 200:
-                transactions = transactions_response.json()
+            if transactions:
+                # Фильтры
+                col_filter1, col_filter2 = st.columns(2)
+                with col_filter1:
+                    transaction_type = st.selectbox(
+                        "Тип операции",
+                        ["Все", "deposit", "subscription_purchase", "subscription_renewal", "refund", "subscription_auto_renewal"],
+                        key="transaction_type_filter"
+                    )
+                
+                # Применяем фильтры
+                filtered_transactions = transactions
+                if transaction_type != "Все":
+                    filtered_transactions = [t for t in transactions if t.get('transaction_type') == transaction_type]
                 
-                if transactions:
-                    # Фильтры
-                    col_filter1, col_filter2 = st.columns(2)
-                    with col_filter1:
-                        transaction_type = st.selectbox(
-                            "Тип операции",
-                            ["Все", "deposit", "subscription_purchase", "subscription_renewal", "refund", "subscription_auto_renewal"],
-                            key="transaction_type_filter"
-                        )
+                # Показываем транзакции
+                for transaction in filtered_transactions:
+                    # Определяем цвет и заголовок по типу
+                    type_config = {
+                        'deposit': {'color': '#4CAF50', 'title': 'Пополнение'},
+                        'subscription_purchase': {'color': '#2196F3', 'title': 'Покупка подписки'},
+                        'subscription_renewal': {'color': '#FF9800', 'title': 'Продление подписки'},
+                        'subscription_auto_renewal': {'color': '#FF5722', 'title': 'Автопродление'},
+                        'refund': {'color': '#9C27B0', 'title': 'Возврат средств'}
+                    }
                     
-                    # Применяем фильтры
-                    filtered_transactions = transactions
-                    if transaction_type != "Все":
-                        filtered_transactions = [t for t in transactions if t.get('transaction_type') == transaction_type]
+                    config = type_config.get(
+                        transaction.get('transaction_type', ''),
+                        {'color': '#757575', 'title': 'Операция'}
+                    )
                     
-                    # Показываем транзакции
-                    for transaction in filtered_transactions[:20]:
-                        # Определяем цвет и заголовок по типу
-                        type_config = {
-                            'deposit': {'color': '#4CAF50', 'title': 'Пополнение'},
-                            'subscription_purchase': {'color': '#2196F3', 'title': 'Покупка подписки'},
-                            'subscription_renewal': {'color': '#FF9800', 'title': 'Продление подписки'},
-                            'subscription_auto_renewal': {'color': '#FF5722', 'title': 'Автопродление'},
-                            'refund': {'color': '#9C27B0', 'title': 'Возврат средств'}
-                        }
-                        
-                        config = type_config.get(
-                            transaction.get('transaction_type', ''),
-                            {'color': '#757575', 'title': 'Операция'}
-                        )
-                        
-                        # Форматируем дату
-                        try:
-                            created_at = datetime.fromisoformat(
-                                transaction.get('created_at', '').replace('Z', '+00:00')
-                            ).strftime('%d.%m.%Y %H:%M')
-                        except:
-                            created_at = transaction.get('created_at', '')
-                        
-                        # Определяем цвет суммы
-                        amount_color = '#4CAF50' if transaction.get('transaction_type') == 'deposit' else '#F44336'
-                        amount_sign = '+' if transaction.get('transaction_type') == 'deposit' else '-'
-                        
-                        # Отображаем транзакцию
-                        col1, col2, col3 = st.columns([2, 2, 1])
-                        
-                        with col1:
-                            st.markdown(f"**{config['title']}**")
-                            st.caption(f"{created_at}")
-                        
-                        with col2:
-                            description = transaction.get('description', '')
-                            if len(description) > 50:
-                                description = description[:50] + "..."
-                            st.write(description)
-                        
-                        with col3:
-                            st.markdown(f"<span style='color:{amount_color}; font-weight:bold;'>{amount_sign}{transaction.get('amount')} руб.</span>", 
-                                      unsafe_allow_html=True)
-                            
-                            status_text = transaction.get('status', 'unknown')
-                            status_display = "Выполнено" if transaction.get('status') == 'completed' else "В процессе"
-                            st.caption(f"{status_display}")
+                    # Форматируем дату
+                    try:
+                        created_at = datetime.fromisoformat(
+                            transaction.get('created_at', '').replace('Z', '+00:00')
+                        ).strftime('%d.%m.%Y %H:%M')
+                    except:
+                        created_at = transaction.get('created_at', '')
+                    
+                    # Определяем цвет суммы
+                    amount_color = '#4CAF50' if transaction.get('transaction_type') == 'deposit' else '#F44336'
+                    amount_sign = '+' if transaction.get('transaction_type') == 'deposit' else '-'
+                    
+                    # Отображаем транзакцию
+                    col1, col2, col3 = st.columns([2, 2, 1])
+                    
+                    with col1:
+                        st.markdown(f"**{config['title']}**")
+                        st.caption(f"{created_at}")
+                    
+                    with col2:
+                        description = transaction.get('description', '')
+                        if len(description) > 50:
+                            description = description[:50] + "..."
+                        st.write(description)
+                    
+                    with col3:
+                        st.markdown(f"<span style='color:{amount_color}; font-weight:bold;'>{amount_sign}{transaction.get('amount')} руб.</span>", 
+                                  unsafe_allow_html=True)
                         
-                        st.divider()
+                        status_text = transaction.get('status', 'unknown')
+                        status_display = "Выполнено" if transaction.get('status') == 'completed' else "В процессе"
+                        st.caption(f"{status_display}")
                     
-                    if len(filtered_transactions) > 20:
-                        st.info(f"Показаны последние 20 операций из {len(filtered_transactions)}")
-                else:
-                    st.info("У вас пока нет операций. Пополните баланс или купите первую подписку!")
+                    st.divider()
+                
+                load_more_button('transactions', headers)
             else:
-                st.error("Ошибка загрузки истории операций")
+                st.info("У вас пока нет операций. Пополните баланс или купите первую подписку!")
                 
         else:
             st.error("Ошибка загрузки баланса")
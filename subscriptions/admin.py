@@ -2,7 +2,11 @@ from django.contrib import admin
 
 # Register your models here.
 
-from .models import SubscriptionPlan, UserSubscription, Transaction, PromoCode, RefundPolicy
+from .models import (
+    SubscriptionPlan, UserSubscription, Transaction, PromoCode, RefundPolicy,
+    DailyRevenueRollup, FailedPayment, IdempotencyKey, BalanceReconciliation,
+    PromoCodeShard, PromoRedemption, OutboundEmail, ExpirationReminder
+)
 
 @admin.register(SubscriptionPlan)
 class SubscriptionPlanAdmin(admin.ModelAdmin):
@@ -32,4 +36,51 @@ class PromoCodeAdmin(admin.ModelAdmin):
 
 @admin.register(RefundPolicy)
 class RefundPolicyAdmin(admin.ModelAdmin):
-    list_display = ('name', 'full_refund_days', 'partial_refund_enabled')
\ No newline at end of file
+    list_display = ('name', 'full_refund_days', 'partial_refund_enabled')
+
+@admin.register(DailyRevenueRollup)
+class DailyRevenueRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'plan', 'transaction_type', 'status', 'count', 'amount')
+    list_filter = ('transaction_type', 'status', 'plan')
+    date_hierarchy = 'day'
+
+@admin.register(FailedPayment)
+class FailedPaymentAdmin(admin.ModelAdmin):
+    list_display = ('subscription', 'user', 'amount', 'attempt_count', 'next_attempt', 'status')
+    list_filter = ('status',)
+    search_fields = ('user__username',)
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ('user', 'key', 'status', 'response_status', 'created_at', 'expires_at')
+    list_filter = ('status',)
+    search_fields = ('user__username', 'key')
+
+@admin.register(BalanceReconciliation)
+class BalanceReconciliationAdmin(admin.ModelAdmin):
+    list_display = ('user', 'stored_balance', 'expected_balance', 'drift', 'checked_at')
+    list_filter = ('has_drift',)
+    search_fields = ('user__username',)
+
+@admin.register(PromoCodeShard)
+class PromoCodeShardAdmin(admin.ModelAdmin):
+    list_display = ('promo', 'shard', 'used_count', 'capacity')
+    list_filter = ('promo',)
+
+@admin.register(PromoRedemption)
+class PromoRedemptionAdmin(admin.ModelAdmin):
+    list_display = ('promo', 'user', 'subscription', 'shard', 'created_at')
+    list_filter = ('promo',)
+    search_fields = ('user__username', 'promo__code')
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('to_email', 'subject', 'status', 'attempt_count', 'next_attempt', 'sent_at')
+    list_filter = ('status', 'template_name')
+    search_fields = ('to_email', 'subject')
+
+@admin.register(ExpirationReminder)
+class ExpirationReminderAdmin(admin.ModelAdmin):
+    list_display = ('subscription', 'user', 'end_date', 'horizon_days', 'sent_at')
+    list_filter = ('horizon_days',)
+    search_fields = ('user__username',)
@@ -1,11 +1,14 @@
 from background_task import background
-from django.utils import timezone
-from django.db import transaction
-from datetime import timedelta
+from background_task.tasks import TaskSchedule
 import logging
-from .models import UserSubscription, Transaction
-from users.models import User, Notification
-from .payment_gateway import FakePaymentGateway
+from .renewal_engine import run_renewals, renew_pending_for_user, retry_due_payments
+from .expiry import expire_overdue_subscriptions
+from .rollup import update_rollup
+from .idempotency import purge_expired_keys
+from .reconciliation import run_reconciliation
+from .email_queue import drain_queue, purge_sent
+from .reminders import send_expiration_reminders
+from .purchases import sweep_stale_purchases
 
 logger = logging.getLogger(__name__)
 
@@ -14,73 +17,55 @@ def check_subscription_renewals():
     """Проверяет и продлевает подписки"""
     logger.info("Запуск автоматической проверки продления подписок...")
     
-    # Ищем подписки, которые скоро закончатся (за 24 часа) 
-    # ИЛИ уже находятся в статусе ожидания денег
-    renewal_window = timezone.now() + timedelta(hours=24)
-    
-    subscriptions = UserSubscription.objects.filter(
-        status__in=['active', 'pending_renewal'],
-        auto_renew=True,
-        end_date__lte=renewal_window
-    ).select_related('user', 'plan')
-    
-    for sub in subscriptions:
-        try:
-            with transaction.atomic():
-                # Блокируем запись пользователя для безопасности баланса
-                user = User.objects.select_for_update().get(id=sub.user.id)
-                plan = sub.plan
-
-                if user.balance < plan.price:
-                    if sub.status != 'pending_renewal':
-                        sub.status = 'pending_renewal'
-                        sub.save()
-                        Notification.objects.create(
-                            user=user,
-                            notification_type='payment_failed',
-                            title='Недостаточно средств',
-                            message=f'Для продления "{plan.name}" нужно {plan.price} руб. Пополните баланс.'
-                        )
-                    continue
+    # Подписки, которые скоро закончатся (за 24 часа) или ждут пополнения баланса,
+    # обрабатываются шардами по user_id параллельно
+    run_renewals()
 
-                # Имитация платежа
-                payment_result = FakePaymentGateway.process_payment(float(plan.price), user.id)
-                
-                if payment_result['success']:
-                    user.balance -= plan.price
-                    user.save()
-                    
-                    # Продлеваем от даты окончания или от текущей (если уже просрочена)
-                    base_date = max(sub.end_date, timezone.now())
-                    sub.end_date = base_date + timedelta(days=plan.duration_days)
-                    sub.status = 'active'
-                    sub.save()
+# CHECK_EXISTING: если задача для этого пользователя уже ждет в очереди,
+# повторное пополнение не ставит вторую
+@background(schedule={'action': TaskSchedule.CHECK_EXISTING})
+def activate_pending_renewals(user_id):
+    """Продлевает подписки пользователя, ждавшие пополнения баланса"""
+    return len(renew_pending_for_user(user_id))
 
-                    Transaction.objects.create(
-                        user=user,
-                        subscription=sub,
-                        amount=plan.price,
-                        transaction_type='subscription_renewal',
-                        status='completed',
-                        description=f'Автопродление: {plan.name}'
-                    )
+@background(schedule=60 * 60 * 24)
+def send_expiration_notifications():
+    """Напоминает об окончании подписок (одно уведомление и письмо на пользователя)"""
+    return send_expiration_reminders()['reminders']
 
-                    Notification.objects.create(
-                        user=user,
-                        notification_type='payment_success',
-                        title='Подписка продлена',
-                        message=f'Подписка "{plan.name}" успешно продлена до {sub.end_date.strftime("%d.%m.%Y")}.'
-                    )
-        except Exception as e:
-            logger.error(f"Ошибка в задаче продления для ID {sub.id}: {e}")
+@background(schedule=60 * 5)
+def retry_failed_payments():
+    """Повторяет наступившие платежи из очереди неудачных"""
+    return retry_due_payments()
 
 @background(schedule=60 * 60)
 def close_expired_subscriptions():
     """Закрывает те, что так и не были оплачены и срок вышел"""
-    expired = UserSubscription.objects.filter(
-        status__in=['active', 'pending_renewal'],
-        end_date__lt=timezone.now()
-    )
-    for sub in expired:
-        sub.status = 'expired'
-        sub.save()
\ No newline at end of file
+    return expire_overdue_subscriptions()
+
+@background(schedule=60 * 5)
+def sweep_pending_purchases():
+    """Возвращает резерв покупок, которые не завершились (упал процесс или запрос)"""
+    return sweep_stale_purchases()
+
+@background(schedule=60 * 10)
+def update_revenue_rollup():
+    """Досчитывает дневную сводку выручки по измененным транзакциям"""
+    return update_rollup()
+
+@background(schedule=60 * 60)
+def purge_idempotency_keys():
+    """Удаляет просроченные ключи идемпотентности"""
+    return purge_expired_keys()
+
+@background(schedule=60 * 60 * 24)
+def reconcile_balances():
+    """Сверяет балансы пользователей с журналом транзакций (только изменения)"""
+    return run_reconciliation()['drifted']
+
+@background(schedule=60)
+def deliver_outbound_emails():
+    """Отправляет письма из очереди через одно SMTP-соединение на пачку"""
+    report = drain_queue()
+    purge_sent()
+    return report['sent']
@@ -0,0 +1,205 @@
+"""
+Кеш тарифов и промокодов: они меняются редко, а читаются на каждой покупке
+и в каталоге. Чтение идет по цепочке: LRU в памяти процесса -> общий кеш
+(если задан CATALOG_CACHE_ALIAS) -> БД. Сигналы save/delete сбрасывают кеш
+(см. signals.py). Отсутствие записи тоже кешируется.
+
+Наружу отдаются копии объектов: вызывающий код может менять их, не портя кеш.
+"""
+from collections import OrderedDict
+import copy
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import SubscriptionPlan, PromoCode
+
+logger = logging.getLogger(__name__)
+
+PLANS = 'plans'
+PROMOS = 'promos'
+
+_MISSING = object()
+_VERSION_KEY = 'catalog_cache:version:{kind}'
+
+
+def get_local_size():
+    return max(1, getattr(settings, 'CATALOG_CACHE_SIZE', 1024))
+
+
+def get_local_ttl():
+    """
+    Сколько живет запись LRU. Сигналы сбрасывают LRU только в своем процессе,
+    поэтому при нескольких процессах это предел устаревания.
+    """
+    return getattr(settings, 'CATALOG_CACHE_LOCAL_TTL', 60)
+
+
+def get_shared_ttl():
+    return getattr(settings, 'CATALOG_CACHE_SHARED_TTL', 3600)
+
+
+def get_shared_cache():
+    """Общий кеш (Redis/Memcached из CACHES) или None - только память процесса"""
+    alias = getattr(settings, 'CATALOG_CACHE_ALIAS', None)
+    return caches[alias] if alias else None
+
+
+class LRUCache:
+    """LRU с ограничением размера и временем жизни записей; потокобезопасен"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return _MISSING
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self, kind=None):
+        with self._lock:
+            if kind is None:
+                self._data.clear()
+                return
+            for key in [key for key in self._data if key[0] == kind]:
+                del self._data[key]
+
+
+_local = LRUCache(get_local_size(), get_local_ttl())
+_stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _shared_key(shared, kind, key):
+    # Версия вида сдвигается при сбросе: старые ключи других процессов
+    # перестают читаться без перебора
+    version = shared.get(_VERSION_KEY.format(kind=kind), 0)
+    return f"catalog_cache:{kind}:{version}:{key}"
+
+
+def _lookup(kind, key, load):
+    value = _local.get((kind, key))
+    if value is not _MISSING:
+        _count('local_hits')
+        return value
+
+    shared = get_shared_cache()
+    shared_key = _shared_key(shared, kind, key) if shared else None
+    if shared:
+        value = shared.get(shared_key, _MISSING)
+        if value is not _MISSING:
+            _count('shared_hits')
+            _local.set((kind, key), value)
+            return value
+
+    _count('misses')
+    value = load()
+    _local.set((kind, key), value)
+    if shared:
+        shared.set(shared_key, value, get_shared_ttl())
+    return value
+
+
+def _load_one(queryset, **lookup):
+    return queryset.filter(**lookup).first()
+
+
+def get_plan(plan_id):
+    """Активный тариф по id или None"""
+    plan = _lookup(PLANS, f'id:{plan_id}', lambda: _load_one(
+        SubscriptionPlan.objects.filter(is_active=True), id=plan_id
+    ))
+    return copy.copy(plan)
+
+
+def get_active_plans():
+    plans = _lookup(PLANS, 'active', lambda: list(SubscriptionPlan.objects.filter(is_active=True).order_by('id')))
+    return [copy.copy(plan) for plan in plans]
+
+
+def _promo_key(code):
+    return f'code:{code}'
+
+
+def get_promo(code):
+    """Активный промокод по коду или None (срок и лимит проверяет promo.is_valid())"""
+    promo = _lookup(PROMOS, _promo_key(code), lambda: _load_one(
+        PromoCode.objects.filter(is_active=True), code=code
+    ))
+    return copy.copy(promo)
+
+
+def get_active_promos():
+    promos = _lookup(PROMOS, 'active', lambda: list(PromoCode.objects.filter(is_active=True).order_by('id')))
+    return [copy.copy(promo) for promo in promos]
+
+
+def invalidate(kind):
+    """Сбрасывает все закешированные записи вида kind (PLANS или PROMOS)"""
+    _local.clear(kind)
+    shared = get_shared_cache()
+    if shared:
+        version_key = _VERSION_KEY.format(kind=kind)
+        shared.add(version_key, 0, None)
+        shared.incr(version_key)
+    logger.debug(f"Кеш каталога сброшен: {kind}")
+
+
+def invalidate_promo(code):
+    """
+    Сбрасывает только промокод code и список активных: при погашении меняется
+    счетчик одного кода, остальные записи PROMOS остаются в кеше
+    """
+    shared = get_shared_cache()
+    for key in (_promo_key(code), 'active'):
+        _local.discard((PROMOS, key))
+        if shared:
+            shared.delete(_shared_key(shared, PROMOS, key))
+    logger.debug(f"Кеш каталога сброшен: промокод {code}")
+
+
+def cache_stats():
+    """Счетчики попаданий с момента запуска процесса"""
+    with _stats_lock:
+        stats = dict(_stats)
+    total = sum(stats.values())
+    hits = stats['local_hits'] + stats['shared_hits']
+    stats['hit_rate_percent'] = round(hits / total * 100, 1) if total else 0.0
+    return stats
+
+
+def reset_cache():
+    """Очищает LRU и счетчики (для тестов и ручного сброса)"""
+    _local.clear()
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
@@ -0,0 +1,86 @@
+"""
+Условные GET (ETag / Last-Modified) для часто опрашиваемых списков.
+Валидаторы считаются дешевым агрегатом - count и max(updated_at) - без
+сериализации; на совпавший If-None-Match / If-Modified-Since отдается 304,
+и сериализатор не вызывается вовсе.
+"""
+from functools import reduce
+import hashlib
+
+from django.db.models import Count, Max, QuerySet
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest())
+
+
+def _attr(obj, path):
+    return reduce(lambda value, name: getattr(value, name, None), path.split('__'), obj)
+
+
+def compute_validators(objects, fields=('updated_at',)):
+    """
+    (etag, last_modified) для queryset (один агрегирующий запрос) или списка
+    уже загруженных объектов. Количество в ETag ловит удаления.
+    """
+    if isinstance(objects, QuerySet):
+        aggregates = {f'last_{i}': Max(field) for i, field in enumerate(fields)}
+        row = objects.order_by().aggregate(count=Count('pk'), **aggregates)
+        count = row['count']
+        stamps = [row[f'last_{i}'] for i in range(len(fields))]
+    else:
+        count = len(objects)
+        stamps = [max((_attr(obj, field) for obj in objects if _attr(obj, field)), default=None) for field in fields]
+
+    known = [stamp for stamp in stamps if stamp is not None]
+    last_modified = max(known) if known else None
+    etag = make_etag(count, *(stamp.isoformat() if stamp else '' for stamp in stamps))
+    return etag, last_modified
+
+
+def not_modified(request, etag, last_modified=None):
+    """Ответ 304, если у клиента актуальная версия, иначе None"""
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Клиент может хранить ответ, но каждый раз должен перепроверять его
+    response['Cache-Control'] = 'private, no-cache'
+    # Ответ зависит от пользователя: кеш не должен отдать его с чужим токеном
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+def conditional(request, etag, last_modified, render):
+    """304 по валидаторам или render() с проставленными ETag / Last-Modified"""
+    response = not_modified(request, etag, last_modified)
+    if response is None:
+        response = render()
+        if response.status_code != 200:
+            return response
+    return set_validators(response, etag, last_modified)
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified и Vary: Authorization для list и retrieve вьюсета.
+    etag_fields - поля с временем изменения, включая связанные
+    (например 'plan__updated_at'), если их данные попадают в ответ.
+    """
+    etag_fields = ('updated_at',)
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = compute_validators(self.filter_queryset(self.get_queryset()), self.etag_fields)
+        return conditional(request, etag, last_modified, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag, last_modified = compute_validators([instance], self.etag_fields)
+        return conditional(request, etag, last_modified, lambda: Response(self.get_serializer(instance).data))
@@ -0,0 +1,201 @@
+"""
+Очередь исходящих писем (OutboundEmail). Запросы и задачи только сохраняют
+письмо в БД, SMTP в их время ответа не входит. Воркер забирает наступившие
+письма пачкой (с арендой, как очередь повторов платежей), отправляет их через
+одно открытое соединение get_connection() и соблюдает лимит писем в секунду.
+Неудачные попытки повторяются с растущей задержкой.
+
+Доставка "хотя бы один раз": если воркер упадет между отправкой и отметкой,
+письмо уйдет повторно после окончания аренды.
+"""
+from datetime import timedelta
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def get_batch_size():
+    return max(1, getattr(settings, 'EMAIL_QUEUE_BATCH_SIZE', 100))
+
+
+def get_max_per_run():
+    return max(1, getattr(settings, 'EMAIL_QUEUE_MAX_PER_RUN', 1000))
+
+
+def get_rate_limit():
+    """Писем в секунду; 0 - без ограничения"""
+    return getattr(settings, 'EMAIL_QUEUE_RATE_PER_SECOND', 10)
+
+
+def get_max_attempts():
+    return max(1, getattr(settings, 'EMAIL_QUEUE_MAX_ATTEMPTS', 5))
+
+
+def get_claim_delay():
+    return timedelta(seconds=getattr(settings, 'EMAIL_QUEUE_CLAIM_SECONDS', 300))
+
+
+def get_backend():
+    """Бэкенд отправки; None - EMAIL_BACKEND (в тестах можно console/filebased/locmem)"""
+    return getattr(settings, 'EMAIL_QUEUE_BACKEND', None)
+
+
+def retry_delay(attempt):
+    """Задержка перед попыткой номер attempt + 1"""
+    base = getattr(settings, 'EMAIL_QUEUE_RETRY_BASE_SECONDS', 60)
+    delay = min(6 * 3600, base * 2 ** (attempt - 1))
+    return timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+def enqueue(to_email, subject, body_text, body_html='', template_name=''):
+    """Ставит письмо в очередь. Внутри транзакции письмо уйдет только после ее коммита"""
+    return OutboundEmail.objects.create(
+        to_email=to_email,
+        subject=subject,
+        body_text=body_text,
+        body_html=body_html,
+        template_name=template_name,
+    )
+
+
+def enqueue_many(emails):
+    """Ставит в очередь список OutboundEmail пачками bulk_create. Возвращает их число"""
+    emails = list(emails)
+    OutboundEmail.objects.bulk_create(emails, batch_size=get_batch_size())
+    return len(emails)
+
+
+def claim_batch(now=None, limit=None):
+    """Забирает до limit наступивших писем и сдвигает их на время аренды"""
+    now = now or timezone.now()
+    limit = limit or get_batch_size()
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects.filter(status='pending', next_attempt__lte=now)
+            .select_for_update(skip_locked=True)
+            .order_by('next_attempt')[:limit]
+        )
+        if emails:
+            OutboundEmail.objects.filter(id__in=[email.id for email in emails]).update(
+                next_attempt=now + get_claim_delay()
+            )
+    return emails
+
+
+def build_message(email, connection):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body_text,
+        to=[email.to_email],
+        connection=connection,
+    )
+    if email.body_html:
+        message.attach_alternative(email.body_html, 'text/html')
+    return message
+
+
+def _record_failure(email, error):
+    attempt = email.attempt_count + 1
+    fields = {'attempt_count': attempt, 'last_error': str(error)[:1000]}
+    if attempt >= get_max_attempts():
+        fields['status'] = 'failed'
+        logger.error(f"Письмо {email.id} для {email.to_email} не отправлено: {error}")
+    else:
+        fields['next_attempt'] = timezone.now() + retry_delay(attempt)
+    OutboundEmail.objects.filter(id=email.id).update(**fields)
+
+
+def send_batch(emails, connection, throttle=None):
+    """
+    Отправляет письма через одно соединение. Каждое письмо - отдельный
+    send_messages, чтобы ошибка одного не помечала всю пачку; после ошибки
+    соединение сразу переоткрывается, и остаток пачки идет через него.
+    Если переоткрыть не удалось, остаток вернется в очередь по окончании аренды.
+    Возвращает (отправлено, ошибок).
+    """
+    sent_ids = []
+    failed = 0
+    for email in emails:
+        if throttle:
+            throttle()
+        try:
+            connection.send_messages([build_message(email, connection)])
+            sent_ids.append(email.id)
+        except Exception as e:
+            failed += 1
+            _record_failure(email, e)
+            # Закрытое соединение send_messages открывал бы заново на каждое письмо
+            try:
+                connection.close()
+                connection.open()
+            except Exception as reopen_error:
+                logger.warning(f"Не удалось переоткрыть соединение для писем: {reopen_error}")
+                break
+
+    if sent_ids:
+        OutboundEmail.objects.filter(id__in=sent_ids).update(
+            status='sent', sent_at=timezone.now(), attempt_count=F('attempt_count') + 1
+        )
+    return len(sent_ids), failed
+
+
+def _throttle(rate):
+    """Функция-пауза, выдерживающая не больше rate вызовов в секунду"""
+    if not rate:
+        return None
+    interval = 1.0 / rate
+    next_slot = [time.monotonic()]
+
+    def wait():
+        now = time.monotonic()
+        if next_slot[0] > now:
+            time.sleep(next_slot[0] - now)
+        next_slot[0] = max(next_slot[0], now) + interval
+    return wait
+
+
+def drain_queue(limit=None, now=None):
+    """
+    Отправляет наступившие письма пачками, пока очередь не опустеет или не будет
+    отправлено limit писем (по умолчанию EMAIL_QUEUE_MAX_PER_RUN).
+    """
+    limit = limit or get_max_per_run()
+    throttle = _throttle(get_rate_limit())
+    report = {'sent': 0, 'failed': 0, 'batches': 0}
+
+    connection = get_connection(get_backend(), fail_silently=False)
+    try:
+        while report['sent'] + report['failed'] < limit:
+            emails = claim_batch(now, min(get_batch_size(), limit - report['sent'] - report['failed']))
+            if not emails:
+                break
+            connection.open()
+            sent, failed = send_batch(emails, connection, throttle)
+            report['sent'] += sent
+            report['failed'] += failed
+            report['batches'] += 1
+    finally:
+        connection.close()
+
+    if report['batches']:
+        logger.info(f"Очередь писем: отправлено {report['sent']}, ошибок {report['failed']}, пачек {report['batches']}")
+    return report
+
+
+def purge_sent(days=None):
+    """Удаляет отправленные письма старше EMAIL_QUEUE_KEEP_SENT_DAYS дней"""
+    days = days if days is not None else getattr(settings, 'EMAIL_QUEUE_KEEP_SENT_DAYS', 7)
+    deleted, _ = OutboundEmail.objects.filter(
+        status='sent', sent_at__lt=timezone.now() - timedelta(days=days)
+    ).delete()
+    return deleted
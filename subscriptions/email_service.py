@@ -1,133 +1,120 @@
-from django.core.mail import send_mail
-from django.conf import settings
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from django.utils import timezone
 import logging
 
+from .email_queue import enqueue, enqueue_many, get_batch_size
+from .email_templates import get_email_template, DEFAULT_TEMPLATE
+from .models import OutboundEmail
+
 logger = logging.getLogger(__name__)
 
+def _template_context(template, context):
+    # Общий шаблон выводит все поля контекста списком деталей
+    if template.name == DEFAULT_TEMPLATE and 'details' not in context:
+        return dict(context, details=[(key, value) for key, value in context.items() if key not in ('message', 'subject')])
+    return context
+
 def send_email_notification(user_email, subject, template_name, context):
+    """
+    Ставит письмо в очередь (OutboundEmail), отправляет его воркер - SMTP
+    не входит во время ответа. В разработке воркер пишет письма в консоль.
+    subject=None - тема из шаблона.
+    """
     try:
-        # в разработке выводим в консоль
-        if settings.DEBUG:
-            logger.info(f"Email для {user_email}: {subject}")
-            logger.info(f"Контекст: {context}")
-            return True
-        
-        # пробуем отправить реальный email
-        html_message = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 10px;">
-                <div style="background-color: #4CAF50; color: white; padding: 15px; border-radius: 10px 10px 0 0; text-align: center;">
-                    <h1>Subscription System</h1>
-                </div>
-                <div style="padding: 20px;">
-                    <h2>{subject}</h2>
-                    <div style="margin: 20px 0;">
-                        {context.get('message', '')}
-                    </div>
-                    <div style="margin-top: 30px; padding: 15px; background-color: #f9f9f9; border-radius: 5px;">
-                        <h3>Детали:</h3>
-                        <ul>
-        """
-        
-        for key, value in context.items():
-            if key != 'message':
-                html_message += f"<li><strong>{key}:</strong> {value}</li>"
-        
-        html_message += """
-                        </ul>
-                    </div>
-                    <div style="margin-top: 30px; text-align: center; color: #666; font-size: 12px;">
-                        <p>Это автоматическое сообщение. Пожалуйста, не отвечайте на него.</p>
-                        <p>Subscription System © 2025</p>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        plain_message = strip_tags(html_message)
-        
-        send_mail(
+        template = get_email_template(template_name)
+        if subject:
+            context = dict(context, subject=subject)
+        subject, body_text, body_html = template.render(_template_context(template, context))
+
+        enqueue(
+            to_email=user_email,
             subject=subject,
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user_email],
-            html_message=html_message,
-            fail_silently=False,
+            body_text=body_text,
+            body_html=body_html,
+            template_name=template.name,
         )
-        
-        logger.info(f"Email отправлен: {user_email} - {subject}")
+
+        logger.info(f"Email поставлен в очередь: {user_email} - {subject}")
         return True
-        
+
     except Exception as e:
-        logger.error(f"Ошибка отправки email: {e}")
+        logger.error(f"Ошибка постановки email в очередь: {e}")
         return False
 
+def send_bulk_email(template_name, recipients):
+    """
+    Ставит в очередь одно письмо многим получателям: recipients - итерируемое
+    (email, context). Рендер и bulk_create идут пачками по EMAIL_QUEUE_BATCH_SIZE,
+    поэтому память не растет с числом получателей. Возвращает число писем.
+    """
+    template = get_email_template(template_name)
+    batch_size = get_batch_size()
+    total = 0
+    batch = []
+
+    def flush():
+        rendered = template.render_many([_template_context(template, context) for _, context in batch])
+        return enqueue_many(
+            OutboundEmail(
+                to_email=email,
+                subject=subject,
+                body_text=body_text,
+                body_html=body_html,
+                template_name=template.name,
+            )
+            for (email, _), (subject, body_text, body_html) in zip(batch, rendered)
+        )
+
+    for recipient in recipients:
+        batch.append(recipient)
+        if len(batch) >= batch_size:
+            total += flush()
+            batch = []
+    if batch:
+        total += flush()
+
+    logger.info(f"Писем '{template.name}' поставлено в очередь: {total}")
+    return total
+
 def send_test_email(user_email):
-    context = {
-        'message': 'Это тестовое сообщение от системы подписок.',
-        'system': 'Subscription System',
-        'status': 'Работает нормально',
-        'timestamp': 'Текущее время'
-    }
-    
     return send_email_notification(
         user_email=user_email,
-        subject='Тестовое уведомление от системы подписок',
+        subject=None,
         template_name='test_email',
-        context=context
+        context={'timestamp': timezone.localtime()}
     )
 
+def subscription_renewed_context(subscription_name, new_end_date, amount):
+    return {'subscription': subscription_name, 'new_end_date': new_end_date, 'amount': amount}
+
+def payment_failed_context(subscription_name, error_message):
+    return {'subscription': subscription_name, 'error': error_message}
+
+def subscription_expiring_context(subscription_name, days_left, end_date):
+    return {'subscription': subscription_name, 'days_left': days_left, 'end_date': end_date}
+
 def send_subscription_renewed_email(user_email, subscription_name, new_end_date, amount):
     """Уведомление о продлении подписки"""
-    context = {
-        'message': f'Ваша подписка "{subscription_name}" была успешно продлена.',
-        'subscription': subscription_name,
-        'new_end_date': new_end_date,
-        'amount': f'{amount} RUB',
-        'next_renewal': 'Автоматически через 30 дней'
-    }
-    
     return send_email_notification(
         user_email=user_email,
-        subject=f'Подписка {subscription_name} продлена',
+        subject=None,
         template_name='subscription_renewed',
-        context=context
+        context=subscription_renewed_context(subscription_name, new_end_date, amount)
     )
 
 def send_payment_failed_email(user_email, subscription_name, error_message):
     """Уведомление об ошибке платежа"""
-    context = {
-        'message': f'Не удалось продлить подписку "{subscription_name}".',
-        'subscription': subscription_name,
-        'error': error_message,
-        'action': 'Пожалуйста, проверьте данные платежной карты'
-    }
-    
     return send_email_notification(
         user_email=user_email,
-        subject=f'Ошибка продления подписки {subscription_name}',
+        subject=None,
         template_name='payment_failed',
-        context=context
+        context=payment_failed_context(subscription_name, error_message)
     )
 
 def send_subscription_expiring_email(user_email, subscription_name, days_left, end_date):
     """Уведомление о скором истечении подписки"""
-    context = {
-        'message': f'Ваша подписка "{subscription_name}" скоро истечет.',
-        'subscription': subscription_name,
-        'days_left': f'{days_left} дней',
-        'end_date': end_date,
-        'action': 'Убедитесь, что на счете достаточно средств для автопродления'
-    }
-    
     return send_email_notification(
         user_email=user_email,
-        subject=f'Подписка {subscription_name} истекает через {days_left} дней',
+        subject=None,
         template_name='subscription_expiring',
-        context=context
-    )
\ No newline at end of file
+        context=subscription_expiring_context(subscription_name, days_left, end_date)
+    )
@@ -0,0 +1,72 @@
+"""
+Реестр шаблонов писем. Каждый шаблон (тема, HTML и текстовая версия из
+templates/emails/<name>.html и .txt) компилируется один раз на процесс и
+хранится в реестре. render_many рендерит пачку получателей в одном
+Context, без создания контекста и прогона context processors на каждое
+письмо. Текстовая версия берется из своего шаблона, а не из strip_tags по HTML.
+"""
+import threading
+
+from django.template import Context, engines
+
+DEFAULT_TEMPLATE = 'notification'
+
+# Темы писем (шаблоны Django, без экранирования)
+SUBJECTS = {
+    'notification': '{{ subject }}',
+    'test_email': 'Тестовое уведомление от системы подписок',
+    'subscription_renewed': 'Подписка {{ subscription }} продлена',
+    'payment_failed': 'Ошибка продления подписки {{ subscription }}',
+    'subscription_expiring': 'Подписка {{ subscription }} истекает через {{ days_left }} дн.',
+    'subscription_expiring_digest': 'Скоро истекают подписки: {{ subscriptions|length }}',
+}
+
+
+class EmailTemplate:
+    """Скомпилированные тема, HTML и текст одного письма"""
+
+    def __init__(self, name):
+        engine = engines['django']
+        self.name = name
+        self.subject = engine.from_string(SUBJECTS[name]).template
+        self.html = engine.get_template(f'emails/{name}.html').template
+        self.text = engine.get_template(f'emails/{name}.txt').template
+
+    def render(self, context):
+        """Возвращает (тема, текст, html) для одного получателя"""
+        return self.render_many([context])[0]
+
+    def render_many(self, contexts):
+        """Список (тема, текст, html) по списку контекстов получателей"""
+        html_context = Context(autoescape=True)
+        text_context = Context(autoescape=False)
+        rendered = []
+        for context in contexts:
+            with text_context.push(context):
+                subject = context.get('subject') or self.subject.render(text_context).strip()
+                with text_context.push(subject=subject), html_context.push(context, subject=subject):
+                    rendered.append((subject, self.text.render(text_context).strip() + '\n', self.html.render(html_context)))
+        return rendered
+
+
+_registry = {}
+_lock = threading.Lock()
+
+
+def get_email_template(name):
+    """Шаблон из реестра (компилируется при первом обращении); неизвестное имя - общий шаблон"""
+    if name not in SUBJECTS:
+        name = DEFAULT_TEMPLATE
+    template = _registry.get(name)
+    if template is None:
+        with _lock:
+            template = _registry.get(name)
+            if template is None:
+                template = _registry[name] = EmailTemplate(name)
+    return template
+
+
+def clear_registry():
+    """Сбрасывает скомпилированные шаблоны (после изменения файлов шаблонов)"""
+    with _lock:
+        _registry.clear()
@@ -0,0 +1,89 @@
+"""
+Закрытие истекших подписок пачками: статус меняется одним UPDATE на пачку,
+уведомления пишутся пачками через NotificationBuffer.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import UserSubscription
+from .schedule import unschedule
+from users.notifications import NotificationBuffer
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = ['active', 'pending_renewal']
+
+
+def get_chunk_size():
+    return max(1, getattr(settings, 'EXPIRY_CHUNK_SIZE', 1000))
+
+
+def overdue_subscriptions(now):
+    return UserSubscription.objects.filter(
+        status__in=OPEN_STATUSES,
+        end_date__lt=now
+    ).order_by()
+
+
+def expire_chunk(now, chunk_size, notifications, subscription_ids=None):
+    """
+    Закрывает одну пачку истекших подписок (или только истекшие из subscription_ids).
+    Возвращает число измененных строк
+    """
+    queryset = overdue_subscriptions(now)
+    if subscription_ids is not None:
+        queryset = queryset.filter(id__in=subscription_ids)
+    with transaction.atomic():
+        rows = list(
+            queryset
+            .select_for_update()
+            .values_list('id', 'user_id', 'plan__name')[:chunk_size]
+        )
+        if not rows:
+            return 0
+
+        updated = UserSubscription.objects.filter(
+            id__in=[subscription_id for subscription_id, _, _ in rows]
+        ).update(status='expired', updated_at=now)
+        # update() не вызывает сигналы - убираем подписки из расписания сами
+        unschedule([subscription_id for subscription_id, _, _ in rows])
+
+        for subscription_id, user_id, plan_name in rows:
+            notifications.add(
+                user_id=user_id,
+                notification_type='subscription_expiring',
+                title='Подписка истекла',
+                message=f'Срок действия подписки "{plan_name}" истек. Оформите подписку заново, чтобы продолжить пользоваться сервисом.',
+                data={'subscription_id': subscription_id, 'plan_name': plan_name}
+            )
+    return updated
+
+
+def expire_overdue_subscriptions(chunk_size=None, now=None):
+    """
+    Закрывает все подписки, срок которых вышел. Обработанные строки перестают
+    подходить под фильтр, поэтому каждая следующая пачка берется с начала выборки.
+    """
+    now = now or timezone.now()
+    chunk_size = chunk_size or get_chunk_size()
+
+    total = 0
+    with NotificationBuffer() as notifications:
+        while True:
+            updated = expire_chunk(now, chunk_size, notifications)
+            if not updated:
+                break
+            total += updated
+
+    logger.info(f"Закрыто истекших подписок: {total}")
+    return total
+
+
+def expire_subscriptions(subscription_ids, now=None):
+    """Закрывает истекшие подписки из заданного списка id (пачка задачи Celery)"""
+    now = now or timezone.now()
+    with NotificationBuffer() as notifications:
+        return expire_chunk(now, len(subscription_ids), notifications, subscription_ids)
@@ -0,0 +1,145 @@
+"""
+Идемпотентность платежных запросов по заголовку Idempotency-Key.
+Первый запрос с ключом выполняется и его ответ сохраняется; повтор с тем же
+ключом и телом получает сохраненный ответ, не доходя до шлюза. Пока первый
+запрос выполняется, повтор получает 409, с тем же ключом и другим телом - 422.
+"""
+from datetime import timedelta
+import functools
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def get_ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 3600))
+
+
+def get_lock_timeout():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 300))
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    raw = f"{request.method}:{request.path}:{body}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def begin(user, key, fingerprint):
+    """
+    Занимает ключ. Возвращает (запись, True), если запрос нужно выполнить,
+    или (существующая запись, False), если по ключу уже есть запрос.
+    Просроченный ключ и ключ, зависший в работе дольше IDEMPOTENCY_LOCK_TIMEOUT,
+    занимаются заново.
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, key=key, fingerprint=fingerprint, expires_at=now + get_ttl()
+            ), True
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.get(user=user, key=key)
+    stale = record.status == 'in_progress' and record.created_at < now - get_lock_timeout()
+    if record.expires_at <= now or stale:
+        # Перезанимаем условным UPDATE: из двух одновременных запросов выиграет один
+        taken = IdempotencyKey.objects.filter(id=record.id, created_at=record.created_at).update(
+            fingerprint=fingerprint, status='in_progress', response_status=None,
+            response_body=None, created_at=now, expires_at=now + get_ttl()
+        )
+        if taken:
+            record.refresh_from_db()
+            return record, True
+        record.refresh_from_db()
+    return record, False
+
+
+def complete(record, response):
+    record.status = 'completed'
+    record.response_status = response.status_code
+    record.response_body = response.data
+    record.save(update_fields=['status', 'response_status', 'response_body'])
+
+
+def release(record):
+    """Освобождает ключ, чтобы запрос можно было повторить (ошибка сервера)"""
+    IdempotencyKey.objects.filter(id=record.id, status='in_progress').delete()
+
+
+def idempotent(view_func):
+    """
+    Декоратор для методов APIView (self, request, ...) и функций с @api_view (request, ...).
+    Без заголовка Idempotency-Key запрос выполняется как обычно.
+    """
+    @functools.wraps(view_func)
+    def wrapper(*args, **kwargs):
+        request = args[0] if isinstance(args[0], Request) else args[1]
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_func(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{IDEMPOTENCY_HEADER} длиннее {MAX_KEY_LENGTH} символов'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = request_fingerprint(request)
+        record, created = begin(request.user, key, fingerprint)
+        if not created:
+            if record.fingerprint != fingerprint:
+                return Response(
+                    {'error': f'{IDEMPOTENCY_HEADER} уже использован с другим запросом'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if record.status == 'in_progress':
+                return Response(
+                    {'error': 'Запрос с этим ключом еще выполняется'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            logger.info(f"Повтор запроса {request.path} по ключу {key}: отдаем сохраненный ответ")
+            return Response(record.response_body, status=record.response_status,
+                            headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = view_func(*args, **kwargs)
+        except Exception:
+            release(record)
+            raise
+
+        if response.status_code >= 500:
+            release(record)
+        else:
+            complete(record, response)
+        return response
+
+    return wrapper
+
+
+def purge_expired_keys(batch_size=1000, now=None):
+    """Удаляет просроченные ключи пачками. Возвращает число удаленных"""
+    now = now or timezone.now()
+    deleted = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
+    if deleted:
+        logger.info(f"Удалено просроченных ключей идемпотентности: {deleted}")
+    return deleted
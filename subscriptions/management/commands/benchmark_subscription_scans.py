@@ -0,0 +1,127 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import timedelta
+import random
+import time
+
+from subscriptions.models import UserSubscription, SubscriptionPlan
+from subscriptions.renewal_engine import due_subscriptions
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Замеряет сканы продления и закрытия истекших подписок с индексами и без. '
+            'Тестовые данные создаются внутри транзакции и откатываются в конце.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Количество подписок')
+        parser.add_argument('--users', type=int, default=10_000, help='Количество пользователей')
+        parser.add_argument('--repeat', type=int, default=5, help='Повторов каждого запроса (берется лучший)')
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Размер пачки bulk_create')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.populate(options['rows'], options['users'], options['batch_size'])
+
+            self.stdout.write("\n=== БЕЗ ИНДЕКСОВ ===")
+            self.drop_indexes()
+            self.analyze()
+            before = self.measure(options['repeat'])
+
+            self.stdout.write("\n=== С ИНДЕКСАМИ ===")
+            self.create_indexes()
+            self.analyze()
+            after = self.measure(options['repeat'])
+
+            self.stdout.write("\n=== ИТОГ ===")
+            for name in before:
+                speedup = before[name] / after[name] if after[name] else float('inf')
+                self.stdout.write(self.style.SUCCESS(
+                    f"{name}: {before[name] * 1000:.1f} мс -> {after[name] * 1000:.1f} мс (x{speedup:.1f})"
+                ))
+
+            # Откатываем тестовые данные и изменения схемы
+            transaction.set_rollback(True)
+
+    def populate(self, rows, users_count, batch_size):
+        self.stdout.write(f"Создание {rows} подписок для {users_count} пользователей...")
+        started = time.monotonic()
+
+        plan = SubscriptionPlan.objects.create(name='Benchmark', price=100, duration_days=30)
+        User.objects.bulk_create(
+            [User(username=f'benchmark_{i}') for i in range(users_count)],
+            batch_size=batch_size
+        )
+        user_ids = list(User.objects.filter(username__startswith='benchmark_').values_list('id', flat=True))
+
+        now = timezone.now()
+        created = 0
+        while created < rows:
+            batch = []
+            for _ in range(min(batch_size, rows - created)):
+                roll = random.random()
+                if roll < 0.70:
+                    # Действующие: окончание равномерно в ближайший год
+                    status, end_date = 'active', now + timedelta(days=random.uniform(0, 365))
+                elif roll < 0.72:
+                    status, end_date = 'pending_renewal', now - timedelta(days=random.uniform(0, 3))
+                elif roll < 0.90:
+                    status, end_date = 'expired', now - timedelta(days=random.uniform(0, 730))
+                else:
+                    status, end_date = 'canceled', now + timedelta(days=random.uniform(-365, 365))
+                batch.append(UserSubscription(
+                    user_id=random.choice(user_ids),
+                    plan=plan,
+                    status=status,
+                    start_date=end_date - timedelta(days=30),
+                    end_date=end_date,
+                    auto_renew=random.random() < 0.85
+                ))
+            UserSubscription.objects.bulk_create(batch)
+            created += len(batch)
+
+        self.stdout.write(f"Данные созданы за {time.monotonic() - started:.1f} с")
+
+    # DDL выполняем напрямую: schema_editor на SQLite нельзя открыть внутри atomic()
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for index in UserSubscription._meta.indexes:
+                cursor.execute(f"DROP INDEX {connection.ops.quote_name(index.name)}")
+
+    def create_indexes(self):
+        editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for index in UserSubscription._meta.indexes:
+                cursor.execute(str(index.create_sql(UserSubscription, editor)))
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def queries(self):
+        now = timezone.now()
+        return {
+            'Скан продления': due_subscriptions(now).order_by().values_list('id', 'user_id'),
+            'Скан истекших': UserSubscription.objects.filter(
+                status__in=['active', 'pending_renewal'],
+                end_date__lt=now
+            ).order_by().values_list('id', flat=True),
+        }
+
+    def measure(self, repeat):
+        timings = {}
+        for name, queryset in self.queries().items():
+            self.stdout.write(f"\n{name}:")
+            self.stdout.write(queryset.explain())
+
+            best = None
+            for _ in range(repeat):
+                started = time.monotonic()
+                found = len(list(queryset.all()))
+                elapsed = time.monotonic() - started
+                best = elapsed if best is None else min(best, elapsed)
+
+            timings[name] = best
+            self.stdout.write(f"Найдено строк: {found}, лучшее время: {best * 1000:.1f} мс")
+        return timings
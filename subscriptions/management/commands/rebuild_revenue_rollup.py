@@ -0,0 +1,34 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+from subscriptions.models import Transaction
+from subscriptions.rollup import rebuild_range, update_rollup
+
+class Command(BaseCommand):
+    help = 'Пересчитывает дневную сводку выручки за диапазон дат (по умолчанию - за весь журнал)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, default=None, help='Первый день, YYYY-MM-DD')
+        parser.add_argument('--end', type=date.fromisoformat, default=None, help='Последний день, YYYY-MM-DD')
+        parser.add_argument('--incremental', action='store_true', help='Только дни с изменениями после последнего обновления')
+    
+    def handle(self, *args, **options):
+        if options['incremental']:
+            rebuilt = update_rollup()
+            self.stdout.write(self.style.SUCCESS(f"Пересчитано дней: {rebuilt}"))
+            return
+        
+        start, end = options['start'], options['end']
+        if start is None or end is None:
+            bounds = Transaction.objects.order_by().aggregate(first=Min('created_at'), last=Max('created_at'))
+            if bounds['first'] is None:
+                self.stdout.write("Транзакций нет")
+                return
+            start = start or timezone.localdate(bounds['first'])
+            end = end or timezone.localdate(bounds['last'])
+        if start > end:
+            raise CommandError("--start позже --end")
+        
+        rebuilt = rebuild_range(start, end)
+        self.stdout.write(self.style.SUCCESS(f"Сводка пересчитана за {start} - {end}: {rebuilt} дн."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from subscriptions.reconciliation import run_reconciliation, drift_report
+
+class Command(BaseCommand):
+    help = 'Сверяет балансы пользователей с журналом транзакций (по умолчанию - только изменения с прошлой сверки)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Проверить всех пользователей')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Пользователей в одном запросе')
+        parser.add_argument('--limit', type=int, default=50, help='Сколько расхождений вывести')
+    
+    def handle(self, *args, **options):
+        result = run_reconciliation(full=options['full'], chunk_size=options['chunk_size'])
+        self.stdout.write(f"Проверено пользователей: {result['checked']}, сверено до {result['position']}")
+        
+        drifted = drift_report()
+        total = drifted.count()
+        if not total:
+            self.stdout.write(self.style.SUCCESS("Расхождений нет"))
+            return
+        
+        self.stdout.write(self.style.WARNING(f"Расхождений: {total}"))
+        for record in drifted[:options['limit']]:
+            self.stdout.write(
+                f"  {record.user.username} (ID: {record.user_id}): баланс {record.stored_balance}, "
+                f"по журналу {record.expected_balance}, разница {record.drift}"
+            )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from subscriptions.renewal_engine import run_renewals
+
+class Command(BaseCommand):
+    help = 'Запускает продление подписок немедленно и выводит пропускную способность'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, default=None, help='Количество шардов (по умолчанию RENEWAL_SHARD_COUNT)')
+        parser.add_argument('--workers', type=int, default=None, help='Потоков на шард (по умолчанию RENEWAL_WORKERS_PER_SHARD)')
+    
+    def handle(self, *args, **options):
+        report = run_renewals(
+            shard_count=options['shards'],
+            workers_per_shard=options['workers']
+        )
+        
+        self.stdout.write("=== ПРОДЛЕНИЕ ПОДПИСОК ===")
+        self.stdout.write(f"   Шардов: {report['shards']} x {report['workers_per_shard']} потоков")
+        self.stdout.write(f"   Обработано: {report['processed']}")
+        self.stdout.write(f"   Продлено: {report['renewed']}")
+        self.stdout.write(f"   Недостаточно средств: {report['insufficient_funds']}")
+        self.stdout.write(f"   Отказ шлюза: {report['payment_failed']}")
+        self.stdout.write(f"   Пропущено: {report['skipped']}")
+        self.stdout.write(f"   Ошибок: {report['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Время: {report['elapsed_seconds']} с, {report['renewals_per_second']} продлений/с"
+        ))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from subscriptions.reminders import send_expiration_reminders
+
+class Command(BaseCommand):
+    help = 'Отправляет напоминания об окончании подписок немедленно (уже отправленные не повторяются)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None, help='Пользователей в пачке (по умолчанию EXPIRY_REMINDER_CHUNK_SIZE)')
+    
+    def handle(self, *args, **options):
+        report = send_expiration_reminders(chunk_size=options['chunk_size'])
+        
+        self.stdout.write("=== НАПОМИНАНИЯ ОБ ОКОНЧАНИИ ПОДПИСОК ===")
+        self.stdout.write(f"   Пользователей: {report['users']}")
+        self.stdout.write(f"   Подписок: {report['reminders']}")
+        self.stdout.write(self.style.SUCCESS(f"Писем в очереди: {report['emails']}"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from subscriptions.email_queue import drain_queue
+
+class Command(BaseCommand):
+    help = 'Отправляет письма из очереди немедленно (без ожидания фоновой задачи)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Максимум писем (по умолчанию EMAIL_QUEUE_MAX_PER_RUN)')
+    
+    def handle(self, *args, **options):
+        report = drain_queue(limit=options['limit'])
+        
+        self.stdout.write("=== ОЧЕРЕДЬ ПИСЕМ ===")
+        self.stdout.write(f"   Пачек: {report['batches']}")
+        self.stdout.write(f"   Ошибок: {report['failed']}")
+        self.stdout.write(self.style.SUCCESS(f"Отправлено: {report['sent']}"))
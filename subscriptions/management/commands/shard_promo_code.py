@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from subscriptions.models import PromoCode
+from subscriptions.promo import shard_promo, redeemed_count
+
+class Command(BaseCommand):
+    help = ('Делит лимит использований промокода между шардами, чтобы одновременные '
+            'покупки с популярным кодом не конкурировали за одну строку')
+    
+    def add_arguments(self, parser):
+        parser.add_argument('code', help='Промокод')
+        parser.add_argument('--shards', type=int, default=16, help='Число шардов (0 - единый счетчик)')
+    
+    def handle(self, *args, **options):
+        if options['shards'] < 0:
+            raise CommandError("--shards не может быть отрицательным")
+        try:
+            promo = PromoCode.objects.get(code=options['code'])
+        except PromoCode.DoesNotExist:
+            raise CommandError(f"Промокод {options['code']} не найден")
+        
+        promo = shard_promo(promo, options['shards'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Промокод {promo.code}: шардов {promo.shard_count}, "
+            f"использовано {redeemed_count(promo)} из {promo.max_uses}"
+        ))
@@ -2,7 +2,12 @@ from django.core.management.base import BaseCommand
 from subscriptions.background_tasks import (
     check_subscription_renewals,
     send_expiration_notifications,
-    retry_failed_payments
+    retry_failed_payments,
+    sweep_pending_purchases,
+    update_revenue_rollup,
+    purge_idempotency_keys,
+    reconcile_balances,
+    deliver_outbound_emails
 )
 from background_task.models import Task
 import logging
@@ -26,8 +31,23 @@ class Command(BaseCommand):
         send_expiration_notifications(repeat=86400, repeat_until=None)  # Каждые 24 часа
         self.stdout.write(self.style.SUCCESS("Задача отправки уведомлений запущена (каждые 24 часа)"))
         
-        retry_failed_payments(repeat=3600, repeat_until=None)  # Каждый час
-        self.stdout.write(self.style.SUCCESS("Задача повторных попыток платежей запущена (каждый час)"))
+        retry_failed_payments(repeat=300, repeat_until=None)  # Каждые 5 минут
+        self.stdout.write(self.style.SUCCESS("Задача повторных попыток платежей запущена (каждые 5 мин)"))
+        
+        sweep_pending_purchases(repeat=300, repeat_until=None)  # Каждые 5 минут
+        self.stdout.write(self.style.SUCCESS("Задача отмены зависших покупок запущена (каждые 5 мин)"))
+        
+        update_revenue_rollup(repeat=600, repeat_until=None)  # Каждые 10 минут
+        self.stdout.write(self.style.SUCCESS("Задача обновления сводки выручки запущена (каждые 10 мин)"))
+        
+        purge_idempotency_keys(repeat=3600, repeat_until=None)  # Каждый час
+        self.stdout.write(self.style.SUCCESS("Задача очистки ключей идемпотентности запущена (каждый час)"))
+        
+        reconcile_balances(repeat=86400, repeat_until=None)  # Каждые 24 часа
+        self.stdout.write(self.style.SUCCESS("Задача сверки балансов запущена (каждые 24 часа)"))
+        
+        deliver_outbound_emails(repeat=60, repeat_until=None)  # Каждую минуту
+        self.stdout.write(self.style.SUCCESS("Задача отправки писем из очереди запущена (каждую минуту)"))
         
         self.stdout.write("\n" + "="*60)
         self.stdout.write(self.style.SUCCESS("ВСЕ ФОНОВЫЕ ЗАДАЧИ ЗАПУЩЕНЫ."))
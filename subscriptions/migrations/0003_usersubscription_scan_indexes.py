@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0002_refundpolicy"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="usersubscription",
+            index=models.Index(
+                condition=models.Q(("auto_renew", True)),
+                fields=["status", "end_date", "user"],
+                name="usersub_renewal_scan_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="usersubscription",
+            index=models.Index(
+                fields=["status", "end_date"], name="usersub_status_end_idx"
+            ),
+        ),
+    ]
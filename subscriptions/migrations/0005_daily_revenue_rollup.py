@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0004_pagination_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Checkpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                ("position", models.DateTimeField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="DailyRevenueRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("transaction_type", models.CharField(max_length=30)),
+                ("status", models.CharField(max_length=20)),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["day"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(fields=["updated_at"], name="transaction_updated_idx"),
+        ),
+        migrations.AddField(
+            model_name="dailyrevenuerollup",
+            name="plan",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Пусто для операций без подписки (пополнения)",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="subscriptions.subscriptionplan",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="dailyrevenuerollup",
+            constraint=models.UniqueConstraint(
+                fields=("day", "plan", "transaction_type", "status"),
+                name="daily_rollup_unique_key",
+            ),
+        ),
+    ]
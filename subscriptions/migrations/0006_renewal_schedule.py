@@ -0,0 +1,94 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:23
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_schedule(apps, schema_editor):
+    """Ставит в расписание уже существующие подписки с автопродлением"""
+    UserSubscription = apps.get_model("subscriptions", "UserSubscription")
+    RenewalSchedule = apps.get_model("subscriptions", "RenewalSchedule")
+    bucket_seconds = max(1, getattr(settings, "RENEWAL_BUCKET_SECONDS", 300))
+    now = timezone.now()
+
+    subscriptions = UserSubscription.objects.filter(
+        status__in=["active", "pending_renewal"],
+        auto_renew=True,
+        end_date__isnull=False,
+    ).values_list("id", "user_id", "status", "end_date")
+
+    batch = []
+    for subscription_id, user_id, status, end_date in subscriptions.iterator():
+        due_at = now if status == "pending_renewal" else end_date - timedelta(hours=24)
+        batch.append(
+            RenewalSchedule(
+                subscription_id=subscription_id,
+                user_id=user_id,
+                due_at=due_at,
+                bucket=int(due_at.timestamp()) // bucket_seconds,
+            )
+        )
+        if len(batch) >= 1000:
+            RenewalSchedule.objects.bulk_create(batch)
+            batch = []
+    RenewalSchedule.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0005_daily_revenue_rollup"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RenewalSchedule",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("due_at", models.DateTimeField()),
+                (
+                    "bucket",
+                    models.BigIntegerField(
+                        help_text="Номер корзины: due_at // RENEWAL_BUCKET_SECONDS"
+                    ),
+                ),
+                (
+                    "subscription",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="renewal_schedule",
+                        to="subscriptions.usersubscription",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["bucket", "due_at"], name="renewal_schedule_bucket_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_schedule, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0008_idempotency_keys"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="transaction",
+            name="transaction_type",
+            field=models.CharField(
+                choices=[
+                    ("subscription_purchase", "Покупка подписки"),
+                    ("subscription_renewal", "Продление подписки"),
+                    ("refund", "Возврат"),
+                    ("topup", "Пополнение баланса"),
+                    ("deposit", "Пополнение баланса"),
+                    ("payment", "Списание"),
+                    ("subscription_cancel", "Отмена подписки"),
+                ],
+                max_length=30,
+            ),
+        ),
+        migrations.CreateModel(
+            name="BalanceReconciliation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "expected_balance",
+                    models.DecimalField(decimal_places=2, max_digits=14),
+                ),
+                (
+                    "stored_balance",
+                    models.DecimalField(decimal_places=2, max_digits=14),
+                ),
+                ("drift", models.DecimalField(decimal_places=2, max_digits=14)),
+                ("has_drift", models.BooleanField(default=False)),
+                ("checked_at", models.DateTimeField()),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("has_drift", True)),
+                        fields=["user"],
+                        name="reconciliation_drift_idx",
+                    )
+                ],
+            },
+        ),
+    ]
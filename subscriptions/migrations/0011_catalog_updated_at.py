@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0010_promo_redemption"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="promocode",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="subscriptionplan",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0013_expiration_reminder"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="renewalschedule",
+            name="claimed_until",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Аренда воркера, взявшего подписку в работу",
+                null=True,
+            ),
+        ),
+    ]
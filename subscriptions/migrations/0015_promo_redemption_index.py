@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0014_renewal_schedule_claimed_until"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="promoredemption",
+            name="promo_redemption_once_per_user",
+        ),
+        migrations.AddIndex(
+            model_name="promoredemption",
+            index=models.Index(
+                fields=["promo", "user"], name="promo_redemption_user_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0016_transaction_pending_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="renewalschedule",
+            name="renewal_schedule_bucket_idx",
+        ),
+        migrations.RemoveField(
+            model_name="renewalschedule",
+            name="bucket",
+        ),
+        migrations.AddIndex(
+            model_name="renewalschedule",
+            index=models.Index(fields=["due_at"], name="renewal_schedule_due_idx"),
+        ),
+    ]
@@ -3,6 +3,7 @@ from django.db import models
 # Create your models here.
 
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator  
 import uuid
@@ -14,6 +15,7 @@ class SubscriptionPlan(models.Model):
     duration_days = models.IntegerField(help_text="Длительность подписки в днях")
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['price']
@@ -41,6 +43,20 @@ class UserSubscription(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Сканирование продления: auto_renew AND status IN (...) AND end_date <= X.
+            # Частичный индекс по auto_renew, внутри - поиск по status и диапазону end_date;
+            # user_id в индексе, чтобы выборка (id, user_id) не читала таблицу
+            models.Index(
+                fields=['status', 'end_date', 'user'],
+                name='usersub_renewal_scan_idx',
+                condition=models.Q(auto_renew=True),
+            ),
+            # Закрытие истекших: status IN (...) AND end_date < now
+            models.Index(fields=['status', 'end_date'], name='usersub_status_end_idx'),
+            # Курсорная пагинация админского списка
+            models.Index(fields=['created_at', 'id'], name='usersub_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.plan.name} ({self.status})"
@@ -73,6 +89,9 @@ class Transaction(models.Model):
         ('subscription_renewal', 'Продление подписки'),
         ('refund', 'Возврат'),
         ('topup', 'Пополнение баланса'),
+        ('deposit', 'Пополнение баланса'),
+        ('payment', 'Списание'),
+        ('subscription_cancel', 'Отмена подписки'),
     )
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -88,6 +107,17 @@ class Transaction(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Курсорная пагинация: история пользователя и общий список для админа
+            models.Index(fields=['user', 'created_at', 'id'], name='transaction_user_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='transaction_created_idx'),
+            # Инкрементальное обновление сводки по дням (см. rollup.py)
+            models.Index(fields=['updated_at'], name='transaction_updated_idx'),
+            # Уборка зависших покупок (см. purchases.py): pending-строк мало
+            models.Index(
+                fields=['created_at'], name='transaction_pending_idx', condition=models.Q(status='pending')
+            ),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.amount} руб. ({self.status})"
@@ -101,7 +131,11 @@ class PromoCode(models.Model):
     valid_from = models.DateTimeField()
     valid_to = models.DateTimeField()
     is_active = models.BooleanField(default=True)
+    shard_count = models.PositiveSmallIntegerField(
+        default=0, help_text="Число счетчиков PromoCodeShard для популярных кодов (0 - счетчик used_count)"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     def is_valid(self):
         now = timezone.now()
@@ -133,4 +167,263 @@ class RefundPolicy(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class FailedPayment(models.Model):
+    """Очередь неудачных платежей за продление для повторной попытки (см. retry_queue.py)"""
+    STATUS_CHOICES = (
+        ('pending', 'Ожидает повтора'),
+        ('resolved', 'Закрыт'),
+        ('abandoned', 'Попытки исчерпаны'),
+    )
+    
+    subscription = models.ForeignKey(UserSubscription, on_delete=models.CASCADE, related_name='failed_payments')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    attempt_count = models.IntegerField(default=1)
+    last_attempt = models.DateTimeField(auto_now=True)
+    next_attempt = models.DateTimeField()
+    error_message = models.TextField(blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            # Выборка наступивших повторов: status = 'pending' AND next_attempt <= now
+            models.Index(fields=['status', 'next_attempt'], name='failedpayment_due_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['subscription'],
+                condition=models.Q(status='pending'),
+                name='failedpayment_one_pending',
+            ),
+        ]
+    
+    def schedule_retry(self, error_message=''):
+        """
+        Отмечает еще одну неудачную попытку: следующая через экспоненциальную
+        задержку с джиттером, после PAYMENT_RETRY_MAX_ATTEMPTS попыток - abandoned.
+        """
+        from .retry_queue import get_max_attempts, retry_delay
+        
+        self.attempt_count += 1
+        if error_message:
+            self.error_message = error_message
+        if self.attempt_count >= get_max_attempts():
+            self.status = 'abandoned'
+        else:
+            self.next_attempt = timezone.now() + retry_delay(self.attempt_count)
+        self.save()
+    
+    def __str__(self):
+        return f"Подписка {self.subscription_id}: попытка {self.attempt_count} ({self.status})"
+
+
+class RenewalSchedule(models.Model):
+    """
+    Очередь продлений: время следующего списания по подписке. Фоновая задача
+    читает только наступившие записи по индексу due_at вместо сканирования
+    всех активных подписок (см. schedule.py).
+    """
+    subscription = models.OneToOneField(UserSubscription, on_delete=models.CASCADE, related_name='renewal_schedule')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    due_at = models.DateTimeField()
+    claimed_until = models.DateTimeField(null=True, blank=True, help_text="Аренда воркера, взявшего подписку в работу")
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['due_at'], name='renewal_schedule_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Подписка {self.subscription_id}: {self.due_at}"
+
+
+class DailyRevenueRollup(models.Model):
+    """
+    Сводка транзакций за день: количество и сумма в разрезе тарифа, типа
+    операции и статуса. Пересчитывается по дням из Transaction (см. rollup.py).
+    """
+    day = models.DateField()
+    plan = models.ForeignKey(SubscriptionPlan, on_delete=models.SET_NULL, null=True, blank=True,
+                             help_text="Пусто для операций без подписки (пополнения)")
+    transaction_type = models.CharField(max_length=30)
+    status = models.CharField(max_length=20)
+    count = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['day']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'plan', 'transaction_type', 'status'],
+                name='daily_rollup_unique_key',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} {self.transaction_type}/{self.status}: {self.count} шт., {self.amount} руб."
+
+
+class Checkpoint(models.Model):
+    """Отметка, до которой фоновая обработка уже дошла (high-water mark)"""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name}: {self.position}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Ответ на запрос с заголовком Idempotency-Key. Повтор запроса с тем же
+    ключом получает сохраненный ответ без повторного списания (см. idempotency.py).
+    """
+    STATUS_CHOICES = (
+        ('in_progress', 'Выполняется'),
+        ('completed', 'Выполнен'),
+    )
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text="sha256 метода, пути и тела запроса")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_unique'),
+        ]
+        indexes = [
+            # Удаление просроченных ключей
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.key} ({self.status})"
+
+
+class BalanceReconciliation(models.Model):
+    """
+    Результат последней сверки баланса пользователя с журналом транзакций
+    (см. reconciliation.py). drift = сохраненный баланс - ожидаемый.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    expected_balance = models.DecimalField(max_digits=14, decimal_places=2)
+    stored_balance = models.DecimalField(max_digits=14, decimal_places=2)
+    drift = models.DecimalField(max_digits=14, decimal_places=2)
+    has_drift = models.BooleanField(default=False)
+    checked_at = models.DateTimeField()
+    
+    class Meta:
+        indexes = [
+            # Отчет о расхождениях и их перепроверка
+            models.Index(fields=['user'], condition=models.Q(has_drift=True), name='reconciliation_drift_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.drift}"
+
+
+class PromoCodeShard(models.Model):
+    """
+    Часть лимита использований популярного промокода. Лимит делится между
+    шардами, и одновременные покупки обновляют разные строки (см. promo.py).
+    """
+    promo = models.ForeignKey(PromoCode, on_delete=models.CASCADE, related_name='shards')
+    shard = models.PositiveSmallIntegerField()
+    capacity = models.IntegerField()
+    used_count = models.IntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['promo', 'shard'], name='promo_shard_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.promo_id}#{self.shard}: {self.used_count}/{self.capacity}"
+
+
+class PromoRedemption(models.Model):
+    """Использование промокода пользователем"""
+    promo = models.ForeignKey(PromoCode, on_delete=models.CASCADE, related_name='redemptions')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='promo_redemptions')
+    subscription = models.ForeignKey(UserSubscription, on_delete=models.SET_NULL, null=True, blank=True)
+    shard = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Шард, с которого списано использование")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['promo', 'user'], name='promo_redemption_user_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.promo_id}: {self.user_id}"
+
+
+class OutboundEmail(models.Model):
+    """
+    Очередь исходящих писем (см. email_queue.py). Запрос только сохраняет письмо,
+    отправляет фоновый воркер пачками через одно SMTP-соединение.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Ожидает отправки'),
+        ('sent', 'Отправлено'),
+        ('failed', 'Попытки исчерпаны'),
+    )
+    
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body_text = models.TextField()
+    body_html = models.TextField(blank=True)
+    template_name = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempt_count = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            # Выборка наступивших писем: status = 'pending' AND next_attempt <= now
+            models.Index(fields=['status', 'next_attempt'], name='outboundemail_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.to_email}: {self.subject}"
+
+
+class ExpirationReminder(models.Model):
+    """
+    Отправленное напоминание об окончании подписки (см. reminders.py). Одно на
+    подписку, срок окончания и горизонт: после продления end_date меняется,
+    и напоминания для нового срока отправляются заново.
+    """
+    subscription = models.ForeignKey(UserSubscription, on_delete=models.CASCADE, related_name='reminders')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    end_date = models.DateTimeField()
+    horizon_days = models.PositiveSmallIntegerField()
+    sent_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['subscription', 'end_date', 'horizon_days'],
+                name='reminder_once_per_horizon',
+            ),
+        ]
+        indexes = [
+            # Удаление напоминаний по прошедшим срокам
+            models.Index(fields=['end_date'], name='reminder_end_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.subscription_id}: за {self.horizon_days} дн."
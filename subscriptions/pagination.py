@@ -0,0 +1,18 @@
+"""
+Keyset-пагинация списков: страница выбирается по курсору (created_at, id),
+а не по OFFSET, поэтому время ответа не растет с размером таблицы.
+"""
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация от новых записей к старым.
+    id в сортировке делает порядок стабильным при одинаковом created_at.
+    Размер страницы задается параметром ?page_size= (не больше API_MAX_PAGE_SIZE).
+    """
+    ordering = ('-created_at', '-id')
+    page_size = getattr(settings, 'API_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 500)
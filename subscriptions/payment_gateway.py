@@ -1,10 +1,143 @@
+import asyncio
+import threading
 import time
 import random
+from collections import OrderedDict
 from datetime import datetime
 from django.conf import settings
 
+ERROR_REASONS = [
+    'Недостаточно средств',
+    'Сеть недоступна',
+    'Таймаут соединения',
+    'Неверные данные карты',
+    'Превышен лимит'
+]
+
+
+def _payment_result(amount):
+    """Результат платежа: успех с вероятностью 90%"""
+    if random.random() < 0.9:
+        # Успешный платеж
+        transaction_id = f"FPG_{int(time.time())}_{random.randint(1000, 9999)}"
+        return {
+            'success': True,
+            'transaction_id': transaction_id,
+            'amount': amount,
+            'status': 'completed',
+            'message': 'Платеж успешно обработан',
+            'timestamp': datetime.now().isoformat(),
+            'gateway_data': {
+                'fake_gateway': True,
+                'approval_code': f"APPROVAL_{random.randint(100000, 999999)}"
+            }
+        }
+    # Неуспешный платеж
+    return {
+        'success': False,
+        'transaction_id': None,
+        'amount': amount,
+        'status': 'failed',
+        'message': random.choice(ERROR_REASONS),
+        'timestamp': datetime.now().isoformat(),
+        'gateway_data': {
+            'fake_gateway': True,
+            'error_code': f"ERR_{random.randint(100, 999)}"
+        }
+    }
+
+
+def _refund_result(amount):
+    """Результат возврата: успех с вероятностью 95%"""
+    if random.random() < 0.95:
+        return {
+            'success': True,
+            'refund_id': f"REFUND_{int(time.time())}_{random.randint(1000, 9999)}",
+            'amount': amount,
+            'status': 'refunded',
+            'message': 'Возврат успешно обработан',
+            'timestamp': datetime.now().isoformat()
+        }
+    return {
+        'success': False,
+        'refund_id': None,
+        'amount': amount,
+        'status': 'failed',
+        'message': 'Ошибка возврата',
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def _balance_result(user_id):
+    # Генерируем случайный баланс для тестирования
+    balance = random.uniform(1000, 10000)
+    return {
+        'success': True,
+        'balance': round(balance, 2),
+        'currency': 'RUB',
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def _timeout_result(amount, idempotency_key=None):
+    """
+    Ответ шлюза не получен за отведенное время. Это не отказ: платеж мог пройти,
+    статус нужно уточнить по ключу идемпотентности (payment_status)
+    """
+    return {
+        'success': False,
+        'transaction_id': None,
+        'amount': amount,
+        'status': 'unknown',
+        'idempotency_key': idempotency_key,
+        'message': 'Таймаут соединения, статус платежа неизвестен',
+        'timestamp': datetime.now().isoformat(),
+        'gateway_data': {
+            'fake_gateway': True,
+            'error_code': 'ERR_TIMEOUT'
+        }
+    }
+
+
+# Результаты уже проведенных платежей по ключу идемпотентности
+# (повторная отправка того же ключа не списывает деньги второй раз)
+_IDEMPOTENCY_CACHE_SIZE = 100000
+_processed_payments = OrderedDict()
+_processed_lock = threading.Lock()
+
+
+def _charge_once(user_id, amount, idempotency_key):
+    with _processed_lock:
+        if idempotency_key in _processed_payments:
+            return dict(_processed_payments[idempotency_key], replayed=True)
+
+    result = _payment_result(amount)
+    result['user_id'] = user_id
+    result['idempotency_key'] = idempotency_key
+
+    with _processed_lock:
+        # Ключ мог быть обработан параллельным запросом - отдаем первый результат
+        if idempotency_key in _processed_payments:
+            return dict(_processed_payments[idempotency_key], replayed=True)
+        _processed_payments[idempotency_key] = result
+        if len(_processed_payments) > _IDEMPOTENCY_CACHE_SIZE:
+            _processed_payments.popitem(last=False)
+    return result
+
+
+def _charge_items(items):
+    return [_charge_once(user_id, amount, idempotency_key) for user_id, amount, idempotency_key in items]
+
+
+def _stored_result(idempotency_key):
+    """Сохраненный результат платежа по ключу; None - шлюз такого платежа не проводил"""
+    with _processed_lock:
+        result = _processed_payments.get(idempotency_key)
+    return dict(result, replayed=True) if result is not None else None
+
+
 class FakePaymentGateway:
-    
+
     @staticmethod
     def process_payment(amount, user_id, description=""):
         """
@@ -13,82 +146,169 @@ class FakePaymentGateway:
         """
         # Имитация задержки сети
         time.sleep(random.uniform(0.5, 2.0))
-        
-        # Вероятность успешного платежа 90%
-        if random.random() < 0.9:
-            # Успешный платеж
-            transaction_id = f"FPG_{int(time.time())}_{random.randint(1000, 9999)}"
-            return {
-                'success': True,
-                'transaction_id': transaction_id,
-                'amount': amount,
-                'status': 'completed',
-                'message': 'Платеж успешно обработан',
-                'timestamp': datetime.now().isoformat(),
-                'gateway_data': {
-                    'fake_gateway': True,
-                    'approval_code': f"APPROVAL_{random.randint(100000, 999999)}"
-                }
-            }
-        else:
-            # Неуспешный платеж
-            error_reasons = [
-                'Недостаточно средств',
-                'Сеть недоступна',
-                'Таймаут соединения',
-                'Неверные данные карты',
-                'Превышен лимит'
-            ]
-            return {
-                'success': False,
-                'transaction_id': None,
-                'amount': amount,
-                'status': 'failed',
-                'message': random.choice(error_reasons),
-                'timestamp': datetime.now().isoformat(),
-                'gateway_data': {
-                    'fake_gateway': True,
-                    'error_code': f"ERR_{random.randint(100, 999)}"
-                }
-            }
-    
+        return _payment_result(amount)
+
+    @staticmethod
+    def batch_charge(items, description=""):
+        """
+        Пакетное списание: одна задержка сети на всю пачку.
+        items - список (user_id, amount, idempotency_key).
+        Возвращает список результатов в том же порядке; каждый элемент
+        проходит или отклоняется независимо от остальных.
+        """
+        if not items:
+            return []
+
+        # Имитация задержки сети - одна на пачку
+        time.sleep(random.uniform(0.5, 2.0))
+        return _charge_items(items)
+
     @staticmethod
     def refund_payment(original_transaction_id, amount):
         """
         Возврат средств
         """
         time.sleep(random.uniform(0.5, 1.5))
-        
-        if random.random() < 0.95:
-            return {
-                'success': True,
-                'refund_id': f"REFUND_{int(time.time())}_{random.randint(1000, 9999)}",
-                'amount': amount,
-                'status': 'refunded',
-                'message': 'Возврат успешно обработан',
-                'timestamp': datetime.now().isoformat()
-            }
-        else:
+        return _refund_result(amount)
+
+    @staticmethod
+    def check_balance(user_id):
+        """
+        Проверяет баланс в платежной системе
+        """
+        time.sleep(0.3)
+        return _balance_result(user_id)
+
+
+class AsyncFakePaymentGateway:
+    """
+    Асинхронный клиент шлюза. Одновременно в работе не больше max_in_flight
+    запросов, каждый запрос ограничен timeout секундами. Задержка сети
+    имитируется через asyncio.sleep, поэтому сотни платежей идут параллельно.
+    """
+
+    def __init__(self, max_in_flight=None, timeout=None):
+        self.max_in_flight = max_in_flight or getattr(settings, 'PAYMENT_GATEWAY_MAX_IN_FLIGHT', 100)
+        self.timeout = timeout or getattr(settings, 'PAYMENT_GATEWAY_TIMEOUT', 5)
+        self._semaphore = None
+        self._loop = None
+
+    def _get_semaphore(self):
+        # Семафор привязан к event loop, поэтому создаем его в текущем цикле
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._loop = loop
+        return self._semaphore
+
+    async def _call(self, delay, build_result, *args):
+        """
+        Выполняет запрос к шлюзу с ограничением параллельности и таймаутом.
+        При отмене (CancelledError) слот семафора освобождается автоматически.
+        """
+        async with self._get_semaphore():
+            async def request():
+                await asyncio.sleep(delay)
+                return build_result(*args)
+            return await asyncio.wait_for(request(), timeout=self.timeout)
+
+    async def process_payment(self, amount, user_id, description="", idempotency_key=None):
+        """
+        Обрабатывает платеж. С ключом идемпотентности повтор не списывает второй раз.
+        При таймауте возвращает результат со статусом 'unknown' (не отказ)
+        """
+        try:
+            if idempotency_key is None:
+                return await self._call(random.uniform(0.5, 2.0), _payment_result, amount)
+            return await self._call(random.uniform(0.5, 2.0), _charge_once, user_id, amount, idempotency_key)
+        except asyncio.TimeoutError:
+            return _timeout_result(amount, idempotency_key)
+
+    async def batch_charge(self, items, description=""):
+        """
+        Пакетное списание одним запросом, как FakePaymentGateway.batch_charge.
+        items - список (user_id, amount, idempotency_key). При таймауте статус
+        каждого платежа пачки 'unknown'
+        """
+        if not items:
+            return []
+        try:
+            return await self._call(random.uniform(0.5, 2.0), _charge_items, items)
+        except asyncio.TimeoutError:
+            return [_timeout_result(amount, idempotency_key) for _, amount, idempotency_key in items]
+
+    async def charge_batches(self, batches, description=""):
+        """
+        Отправляет пачки параллельно (не больше max_in_flight запросов сразу).
+        Платежи с таймаутом перепроверяются по ключу. Возвращает списки
+        результатов в порядке пачек и платежей
+        """
+        results = await asyncio.gather(*[self.batch_charge(items, description) for items in batches])
+        return await asyncio.gather(*[
+            asyncio.gather(*[self._resolve_unknown(result) for result in batch_results])
+            for batch_results in results
+        ])
+
+    async def payment_status(self, idempotency_key):
+        """
+        Уточняет у шлюза результат платежа по ключу идемпотентности.
+        None - платеж не проводился, его можно безопасно отправить снова с тем же ключом
+        """
+        return await self._call(0.3, _stored_result, idempotency_key)
+
+    async def _resolve_unknown(self, result):
+        """Перепроверяет платеж с неизвестным статусом, прежде чем считать его отказом"""
+        if result['status'] != 'unknown' or result['idempotency_key'] is None:
+            return result
+        try:
+            stored = await self.payment_status(result['idempotency_key'])
+        except asyncio.TimeoutError:
+            return result
+        if stored is not None:
+            return stored
+        # Шлюз платеж не проводил: деньги не списаны, это обычный отказ
+        return dict(result, status='failed', message='Платеж не проведен: таймаут соединения')
+
+    async def refund_payment(self, original_transaction_id, amount):
+        """Возврат средств, при таймауте возвращает неуспешный результат"""
+        try:
+            return await self._call(random.uniform(0.5, 1.5), _refund_result, amount)
+        except asyncio.TimeoutError:
             return {
                 'success': False,
                 'refund_id': None,
                 'amount': amount,
                 'status': 'failed',
-                'message': 'Ошибка возврата',
+                'message': 'Таймаут соединения',
                 'timestamp': datetime.now().isoformat()
             }
-    
-    @staticmethod
-    def check_balance(user_id):
+
+    async def check_balance(self, user_id):
+        """Проверяет баланс в платежной системе"""
+        return await self._call(0.3, _balance_result, user_id)
+
+    async def process_payments(self, payments):
         """
-        Проверяет баланс в платежной системе
+        Обрабатывает пачку платежей параллельно.
+        payments - список dict с ключами amount, user_id и (необязательно)
+        description и idempotency_key. Результаты возвращаются в том же порядке.
+        Платежи с таймаутом и ключом перепроверяются по ключу; без ключа статус
+        'unknown' остается - такой платеж нельзя считать отказом.
         """
-        time.sleep(0.3)
-        # Генерируем случайный баланс для тестирования
-        balance = random.uniform(1000, 10000)
-        return {
-            'success': True,
-            'balance': round(balance, 2),
-            'currency': 'RUB',
-            'timestamp': datetime.now().isoformat()
-        }
\ No newline at end of file
+        results = await asyncio.gather(*[
+            self.process_payment(p['amount'], p['user_id'], p.get('description', ''), p.get('idempotency_key'))
+            for p in payments
+        ])
+        return await asyncio.gather(*[self._resolve_unknown(result) for result in results])
+
+
+def process_payments_concurrently(payments, max_in_flight=None, timeout=None):
+    """Синхронная обертка: проводит пачку платежей через асинхронный клиент"""
+    gateway = AsyncFakePaymentGateway(max_in_flight=max_in_flight, timeout=timeout)
+    return asyncio.run(gateway.process_payments(payments))
+
+
+def charge_batches_concurrently(batches, description="", max_in_flight=None, timeout=None):
+    """Синхронная обертка: проводит пачки платежей параллельно через асинхронный клиент"""
+    gateway = AsyncFakePaymentGateway(max_in_flight=max_in_flight, timeout=timeout)
+    return asyncio.run(gateway.charge_batches(batches, description))
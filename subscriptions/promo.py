@@ -0,0 +1,110 @@
+"""
+Погашение промокодов. Использование занимается условным UPDATE
+(used_count = used_count + 1 WHERE used_count < лимит), поэтому лимит не
+превышается при любом числе одновременных покупок. Для популярных кодов лимит
+делится между шардами (PromoCodeShard): покупка занимает место в случайном
+шарде, и конкурирующие транзакции обновляют разные строки.
+"""
+import logging
+import random
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import catalog_cache
+from .models import PromoCode, PromoCodeShard, PromoRedemption
+
+logger = logging.getLogger(__name__)
+
+
+class PromoUnavailable(Exception):
+    """Промокод нельзя применить: исчерпан или неактивен"""
+
+
+def _promo_changed(code):
+    # update() не вызывает save и сигналы: кеш каталога сбрасываем сами, после коммита,
+    # и только для этого кода. Счетчики шардов в кешируемой строке промокода
+    # не хранятся, их изменения кеш не трогают
+    transaction.on_commit(lambda: catalog_cache.invalidate_promo(code))
+
+
+def _claim_shard(promo):
+    """Занимает место в одном из шардов, начиная со случайного. Возвращает номер шарда"""
+    start = random.randrange(promo.shard_count)
+    for offset in range(promo.shard_count):
+        shard = (start + offset) % promo.shard_count
+        claimed = PromoCodeShard.objects.filter(
+            promo_id=promo.id, shard=shard, used_count__lt=F('capacity')
+        ).update(used_count=F('used_count') + 1)
+        if claimed:
+            return shard
+    raise PromoUnavailable("Лимит использований промокода исчерпан")
+
+
+def redeem(promo, user_id, subscription=None, now=None):
+    """
+    Занимает одно использование промокода для пользователя. Вызывается внутри
+    транзакции покупки: при ее откате использование освобождается само.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        redemption = PromoRedemption.objects.create(promo_id=promo.id, user_id=user_id, subscription=subscription)
+
+        active = PromoCode.objects.filter(id=promo.id, is_active=True, valid_from__lte=now, valid_to__gte=now)
+        if promo.shard_count:
+            # Чтение без блокировки: строку промокода не трогаем, чтобы не сериализовать покупки
+            if not active.exists():
+                raise PromoUnavailable("Промокод недействителен или истек срок действия")
+            redemption.shard = _claim_shard(promo)
+            redemption.save(update_fields=['shard'])
+        elif active.filter(used_count__lt=F('max_uses')).update(used_count=F('used_count') + 1, updated_at=now):
+            _promo_changed(promo.code)
+        else:
+            raise PromoUnavailable("Промокод недействителен или лимит использований исчерпан")
+    return redemption
+
+
+def release(redemption):
+    """Возвращает использование (платеж не прошел)"""
+    with transaction.atomic():
+        if redemption.shard is None:
+            promo = PromoCode.objects.filter(id=redemption.promo_id)
+            if promo.filter(used_count__gt=0).update(used_count=F('used_count') - 1, updated_at=timezone.now()):
+                _promo_changed(promo.values_list('code', flat=True).get())
+        else:
+            PromoCodeShard.objects.filter(
+                promo_id=redemption.promo_id, shard=redemption.shard, used_count__gt=0
+            ).update(used_count=F('used_count') - 1)
+        PromoRedemption.objects.filter(id=redemption.id).delete()
+
+
+def redeemed_count(promo):
+    """Сколько раз промокод использован (с учетом шардов)"""
+    sharded = PromoCodeShard.objects.filter(promo_id=promo.id).aggregate(total=Sum('used_count'))['total']
+    return PromoCode.objects.get(id=promo.id).used_count + (sharded or 0)
+
+
+def shard_promo(promo, shard_count):
+    """
+    Делит оставшийся лимит промокода между shard_count шардами
+    (0 - вернуть единый счетчик). Уже занятые в шардах использования
+    переносятся в used_count. Запускать вне пика покупок: возврат использования
+    в удаленный шард теряется.
+    """
+    with transaction.atomic():
+        promo = PromoCode.objects.select_for_update().get(id=promo.id)
+        shards = PromoCodeShard.objects.filter(promo=promo)
+        promo.used_count += shards.aggregate(total=Sum('used_count'))['total'] or 0
+        shards.delete()
+
+        remaining = max(0, promo.max_uses - promo.used_count)
+        base, extra = divmod(remaining, shard_count) if shard_count else (0, 0)
+        PromoCodeShard.objects.bulk_create([
+            PromoCodeShard(promo=promo, shard=shard, capacity=base + (1 if shard < extra else 0))
+            for shard in range(shard_count)
+        ])
+        promo.shard_count = shard_count
+        promo.save(update_fields=['used_count', 'shard_count'])
+    logger.info(f"Промокод {promo.code}: шардов {shard_count}, свободно использований {remaining}")
+    return promo
@@ -0,0 +1,96 @@
+"""
+Фиксация и отмена покупки подписки. Покупка идет в три шага: резерв (списание
+с баланса, pending-подписка и pending-транзакция), платеж вне транзакции БД и
+фиксация результата. Фиксация и отмена меняют статус транзакции условным UPDATE
+(только из pending), поэтому из двух участников - запроса покупки и уборщика
+зависших покупок - сработает один, и резерв не вернется дважды.
+
+Если процесс упал между резервом и фиксацией, покупка так и осталась бы pending
+с занятыми деньгами и промокодом: sweep_stale_purchases отменяет такие покупки
+старше PURCHASE_PENDING_TIMEOUT_SECONDS.
+"""
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import PromoRedemption, Transaction, UserSubscription
+from .promo import release
+from users.balance import credit
+
+logger = logging.getLogger(__name__)
+
+
+def get_pending_timeout():
+    return timedelta(seconds=getattr(settings, 'PURCHASE_PENDING_TIMEOUT_SECONDS', 900))
+
+
+def _pending(purchase):
+    return Transaction.objects.filter(id=purchase.id, status='pending')
+
+
+def complete_purchase(purchase, payment_result):
+    """
+    Проводит оплаченную покупку и активирует подписку.
+    False - покупка уже отменена (например, уборщиком), активировать нечего
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        if not _pending(purchase).update(status='completed', payment_data=payment_result, updated_at=now):
+            return False
+        subscription = purchase.subscription
+        subscription.status = 'active'
+        subscription.start_date = now
+        subscription.end_date = now + timedelta(days=subscription.plan.duration_days)
+        subscription.save()
+    purchase.status = 'completed'
+    purchase.payment_data = payment_result
+    return True
+
+
+def reverse_purchase(purchase, payment_result=None, description=None):
+    """
+    Отменяет зарезервированную покупку: возвращает средства и использование
+    промокода, закрывает pending-подписку. Возвращает новый баланс или None,
+    если покупка уже проведена или отменена
+    """
+    with transaction.atomic():
+        if not _pending(purchase).update(
+            status='failed', payment_data=payment_result or purchase.payment_data, updated_at=timezone.now()
+        ):
+            return None
+        for redemption in PromoRedemption.objects.filter(subscription_id=purchase.subscription_id):
+            release(redemption)
+        UserSubscription.objects.filter(id=purchase.subscription_id, status='pending').update(
+            status='expired', updated_at=timezone.now()
+        )
+        balance = credit(
+            purchase.user_id, purchase.amount, 'purchase_reversal', purchase,
+            description or f'Возврат резерва: {purchase.description}'
+        )
+    purchase.status = 'failed'
+    return balance
+
+
+def stale_purchases(now=None):
+    """Покупки, которые дольше таймаута ждут фиксации"""
+    now = now or timezone.now()
+    return Transaction.objects.filter(
+        status='pending',
+        transaction_type='subscription_purchase',
+        created_at__lt=now - get_pending_timeout()
+    )
+
+
+def sweep_stale_purchases(now=None):
+    """Отменяет зависшие покупки и возвращает их резерв. Возвращает число отмененных"""
+    reversed_count = 0
+    for purchase in stale_purchases(now).order_by('created_at').iterator():
+        if reverse_purchase(purchase, description=f'Возврат резерва зависшей покупки: {purchase.description}') is not None:
+            reversed_count += 1
+            logger.warning(f"Покупка {purchase.id} пользователя {purchase.user_id} не была завершена, резерв возвращен")
+    if reversed_count:
+        logger.info(f"Отменено зависших покупок: {reversed_count}")
+    return reversed_count
@@ -0,0 +1,140 @@
+"""
+Сверка User.balance с журналом транзакций. Ожидаемый баланс пользователя -
+сумма зачислений минус сумма списаний по проведенным транзакциям. Пользователи
+обрабатываются пачками по id (один агрегирующий запрос на пачку), поэтому память
+не зависит от размера журнала. Инкрементальный запуск проверяет только тех, у кого
+транзакции менялись после отметки Checkpoint, и тех, у кого уже было расхождение.
+"""
+from decimal import Decimal
+import logging
+
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.db.models.functions import Abs
+from django.utils import timezone
+
+from .models import Transaction, BalanceReconciliation, Checkpoint
+from .rollup import get_safety_lag
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+RECONCILIATION_CHECKPOINT = 'balance_reconciliation'
+
+CREDIT_TYPES = ('deposit', 'topup', 'refund')
+DEBIT_TYPES = ('subscription_purchase', 'subscription_renewal', 'payment')
+
+# Транзакции, которые изменили баланс: проведенные (в т.ч. позже возвращенные -
+# возврат отдельной транзакцией) и покупки, по которым средства уже зарезервированы
+BALANCE_AFFECTING = (
+    Q(status__in=['completed', 'refunded'])
+    | Q(transaction_type='subscription_purchase', status='pending')
+)
+
+
+def get_chunk_size():
+    return max(1, getattr(settings, 'RECONCILIATION_CHUNK_SIZE', 1000))
+
+
+def _chunks(queryset, field, chunk_size):
+    """Поток различных значений field пачками по возрастанию (keyset, без OFFSET)"""
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(**{f'{field}__gt': last})
+        chunk = list(page.order_by(field).values_list(field, flat=True).distinct()[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
+
+
+def expected_balances(user_ids):
+    """Ожидаемый баланс по журналу для пачки пользователей"""
+    rows = (
+        Transaction.objects.filter(BALANCE_AFFECTING, user_id__in=user_ids)
+        .order_by()
+        .values('user_id')
+        .annotate(
+            credits=Sum('amount', filter=Q(transaction_type__in=CREDIT_TYPES)),
+            debits=Sum('amount', filter=Q(transaction_type__in=DEBIT_TYPES)),
+        )
+    )
+    expected = {user_id: Decimal('0') for user_id in user_ids}
+    for row in rows:
+        expected[row['user_id']] = (row['credits'] or 0) - (row['debits'] or 0)
+    return expected
+
+
+def reconcile_users(user_ids, now=None):
+    """Сверяет пачку пользователей и сохраняет результат. Возвращает (проверено, расхождений)"""
+    now = now or timezone.now()
+    expected = expected_balances(user_ids)
+    records = []
+    for user_id, balance in User.objects.filter(id__in=user_ids).values_list('id', 'balance'):
+        drift = balance - expected[user_id]
+        records.append(BalanceReconciliation(
+            user_id=user_id,
+            expected_balance=expected[user_id],
+            stored_balance=balance,
+            drift=drift,
+            has_drift=drift != 0,
+            checked_at=now,
+        ))
+        if drift:
+            logger.warning(f"Расхождение баланса пользователя {user_id}: "
+                           f"баланс {balance}, по журналу {expected[user_id]}, разница {drift}")
+
+    BalanceReconciliation.objects.bulk_create(
+        records,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['expected_balance', 'stored_balance', 'drift', 'has_drift', 'checked_at'],
+    )
+    return len(records), sum(1 for record in records if record.has_drift)
+
+
+def get_checkpoint():
+    """Время, до которого изменения транзакций уже сверены (None - ни разу)"""
+    checkpoint = Checkpoint.objects.filter(name=RECONCILIATION_CHECKPOINT).first()
+    return checkpoint.position if checkpoint else None
+
+
+def _user_streams(position, upper, now, chunk_size):
+    if position is None:
+        yield from _chunks(User.objects.all(), 'id', chunk_size)
+        return
+    changed = Transaction.objects.filter(updated_at__gt=position, updated_at__lte=upper)
+    yield from _chunks(changed, 'user_id', chunk_size)
+    # Расхождения прошлых запусков перепроверяем, даже если транзакций не было
+    stale = BalanceReconciliation.objects.filter(has_drift=True, checked_at__lt=now)
+    yield from _chunks(stale, 'user_id', chunk_size)
+
+
+def run_reconciliation(full=False, now=None, chunk_size=None):
+    """
+    Сверяет балансы и сдвигает отметку. full - проверить всех пользователей.
+    Возвращает {'checked': ..., 'drifted': ..., 'position': ...}
+    """
+    now = now or timezone.now()
+    upper = now - get_safety_lag()
+    position = None if full else get_checkpoint()
+    chunk_size = chunk_size or get_chunk_size()
+
+    checked = drifted = 0
+    for user_ids in _user_streams(position, upper, now, chunk_size):
+        batch_checked, batch_drifted = reconcile_users(user_ids, now)
+        checked += batch_checked
+        drifted += batch_drifted
+
+    Checkpoint.objects.update_or_create(name=RECONCILIATION_CHECKPOINT, defaults={'position': upper})
+    logger.info(f"Сверка балансов до {upper}: проверено {checked}, расхождений {drifted}")
+    return {'checked': checked, 'drifted': drifted, 'position': upper}
+
+
+def drift_report():
+    """Пользователи с расхождением по последней сверке, сначала самые крупные"""
+    return (
+        BalanceReconciliation.objects.filter(has_drift=True)
+        .select_related('user')
+        .order_by(Abs('drift').desc(), 'user_id')
+    )
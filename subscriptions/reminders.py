@@ -0,0 +1,215 @@
+"""
+Напоминания об окончании подписок. Подписки, заканчивающиеся в пределах
+горизонтов EXPIRY_REMINDER_HORIZONS_DAYS, выбираются одним диапазонным запросом
+по индексу (status, end_date); каждой назначается наименьший горизонт, в который
+она попала. Отправленные напоминания (ExpirationReminder) не повторяются, а после
+меньшего горизонта не отправляется больший.
+
+Несколько подписок пользователя объединяются в одно уведомление и одно письмо.
+Пользователи обрабатываются пачками: напоминания, уведомления и письма пачки
+пишутся bulk-запросами в одной транзакции, поэтому после сбоя повторный запуск
+не отправит ничего дважды.
+"""
+from collections import defaultdict
+from datetime import timedelta
+import logging
+import math
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .email_service import send_bulk_email, subscription_expiring_context
+from .models import UserSubscription, ExpirationReminder
+from users.models import User
+from users.notifications import NotificationBuffer
+
+logger = logging.getLogger(__name__)
+
+
+def get_horizons():
+    """Горизонты напоминаний в днях, по возрастанию"""
+    return sorted({int(days) for days in getattr(settings, 'EXPIRY_REMINDER_HORIZONS_DAYS', (7, 3, 1)) if int(days) > 0})
+
+
+def get_chunk_size():
+    return max(1, getattr(settings, 'EXPIRY_REMINDER_CHUNK_SIZE', 500))
+
+
+def expiring_subscriptions(now, until):
+    return UserSubscription.objects.filter(
+        status='active',
+        end_date__gt=now,
+        end_date__lte=until
+    ).order_by()
+
+
+def horizon_for(end_date, now, horizons):
+    """Наименьший горизонт, в который попадает срок окончания"""
+    left = end_date - now
+    for days in horizons:
+        if left <= timedelta(days=days):
+            return days
+    return None
+
+
+def days_left(end_date, now):
+    return max(1, math.ceil((end_date - now).total_seconds() / 86400))
+
+
+def collect_candidates(now, horizons, user_ids=None):
+    """{user_id: [(subscription_id, end_date, plan_name, horizon), ...]} - один проход по индексу"""
+    candidates = defaultdict(list)
+    rows = expiring_subscriptions(now, now + timedelta(days=horizons[-1]))
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    rows = rows.values_list('id', 'user_id', 'end_date', 'plan__name')
+    for subscription_id, user_id, end_date, plan_name in rows.iterator(chunk_size=get_chunk_size()):
+        candidates[user_id].append((subscription_id, end_date, plan_name, horizon_for(end_date, now, horizons)))
+    return candidates
+
+
+def _notification_text(items, now):
+    if len(items) == 1:
+        _, end_date, plan_name, _ = items[0]
+        return (
+            'Подписка скоро истечет',
+            f'Подписка "{plan_name}" истекает через {days_left(end_date, now)} дн. '
+            f'({timezone.localtime(end_date):%d.%m.%Y}). Убедитесь, что на счете достаточно средств для автопродления.'
+        )
+    listed = ', '.join(f'"{plan_name}" (через {days_left(end_date, now)} дн.)' for _, end_date, plan_name, _ in items)
+    return (
+        f'Скоро истекают подписки: {len(items)}',
+        f'Скоро истекают подписки: {listed}. Убедитесь, что на счете достаточно средств для автопродления.'
+    )
+
+
+def remind_chunk(now, chunk, notifications):
+    """
+    Отправляет напоминания пачке пользователей: chunk - {user_id: [кандидаты]}.
+    Возвращает (пользователей, напоминаний, писем).
+    """
+    subscription_ids = [item[0] for items in chunk.values() for item in items]
+    with transaction.atomic():
+        # Наименьший уже отправленный горизонт для каждого срока подписки
+        sent = {}
+        for subscription_id, end_date, horizon in ExpirationReminder.objects.filter(
+            subscription_id__in=subscription_ids
+        ).values_list('subscription_id', 'end_date', 'horizon_days'):
+            key = (subscription_id, end_date)
+            sent[key] = min(horizon, sent.get(key, horizon))
+
+        due = {}
+        for user_id, items in chunk.items():
+            items = [item for item in items if sent.get((item[0], item[1]), item[3] + 1) > item[3]]
+            if items:
+                due[user_id] = sorted(items, key=lambda item: item[1])
+        if not due:
+            return 0, 0, 0
+
+        ExpirationReminder.objects.bulk_create([
+            ExpirationReminder(subscription_id=subscription_id, user_id=user_id, end_date=end_date, horizon_days=horizon)
+            for user_id, items in due.items()
+            for subscription_id, end_date, _, horizon in items
+        ])
+
+        single, digests = [], []
+        emails = dict(User.objects.filter(id__in=due).exclude(email='').values_list('id', 'email'))
+        for user_id, items in due.items():
+            title, message = _notification_text(items, now)
+            notifications.add(
+                user_id=user_id,
+                notification_type='subscription_expiring',
+                title=title,
+                message=message,
+                data={'subscriptions': [
+                    {
+                        'subscription_id': subscription_id,
+                        'plan_name': plan_name,
+                        'end_date': end_date.isoformat(),
+                        'days_left': days_left(end_date, now),
+                    }
+                    for subscription_id, end_date, plan_name, _ in items
+                ]}
+            )
+
+            if user_id not in emails:
+                continue
+            contexts = [
+                subscription_expiring_context(plan_name, days_left(end_date, now), timezone.localtime(end_date))
+                for _, end_date, plan_name, _ in items
+            ]
+            if len(contexts) == 1:
+                single.append((emails[user_id], contexts[0]))
+            else:
+                digests.append((emails[user_id], {'subscriptions': contexts}))
+
+        sent_emails = send_bulk_email('subscription_expiring', single) if single else 0
+        sent_emails += send_bulk_email('subscription_expiring_digest', digests) if digests else 0
+
+    return len(due), sum(len(items) for items in due.values()), sent_emails
+
+
+def _remind_safely(now, chunk, notifications):
+    try:
+        users, reminders, emails = remind_chunk(now, chunk, notifications)
+    except IntegrityError:
+        # Параллельный запуск уже отправил напоминания этой пачке
+        logger.warning(f"Пачка напоминаний с пользователя {min(chunk)} уже обработана другим запуском")
+        return {'users': 0, 'reminders': 0, 'emails': 0}
+    return {'users': users, 'reminders': reminders, 'emails': emails}
+
+
+def remind_users(user_ids, now=None):
+    """Напоминания пачке пользователей (отдельная задача воркера Celery)"""
+    now = now or timezone.now()
+    horizons = get_horizons()
+    if not horizons or not user_ids:
+        return {'users': 0, 'reminders': 0, 'emails': 0}
+    with NotificationBuffer() as notifications:
+        return _remind_safely(now, collect_candidates(now, horizons, user_ids), notifications)
+
+
+def expiring_user_ids(now=None):
+    """id пользователей, которым может понадобиться напоминание, по возрастанию"""
+    now = now or timezone.now()
+    horizons = get_horizons()
+    if not horizons:
+        return []
+    return list(
+        expiring_subscriptions(now, now + timedelta(days=horizons[-1]))
+        .values_list('user_id', flat=True).distinct().order_by('user_id')
+    )
+
+
+def purge_reminders(now=None):
+    """Напоминания по прошедшим срокам для дедупликации больше не нужны"""
+    return ExpirationReminder.objects.filter(end_date__lt=now or timezone.now()).delete()[0]
+
+
+def send_expiration_reminders(now=None, chunk_size=None):
+    """
+    Напоминает об окончании подписок по всем горизонтам. Запуск идемпотентен:
+    повторный вызов в тот же день ничего не отправит.
+    """
+    now = now or timezone.now()
+    chunk_size = chunk_size or get_chunk_size()
+    horizons = get_horizons()
+    report = {'users': 0, 'reminders': 0, 'emails': 0}
+    if not horizons:
+        return report
+
+    candidates = collect_candidates(now, horizons)
+    user_ids = sorted(candidates)
+    with NotificationBuffer() as notifications:
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = {user_id: candidates[user_id] for user_id in user_ids[start:start + chunk_size]}
+            for key, value in _remind_safely(now, chunk, notifications).items():
+                report[key] += value
+
+    purge_reminders(now)
+    logger.info(
+        f"Напоминания об окончании: пользователей {report['users']}, "
+        f"подписок {report['reminders']}, писем {report['emails']}"
+    )
+    return report
@@ -0,0 +1,512 @@
+"""
+Движок автопродления подписок: подписки к продлению берутся из расписания
+(RenewalSchedule), делятся на шарды по user_id,
+каждый шард списывается пакетными запросами к шлюзу (пачки уходят параллельно
+через асинхронный клиент), а проверка и применение
+результатов идут в пуле потоков шарда. Все подписки одного пользователя
+обрабатываются последовательно; деньги списываются условным UPDATE (users.balance),
+запись пользователя не блокируется.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict
+from datetime import timedelta
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import UserSubscription, Transaction
+from .payment_gateway import FakePaymentGateway, charge_batches_concurrently
+from .schedule import (
+    RENEWAL_WINDOW, claim_due, claim_subscriptions, reschedule, schedule_many, get_pending_retry_delay
+)
+from . import retry_queue
+from users.models import User
+from users.notifications import NotificationBuffer
+from users.balance import debit, InsufficientFunds
+
+logger = logging.getLogger(__name__)
+
+# Итоги обработки одной подписки
+RENEWED = 'renewed'
+INSUFFICIENT_FUNDS = 'insufficient_funds'
+PAYMENT_FAILED = 'payment_failed'
+SKIPPED = 'skipped'
+ERROR = 'error'
+# Шлюз не ответил, и статус платежа уточнить не удалось: подписка остается взятой
+# до конца аренды и потом повторяется с тем же ключом (второй раз не спишется)
+PAYMENT_UNKNOWN = 'payment_unknown'
+
+
+def get_shard_count():
+    return max(1, getattr(settings, 'RENEWAL_SHARD_COUNT', 4))
+
+
+def get_workers_per_shard():
+    return max(1, getattr(settings, 'RENEWAL_WORKERS_PER_SHARD', 4))
+
+
+def get_batch_size():
+    return max(1, getattr(settings, 'RENEWAL_BATCH_SIZE', 500))
+
+
+def shard_for_user(user_id, shard_count):
+    """Номер шарда для пользователя"""
+    return user_id % shard_count
+
+
+def due_subscriptions(now=None):
+    """Подписки, которые пора продлевать (или которые ждут пополнения баланса)"""
+    now = now or timezone.now()
+    return UserSubscription.objects.filter(
+        status__in=['active', 'pending_renewal'],
+        auto_renew=True,
+        end_date__lte=now + RENEWAL_WINDOW
+    )
+
+
+def group_by_user(rows):
+    """Группирует пары (subscription_id, user_id): {user_id: [subscription_id, ...]}"""
+    users = defaultdict(list)
+    for subscription_id, user_id in rows:
+        users[user_id].append(subscription_id)
+    return users
+
+
+def split_into_shards(rows, shard_count):
+    """
+    Раскладывает пары (subscription_id, user_id) по шардам.
+    Возвращает {shard: {user_id: [subscription_id, ...]}}
+    """
+    shards = defaultdict(lambda: defaultdict(list))
+    for subscription_id, user_id in rows:
+        shards[shard_for_user(user_id, shard_count)][user_id].append(subscription_id)
+    return shards
+
+
+def idempotency_key(sub, attempt=None):
+    """
+    Ключ платежа за конкретный период подписки: повтор не спишет деньги дважды.
+    Повторы после отказа шлюза получают свой ключ на каждую попытку, иначе шлюз
+    вернул бы сохраненный отказ.
+    """
+    key = f"renewal:{sub.id}:{sub.end_date.strftime('%Y%m%d%H%M%S')}"
+    return f"{key}:retry{attempt}" if attempt else key
+
+
+def is_due(sub, now=None):
+    """Подписка все еще подлежит продлению (ее могли отменить или уже продлить)"""
+    now = now or timezone.now()
+    return (sub.status in ('active', 'pending_renewal') and sub.auto_renew
+            and sub.end_date is not None and sub.end_date <= now + RENEWAL_WINDOW)
+
+
+def mark_insufficient_funds(sub, user, notifications):
+    """Переводит подписку в ожидание пополнения баланса"""
+    plan = sub.plan
+    if sub.status != 'pending_renewal':
+        sub.status = 'pending_renewal'
+        sub.save()
+        notifications.add(
+            user=user,
+            notification_type='payment_failed',
+            title='Недостаточно средств',
+            message=f'Для продления "{plan.name}" нужно {plan.price} руб. Пополните баланс.'
+        )
+
+
+def apply_renewal(sub, user, payment_result, notifications, description=None):
+    """
+    Списывает деньги и продлевает подписку после успешного платежа.
+    Вызывается внутри транзакции, запись подписки уже заблокирована.
+    Если средств уже не хватает - InsufficientFunds (транзакция откатывается).
+    """
+    plan = sub.plan
+
+    # Продлеваем от даты окончания или от текущей (если уже просрочена)
+    base_date = max(sub.end_date, timezone.now())
+    sub.end_date = base_date + timedelta(days=plan.duration_days)
+    sub.status = 'active'
+    sub.save()
+
+    renewal = Transaction.objects.create(
+        user=user,
+        subscription=sub,
+        amount=plan.price,
+        transaction_type='subscription_renewal',
+        status='completed',
+        description=description or f'Автопродление: {plan.name}',
+        payment_data=payment_result
+    )
+    user.balance = debit(user.id, plan.price, 'subscription_renewal', renewal, renewal.description)
+
+    notifications.add(
+        user=user,
+        notification_type='payment_success',
+        title='Подписка продлена',
+        message=f'Подписка "{plan.name}" успешно продлена до {sub.end_date.strftime("%d.%m.%Y")}.'
+    )
+
+
+def _outcome(subscription_id, outcome, **extra):
+    return dict(extra, subscription_id=subscription_id, outcome=outcome)
+
+
+def prepare_user(user_id, subscription_ids, notifications, attempts=None):
+    """
+    Фаза 1: проверяет, какие подписки можно оплатить. Несколько подписок одного
+    пользователя резервируют баланс по очереди. Проверка предварительная, без
+    блокировки: окончательно баланс проверяет условное списание в фазе 2.
+    attempts - {subscription_id: номер попытки} для повторов из очереди.
+    Возвращает (итоги для неоплачиваемых подписок, список платежей).
+    """
+    attempts = attempts or {}
+    outcomes = []
+    charges = []
+    with transaction.atomic():
+        user = User.objects.get(id=user_id)
+        reserved = 0
+        subscriptions = UserSubscription.objects.select_related('plan').filter(id__in=subscription_ids)
+        for sub in subscriptions.order_by('end_date'):
+            if not is_due(sub):
+                outcomes.append(_outcome(sub.id, SKIPPED))
+                continue
+
+            if user.balance - reserved < sub.plan.price:
+                mark_insufficient_funds(sub, user, notifications)
+                outcomes.append(_outcome(
+                    sub.id, INSUFFICIENT_FUNDS,
+                    balance=user.balance - reserved, price=sub.plan.price
+                ))
+                continue
+
+            reserved += sub.plan.price
+            charges.append((sub.id, user_id, sub.plan.price, idempotency_key(sub, attempts.get(sub.id))))
+    return outcomes, charges
+
+
+def settle_user(user_id, settlements, notifications, description=None):
+    """
+    Фаза 2: применяет результаты платежей одного пользователя.
+    settlements - список (subscription_id, payment_result).
+    """
+    outcomes = []
+    for subscription_id, payment_result in settlements:
+        if payment_result['status'] == 'unknown':
+            logger.warning(f"Статус платежа за подписку {subscription_id} неизвестен, повтор после аренды")
+            outcomes.append(_outcome(subscription_id, PAYMENT_UNKNOWN, error=payment_result['message']))
+            continue
+
+        if not payment_result['success']:
+            logger.warning(f"Платеж за продление подписки {subscription_id} отклонен: {payment_result['message']}")
+            outcomes.append(_outcome(
+                subscription_id, PAYMENT_FAILED,
+                user_id=user_id, amount=payment_result['amount'], error=payment_result['message']
+            ))
+            continue
+
+        try:
+            with transaction.atomic():
+                user = User.objects.get(id=user_id)
+                sub = UserSubscription.objects.select_for_update().select_related('plan').get(id=subscription_id)
+
+                if is_due(sub):
+                    apply_renewal(sub, user, payment_result, notifications, description)
+                    outcomes.append(_outcome(
+                        subscription_id, RENEWED,
+                        new_end_date=sub.end_date, new_balance=user.balance
+                    ))
+                    continue
+        except InsufficientFunds:
+            pass
+
+        if payment_result.get('replayed'):
+            # Шлюз вернул сохраненный результат по тому же ключу: этот платеж уже
+            # применен (или возвращен) другим прогоном - возвращать его нельзя
+            logger.info(f"Платеж за подписку {subscription_id} уже обработан другим прогоном, пропуск")
+            outcomes.append(_outcome(subscription_id, SKIPPED))
+            continue
+
+        # Пока шел новый платеж, баланс или подписка изменились - возвращаем его сумму
+        logger.warning(f"Состояние подписки {subscription_id} изменилось во время платежа, возврат средств")
+        FakePaymentGateway.refund_payment(payment_result['transaction_id'], payment_result['amount'])
+        outcomes.append(_outcome(subscription_id, SKIPPED))
+    return outcomes
+
+
+def _in_thread(func, *args):
+    try:
+        return func(*args)
+    finally:
+        # Каждый поток открывает свое соединение с БД - закрываем его сами
+        connection.close()
+
+
+def _map_users(pool, func, per_user, on_error, *extra):
+    """Запускает func(user_id, items, *extra) для каждого пользователя в пуле"""
+    results = []
+    futures = {
+        pool.submit(_in_thread, func, user_id, items, *extra): items
+        for user_id, items in per_user.items()
+    }
+    for future in as_completed(futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logger.error(f"Ошибка в задаче продления: {e}")
+            results.append(on_error(futures[future], e))
+    return results
+
+
+def _prepare_failed(subscription_ids, error):
+    return [_outcome(subscription_id, ERROR, error=str(error)) for subscription_id in subscription_ids], []
+
+
+def _settle_failed(settlements, error):
+    return [_outcome(subscription_id, ERROR, error=str(error)) for subscription_id, _ in settlements]
+
+
+def renew_batch(users, workers=None, description=None, notifications=None, attempts=None):
+    """
+    Продлевает набор подписок {user_id: [subscription_id, ...]}: проверка балансов
+    в пуле потоков, один пакетный платеж на каждые RENEWAL_BATCH_SIZE подписок,
+    затем применение результатов в том же пуле. Возвращает итоги по подпискам.
+    Уведомления пишутся пачками через общий буфер notifications.
+    """
+    if notifications is None:
+        with NotificationBuffer() as notifications:
+            return renew_batch(users, workers, description, notifications, attempts)
+
+    workers = workers or get_workers_per_shard()
+    batch_size = get_batch_size()
+    outcomes = []
+    charges = []
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='renewal') as pool:
+        for user_outcomes, user_charges in _map_users(pool, prepare_user, users, _prepare_failed, notifications, attempts):
+            outcomes.extend(user_outcomes)
+            charges.extend(user_charges)
+
+        # Пачки уходят в шлюз параллельно через асинхронный клиент
+        chunks = [charges[start:start + batch_size] for start in range(0, len(charges), batch_size)]
+        results = charge_batches_concurrently(
+            [[(user_id, float(amount), key) for _, user_id, amount, key in chunk] for chunk in chunks],
+            description=description or 'Автопродление подписок'
+        ) if chunks else []
+
+        settlements = defaultdict(list)
+        for chunk, chunk_results in zip(chunks, results):
+            for (subscription_id, user_id, _, _), payment_result in zip(chunk, chunk_results):
+                settlements[user_id].append((subscription_id, payment_result))
+
+        for user_outcomes in _map_users(pool, settle_user, settlements, _settle_failed, notifications, description):
+            outcomes.extend(user_outcomes)
+
+    return outcomes
+
+
+def queue_failed_payments(outcomes):
+    """Отправляет отклоненные шлюзом платежи в очередь повторов"""
+    return retry_queue.record_failures([
+        (outcome['subscription_id'], outcome['user_id'], outcome['amount'], outcome['error'])
+        for outcome in outcomes if outcome['outcome'] == PAYMENT_FAILED
+    ])
+
+
+def renew_pending_for_user(user_id):
+    """
+    Продлевает подписки пользователя, ждавшие пополнения баланса (pending_renewal).
+    Вызывается после пополнения вместо общего прогона по всем подпискам.
+    """
+    subscription_ids = list(
+        due_subscriptions().filter(user_id=user_id, status='pending_renewal').values_list('id', flat=True)
+    )
+    outcomes = renew_now(subscription_ids, workers=1)
+    renewed = sum(1 for outcome in outcomes if outcome['outcome'] == RENEWED)
+    logger.info(f"Пополнение пользователя {user_id}: продлено {renewed} из {len(outcomes)} ожидавших подписок")
+    return outcomes
+
+
+def renew_now(subscription_ids, description=None, workers=None):
+    """
+    Продлевает конкретные подписки вне расписания тем же путем, что и прогон:
+    аренда в расписании, продление, разбор итогов (finish_renewals).
+    Подписки, которые держит другой воркер или очередь повторов, пропускаются
+    и в итоги не попадают.
+    """
+    # Аренда в расписании: ту же подписку не спишет параллельно прогон продлений или повторов
+    claimed = claim_subscriptions(subscription_ids)
+    if not claimed:
+        return []
+    rows = UserSubscription.objects.filter(id__in=claimed).values_list('id', 'user_id')
+    outcomes = renew_batch(group_by_user(rows), workers, description)
+    finish_renewals(outcomes)
+    return outcomes
+
+
+def finish_renewals(outcomes):
+    """
+    Разбирает итоги прогона и возвращает счетчики по итогам.
+    Продленные подписки уже перенесены сигналом на следующий период.
+    Отказы шлюза уходят в очередь повторов с нарастающей задержкой, прочие
+    ошибки остаются до конца аренды. Без денег ждем дольше
+    (после пополнения продление запускается отдельно)
+    """
+    totals = defaultdict(int)
+    waiting_for_funds = []
+    failed_payments = []
+    for outcome in outcomes:
+        totals[outcome['outcome']] += 1
+        if outcome['outcome'] == INSUFFICIENT_FUNDS:
+            waiting_for_funds.append(outcome['subscription_id'])
+        elif outcome['outcome'] == PAYMENT_FAILED:
+            failed_payments.append(outcome)
+
+    if waiting_for_funds:
+        reschedule(waiting_for_funds, get_pending_retry_delay())
+    queue_failed_payments(failed_payments)
+    return totals
+
+
+def renew_shard(users, workers_per_shard=None):
+    """
+    Продлевает один шард {user_id: [subscription_id, ...]} целиком, включая
+    перенос и очередь повторов. Для воркеров Celery, где каждый шард - отдельная
+    задача. Возвращает счетчики по итогам.
+    """
+    started = time.monotonic()
+    totals = finish_renewals(renew_batch(users, workers_per_shard))
+    logger.info(f"Шард продления: {len(users)} пользователей, {dict(totals)} за {time.monotonic() - started:.2f} с")
+    return totals
+
+
+def build_report(totals, shard_count, workers_per_shard, elapsed):
+    processed = sum(totals.values())
+    report = {
+        'shards': shard_count,
+        'workers_per_shard': workers_per_shard,
+        'processed': processed,
+        'renewed': totals[RENEWED],
+        'insufficient_funds': totals[INSUFFICIENT_FUNDS],
+        'payment_failed': totals[PAYMENT_FAILED],
+        'skipped': totals[SKIPPED],
+        'errors': totals[ERROR],
+        'payment_unknown': totals[PAYMENT_UNKNOWN],
+        'elapsed_seconds': round(elapsed, 3),
+        'renewals_per_second': round(totals[RENEWED] / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    logger.info(
+        f"Продление завершено: обработано {processed}, продлено {report['renewed']} "
+        f"за {report['elapsed_seconds']} с ({report['renewals_per_second']} продлений/с, "
+        f"{shard_count} шардов x {workers_per_shard} потоков)"
+    )
+    return report
+
+
+def run_renewals(shard_count=None, workers_per_shard=None, now=None):
+    """
+    Полный прогон продления: забирает наступившие записи расписания, делит их
+    на шарды и обрабатывает шарды параллельно. Возвращает отчет с пропускной способностью.
+    """
+    shard_count = shard_count or get_shard_count()
+    workers_per_shard = workers_per_shard or get_workers_per_shard()
+    started = time.monotonic()
+
+    rows = claim_due(now)
+    shards = split_into_shards(rows, shard_count)
+
+    outcomes = []
+    with NotificationBuffer() as notifications:
+        if shards:
+            with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix='renewal-shard') as pool:
+                futures = [
+                    pool.submit(renew_batch, users, workers_per_shard, None, notifications)
+                    for users in shards.values()
+                ]
+                for future in as_completed(futures):
+                    outcomes.extend(future.result())
+
+    totals = finish_renewals(outcomes)
+    report = build_report(totals, shard_count, workers_per_shard, time.monotonic() - started)
+    report['notification_inserts'] = notifications.statements
+    return report
+
+
+def retry_due_payments(now=None, batch_size=None):
+    """
+    Повторяет наступившие платежи из очереди FailedPayment пачками по
+    PAYMENT_RETRY_BATCH_SIZE. Оплаченные и больше не нужные повторы
+    закрываются, отклоненные откладываются, после лимита попыток
+    пользователь получает уведомление. Возвращает счетчики итогов.
+    """
+    totals = defaultdict(int)
+    with NotificationBuffer() as notifications:
+        while True:
+            claimed = retry_queue.claim_due(now, batch_size)
+            if not claimed:
+                break
+            for outcome, count in retry_claimed(claimed, notifications).items():
+                totals[outcome] += count
+
+    if totals:
+        logger.info(f"Повторы платежей: {dict(totals)}")
+    return dict(totals)
+
+
+def retry_claimed(claimed, notifications=None):
+    """
+    Повторяет уже взятые из очереди платежи: claimed - строки
+    (failed_payment_id, subscription_id, user_id, attempt_count) из claim_due.
+    Возвращает счетчики итогов.
+    """
+    if notifications is None:
+        with NotificationBuffer() as notifications:
+            return retry_claimed(claimed, notifications)
+
+    totals = defaultdict(int)
+    users = defaultdict(list)
+    attempts = {}
+    for _, subscription_id, user_id, attempt_count in claimed:
+        users[user_id].append(subscription_id)
+        attempts[subscription_id] = attempt_count + 1
+
+    results = {
+        outcome['subscription_id']: outcome
+        for outcome in renew_batch(users, None, 'Повторное списание за продление', notifications, attempts)
+    }
+
+    resolved = []
+    to_schedule = []
+    failed = []
+    for failed_payment_id, subscription_id, _, _ in claimed:
+        outcome = results.get(subscription_id) or _outcome(subscription_id, ERROR, error='Нет результата')
+        totals[outcome['outcome']] += 1
+        if outcome['outcome'] == PAYMENT_UNKNOWN:
+            # Попытку не засчитываем: после аренды повтор пойдет с тем же ключом
+            continue
+        if outcome['outcome'] in (PAYMENT_FAILED, ERROR):
+            failed.append((failed_payment_id, outcome['error']))
+            continue
+        resolved.append(failed_payment_id)
+        if outcome['outcome'] != RENEWED:
+            # Ждет пополнения или уже не требует продления: пока шли повторы, подписки
+            # не было в расписании, возвращаем ее туда по текущему состоянию
+            to_schedule.append(subscription_id)
+
+    retry_queue.resolve(resolved)
+    schedule_many(to_schedule)
+    for failed_payment in retry_queue.retry_later(failed):
+        totals['abandoned'] += 1
+        plan = failed_payment.subscription.plan
+        notifications.add(
+            user_id=failed_payment.user_id,
+            notification_type='payment_failed',
+            title='Не удалось продлить подписку',
+            message=f'Платеж за продление "{plan.name}" не прошел после {failed_payment.attempt_count} попыток. '
+                    f'Подписка закончится {failed_payment.subscription.end_date.strftime("%d.%m.%Y")}.',
+            data={'subscription_id': failed_payment.subscription_id}
+        )
+
+    return dict(totals)
@@ -1,18 +1,126 @@
-from django.db import models
+"""
+Очередь повторов неудачных платежей за продление (FailedPayment).
+Задержка между попытками растет экспоненциально, со случайным разбросом,
+чтобы платежи, отклоненные одновременно, не повторялись одной пачкой.
+Воркер забирает наступившие записи и сдвигает их на время аренды, поэтому
+несколько воркеров делят очередь и не берут одни и те же записи.
+"""
+from datetime import timedelta
+import logging
+import random
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
 from django.utils import timezone
-from .models import UserSubscription
-
-class FailedPayment(models.Model):
-    """Очередь неудачных платежей для повторной попытки"""
-    subscription = models.ForeignKey(UserSubscription, on_delete=models.CASCADE)
-    amount = models.DecimalField(max_digits=10, decimal_places=2)
-    attempt_count = models.IntegerField(default=1)
-    last_attempt = models.DateTimeField(auto_now=True)
-    next_attempt = models.DateTimeField()
-    error_message = models.TextField()
-    
-    def schedule_retry(self):
-        self.attempt_count += 1
-        delay_hours = min(24, 2 ** self.attempt_count)  # экспоненциальная задержка
-        self.next_attempt = timezone.now() + timezone.timedelta(hours=delay_hours)
-        self.save()
\ No newline at end of file
+
+from .models import FailedPayment
+from .schedule import unschedule
+
+logger = logging.getLogger(__name__)
+
+
+def get_max_attempts():
+    return max(1, getattr(settings, 'PAYMENT_RETRY_MAX_ATTEMPTS', 5))
+
+
+def get_batch_size():
+    return max(1, getattr(settings, 'PAYMENT_RETRY_BATCH_SIZE', 200))
+
+
+def get_claim_delay():
+    return timedelta(seconds=getattr(settings, 'PAYMENT_RETRY_CLAIM_SECONDS', 600))
+
+
+def retry_delay(attempt):
+    """Задержка перед попыткой номер attempt + 1"""
+    base = getattr(settings, 'PAYMENT_RETRY_BASE_SECONDS', 300)
+    cap = getattr(settings, 'PAYMENT_RETRY_MAX_DELAY_SECONDS', 6 * 3600)
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+def record_failures(failures):
+    """
+    Ставит в очередь отклоненные шлюзом платежи.
+    failures - список (subscription_id, user_id, amount, error).
+    Пока идут повторы, подписка убирается из расписания продлений.
+    """
+    if not failures:
+        return 0
+
+    now = timezone.now()
+    subscription_ids = [subscription_id for subscription_id, _, _, _ in failures]
+    with transaction.atomic():
+        queued = set(
+            FailedPayment.objects.filter(subscription_id__in=subscription_ids, status='pending')
+            .values_list('subscription_id', flat=True)
+        )
+        FailedPayment.objects.bulk_create([
+            FailedPayment(
+                subscription_id=subscription_id,
+                user_id=user_id,
+                amount=amount,
+                error_message=error,
+                next_attempt=now + retry_delay(1),
+            )
+            for subscription_id, user_id, amount, error in failures
+            if subscription_id not in queued
+        ])
+        unschedule(subscription_ids)
+    logger.info(f"В очередь повторов добавлено платежей: {len(failures) - len(queued)}")
+    return len(failures) - len(queued)
+
+
+def claim_due(now=None, limit=None):
+    """
+    Забирает до limit наступивших повторов и сдвигает их на время аренды.
+    Возвращает список (failed_payment_id, subscription_id, user_id, attempt_count).
+    """
+    now = now or timezone.now()
+    limit = limit or get_batch_size()
+    with transaction.atomic():
+        rows = list(
+            FailedPayment.objects.filter(status='pending', next_attempt__lte=now)
+            .select_for_update(skip_locked=True)
+            .order_by('next_attempt')
+            .values_list('id', 'subscription_id', 'user_id', 'attempt_count')[:limit]
+        )
+        if rows:
+            FailedPayment.objects.filter(id__in=[row[0] for row in rows]).update(
+                next_attempt=now + get_claim_delay(), last_attempt=now
+            )
+    return rows
+
+
+def resolve(failed_payment_ids):
+    """Закрывает повторы, которые больше не нужны (оплачено или продлевать уже нечего)"""
+    return FailedPayment.objects.filter(id__in=failed_payment_ids).update(status='resolved', last_attempt=timezone.now())
+
+
+def retry_later(failures):
+    """
+    Отмечает неудачные попытки. failures - список (failed_payment_id, error).
+    Возвращает записи, у которых попытки исчерпаны.
+    """
+    errors = dict(failures)
+    abandoned = []
+    for failed_payment in FailedPayment.objects.filter(id__in=errors).select_related('subscription__plan'):
+        failed_payment.schedule_retry(errors[failed_payment.id])
+        if failed_payment.status == 'abandoned':
+            abandoned.append(failed_payment)
+    return abandoned
+
+
+def queue_metrics(now=None):
+    """Глубина очереди: ожидающие, наступившие, брошенные, возраст самого старого повтора"""
+    now = now or timezone.now()
+    pending = FailedPayment.objects.filter(status='pending').order_by()
+    due = pending.filter(next_attempt__lte=now).aggregate(count=Count('id'), oldest=Min('next_attempt'))
+    return {
+        'pending': pending.count(),
+        'due': due['count'],
+        'oldest_due_seconds': int((now - due['oldest']).total_seconds()) if due['oldest'] else 0,
+        'abandoned': FailedPayment.objects.filter(status='abandoned').count(),
+        'by_attempt': dict(pending.values_list('attempt_count').annotate(count=Count('id'))),
+    }
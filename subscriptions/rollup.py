@@ -0,0 +1,145 @@
+"""
+Сводка транзакций по дням (DailyRevenueRollup). Обновляется инкрементально:
+пересчитываются только дни, в которых транзакции создавались или менялись
+после отметки Checkpoint. Аналитика и выгрузки читают сводку, а не журнал.
+"""
+from datetime import datetime, time, timedelta
+import csv
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import Transaction, DailyRevenueRollup, Checkpoint
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_CHECKPOINT = 'revenue_rollup'
+
+# Типы операций, которые считаются выручкой
+REVENUE_TYPES = ('subscription_purchase', 'subscription_renewal')
+
+CSV_COLUMNS = ['day', 'plan', 'transaction_type', 'status', 'count', 'amount']
+
+
+def get_safety_lag():
+    """
+    Отставание от текущего времени: транзакция, сохраненная чуть раньше
+    отметки, могла еще не закоммититься и будет подхвачена следующим запуском.
+    """
+    return timedelta(seconds=getattr(settings, 'ROLLUP_SAFETY_LAG_SECONDS', 60))
+
+
+def day_bounds(day):
+    """Начало и конец дня в текущем часовом поясе"""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def rebuild_day(day):
+    """Пересчитывает сводку за один день целиком"""
+    start, end = day_bounds(day)
+    with transaction.atomic():
+        rows = (
+            Transaction.objects.filter(created_at__gte=start, created_at__lt=end)
+            .order_by()
+            .values('subscription__plan', 'transaction_type', 'status')
+            .annotate(count=Count('id'), amount=Sum('amount'))
+        )
+        DailyRevenueRollup.objects.filter(day=day).delete()
+        DailyRevenueRollup.objects.bulk_create([
+            DailyRevenueRollup(
+                day=day,
+                plan_id=row['subscription__plan'],
+                transaction_type=row['transaction_type'],
+                status=row['status'],
+                count=row['count'],
+                amount=row['amount'] or 0,
+            )
+            for row in rows
+        ])
+
+
+def rebuild_days(days):
+    days = sorted(set(days))
+    for day in days:
+        rebuild_day(day)
+    return len(days)
+
+
+def rebuild_range(start_date, end_date):
+    """Пересчитывает сводку за каждый день диапазона (включительно)"""
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    rebuilt = rebuild_days(days)
+    logger.info(f"Сводка пересчитана за {start_date} - {end_date} ({rebuilt} дн.)")
+    return rebuilt
+
+
+def get_checkpoint():
+    """Время, до которого изменения транзакций уже учтены в сводке (None - ни разу)"""
+    checkpoint = Checkpoint.objects.filter(name=ROLLUP_CHECKPOINT).first()
+    return checkpoint.position if checkpoint else None
+
+
+def update_rollup(now=None):
+    """
+    Инкрементальное обновление: находит дни транзакций, измененных после
+    отметки, пересчитывает только их и сдвигает отметку. Возвращает число дней.
+    """
+    upper = (now or timezone.now()) - get_safety_lag()
+    position = get_checkpoint()
+    if position is not None and position >= upper:
+        return 0
+
+    changed = Transaction.objects.filter(updated_at__lte=upper)
+    if position is not None:
+        changed = changed.filter(updated_at__gt=position)
+
+    rebuilt = rebuild_days(changed.dates('created_at', 'day'))
+    Checkpoint.objects.update_or_create(name=ROLLUP_CHECKPOINT, defaults={'position': upper})
+    logger.info(f"Сводка выручки обновлена до {upper}: пересчитано дней {rebuilt}")
+    return rebuilt
+
+
+def rollup_rows(start_date, end_date):
+    return DailyRevenueRollup.objects.filter(
+        day__gte=start_date, day__lte=end_date
+    ).select_related('plan').order_by('day', 'plan_id', 'transaction_type', 'status')
+
+
+def daily_revenue(start_date, end_date):
+    """Выручка, возвраты и число оплат по дням диапазона"""
+    completed = Q(status='completed')
+    rows = list(
+        DailyRevenueRollup.objects.filter(day__gte=start_date, day__lte=end_date)
+        .order_by('day')
+        .values('day')
+        .annotate(
+            revenue=Sum('amount', filter=completed & Q(transaction_type__in=REVENUE_TYPES)),
+            refunds=Sum('amount', filter=completed & Q(transaction_type='refund')),
+            payments=Sum('count', filter=completed & Q(transaction_type__in=REVENUE_TYPES)),
+            failed=Sum('count', filter=Q(status='failed')),
+        )
+    )
+    for row in rows:
+        # Sum по пустой выборке дает NULL
+        for key in ('revenue', 'refunds', 'payments', 'failed'):
+            row[key] = row[key] or 0
+    return rows
+
+
+def write_csv(rows, output):
+    """Выгружает строки сводки в CSV"""
+    writer = csv.writer(output)
+    writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        writer.writerow([
+            row.day.isoformat(),
+            row.plan.name if row.plan else '',
+            row.transaction_type,
+            row.status,
+            row.count,
+            row.amount,
+        ])
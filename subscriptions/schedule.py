@@ -0,0 +1,117 @@
+"""
+Расписание продлений (RenewalSchedule). Для каждой подписки с автопродлением
+хранится время следующего списания. Запись обновляется сигналом при
+сохранении подписки. Воркер забирает наступившие записи по индексу due_at и
+сдвигает взятые на время аренды: если воркер упадет или платеж не
+пройдет, подписка снова станет видна после RENEWAL_CLAIM_SECONDS.
+"""
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from .models import RenewalSchedule, UserSubscription
+
+logger = logging.getLogger(__name__)
+
+# За сколько до окончания подписки списывать оплату
+RENEWAL_WINDOW = timedelta(hours=24)
+
+SCHEDULED_STATUSES = ('active', 'pending_renewal')
+
+
+def get_claim_delay():
+    return timedelta(seconds=getattr(settings, 'RENEWAL_CLAIM_SECONDS', 900))
+
+
+def get_pending_retry_delay():
+    return timedelta(seconds=getattr(settings, 'PENDING_RENEWAL_RETRY_SECONDS', 3600))
+
+
+def next_due_at(sub, now=None):
+    """Когда подписку пора продлевать; None - продлевать не нужно"""
+    if sub.status not in SCHEDULED_STATUSES or not sub.auto_renew or sub.end_date is None:
+        return None
+    if sub.status == 'pending_renewal':
+        # Ждем пополнения баланса: пробуем снова через интервал
+        return (now or timezone.now()) + get_pending_retry_delay()
+    return sub.end_date - RENEWAL_WINDOW
+
+
+def schedule_subscription(sub):
+    """Ставит подписку в расписание (или убирает из него) по ее текущему состоянию"""
+    due_at = next_due_at(sub)
+    if due_at is None:
+        RenewalSchedule.objects.filter(subscription_id=sub.id).delete()
+        return None
+    RenewalSchedule.objects.update_or_create(
+        subscription_id=sub.id,
+        defaults={'user_id': sub.user_id, 'due_at': due_at, 'claimed_until': None}
+    )
+    return due_at
+
+
+def schedule_many(subscription_ids):
+    """Ставит подписки в расписание заново по их текущему состоянию"""
+    subscriptions = UserSubscription.objects.filter(id__in=subscription_ids).only(
+        'id', 'user_id', 'status', 'end_date', 'auto_renew'
+    )
+    return sum(1 for sub in subscriptions if schedule_subscription(sub) is not None)
+
+
+def unschedule(subscription_ids):
+    """Убирает подписки из расписания (для изменений через QuerySet.update)"""
+    return RenewalSchedule.objects.filter(subscription_id__in=subscription_ids).delete()[0]
+
+
+def reschedule(subscription_ids, delay, now=None):
+    """Переносит записи на now + delay и снимает аренду"""
+    due_at = (now or timezone.now()) + delay
+    return RenewalSchedule.objects.filter(subscription_id__in=subscription_ids).update(due_at=due_at, claimed_until=None)
+
+
+def _lease(subscription_ids, now):
+    """Сдвигает записи на время аренды и помечает их взятыми до ее конца"""
+    lease_until = now + get_claim_delay()
+    RenewalSchedule.objects.filter(subscription_id__in=subscription_ids).update(
+        due_at=lease_until, claimed_until=lease_until
+    )
+
+
+def claim_due(now=None, limit=None):
+    """
+    Забирает наступившие записи (диапазон по индексу due_at) и сдвигает
+    взятые записи на время аренды. Возвращает пары (subscription_id, user_id).
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = RenewalSchedule.objects.filter(due_at__lte=now).select_for_update(
+            skip_locked=True
+        ).order_by('due_at').values_list('subscription_id', 'user_id')
+        rows = list(due[:limit] if limit else due)
+        if rows:
+            _lease([subscription_id for subscription_id, _ in rows], now)
+    logger.info(f"Из расписания продлений взято подписок: {len(rows)}")
+    return rows
+
+
+def claim_subscriptions(subscription_ids, now=None):
+    """
+    Берет в работу конкретные подписки вне очереди (продление после пополнения).
+    Подписки, которые держит другой воркер, а также отсутствующие в расписании
+    (например, ждущие в очереди повторов платежей) пропускаются.
+    Возвращает id взятых подписок.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        claimed = list(
+            RenewalSchedule.objects.filter(subscription_id__in=subscription_ids)
+            .filter(models.Q(claimed_until__isnull=True) | models.Q(claimed_until__lte=now))
+            .select_for_update(skip_locked=True)
+            .values_list('subscription_id', flat=True)
+        )
+        if claimed:
+            _lease(claimed, now)
+    return claimed
@@ -36,23 +36,22 @@ class SubscriptionPurchaseSerializer(serializers.Serializer):
     promo_code = serializers.CharField(required=False, allow_blank=True, allow_null=True)
     
     def validate(self, data):
-        from .models import SubscriptionPlan, PromoCode
+        # Тарифы и промокоды читаются из кеша каталога, без запросов к БД
+        from .catalog_cache import get_plan, get_promo
         
-        try:
-            plan = SubscriptionPlan.objects.get(id=data['plan_id'], is_active=True)
-        except SubscriptionPlan.DoesNotExist:
+        plan = get_plan(data['plan_id'])
+        if plan is None:
             raise serializers.ValidationError({"plan_id": "Тарифный план не найден или неактивен"})
         
         promo_code = data.get('promo_code')
         promo = None
         
         if promo_code:
-            try:
-                promo = PromoCode.objects.get(code=promo_code, is_active=True)
-                if not promo.is_valid():
-                    raise serializers.ValidationError({"promo_code": "Промокод недействителен или истек срок действия"})
-            except PromoCode.DoesNotExist:
+            promo = get_promo(promo_code)
+            if promo is None:
                 raise serializers.ValidationError({"promo_code": "Промокод не найден"})
+            if not promo.is_valid():
+                raise serializers.ValidationError({"promo_code": "Промокод недействителен или истек срок действия"})
         
         data['plan'] = plan
         data['promo'] = promo
@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import UserSubscription, SubscriptionPlan, PromoCode
+from .schedule import schedule_subscription
+from . import catalog_cache
+
+# Поля подписки, от которых зависит время следующего продления
+SCHEDULE_FIELDS = {'status', 'end_date', 'auto_renew'}
+
+
+@receiver(post_save, sender=UserSubscription)
+def sync_renewal_schedule(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Держит RenewalSchedule в соответствии с подпиской"""
+    if raw:
+        return
+    if update_fields is not None and not SCHEDULE_FIELDS & set(update_fields):
+        return
+    schedule_subscription(instance)
+
+
+@receiver([post_save, post_delete], sender=SubscriptionPlan)
+def invalidate_plan_cache(sender, **kwargs):
+    # После коммита: иначе параллельный запрос успеет закешировать старую строку
+    transaction.on_commit(lambda: catalog_cache.invalidate(catalog_cache.PLANS))
+
+
+@receiver([post_save, post_delete], sender=PromoCode)
+def invalidate_promo_cache(sender, **kwargs):
+    transaction.on_commit(lambda: catalog_cache.invalidate(catalog_cache.PROMOS))
@@ -0,0 +1,102 @@
+"""
+Сводная статистика для админ-панели. Все метрики считаются агрегатами в БД
+(выручка - по дневной сводке DailyRevenueRollup), результат кешируется
+на ADMIN_STATS_CACHE_TTL секунд.
+"""
+from decimal import Decimal
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import UserSubscription, DailyRevenueRollup
+from .rollup import REVENUE_TYPES, get_checkpoint
+from .retry_queue import queue_metrics
+from .catalog_cache import cache_stats
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATS_CACHE_KEY = 'subscriptions:admin_stats'
+
+
+def get_cache_ttl():
+    return getattr(settings, 'ADMIN_STATS_CACHE_TTL', 30)
+
+
+def _grouped(queryset, field, **aggregates):
+    """{значение field: {агрегаты}}; order_by() сбрасывает сортировку из Meta, иначе она попадет в GROUP BY"""
+    return {
+        row.pop(field): row
+        for row in queryset.order_by().values(field).annotate(**aggregates)
+    }
+
+
+def _transactions_by(field):
+    rows = _grouped(DailyRevenueRollup.objects.all(), field, count=Sum('count'), amount=Sum('amount'))
+    for row in rows.values():
+        row['amount'] = row['amount'] or Decimal('0')
+    return rows
+
+
+def compute_admin_stats():
+    """Считает метрики дашборда: выручку, подписки и пользователей"""
+    by_status = _transactions_by('status')
+    by_type = _transactions_by('transaction_type')
+
+    completed = DailyRevenueRollup.objects.filter(status='completed').order_by()
+    revenue = completed.filter(transaction_type__in=REVENUE_TYPES).aggregate(total=Sum('amount'))['total'] or Decimal('0')
+    refunded = completed.filter(transaction_type='refund').aggregate(total=Sum('amount'))['total'] or Decimal('0')
+
+    subscriptions_by_status = {
+        status: row['count']
+        for status, row in _grouped(UserSubscription.objects.all(), 'status', count=Count('id')).items()
+    }
+    active_by_plan = [
+        {'plan_id': row['plan_id'], 'plan_name': row['plan__name'], 'count': row['count']}
+        for row in UserSubscription.objects.filter(status='active').order_by()
+        .values('plan_id', 'plan__name').annotate(count=Count('id')).order_by('-count')
+    ]
+
+    total_users = User.objects.count()
+    subscribed_users = UserSubscription.objects.order_by().values('user_id').distinct().count()
+    active_users = UserSubscription.objects.filter(status='active').order_by().values('user_id').distinct().count()
+
+    return {
+        'revenue': {
+            'total': revenue,
+            'refunded': refunded,
+            'net': revenue - refunded,
+            'by_status': by_status,
+            'by_type': by_type,
+            'as_of': get_checkpoint(),
+        },
+        'subscriptions': {
+            'total': sum(subscriptions_by_status.values()),
+            'active': subscriptions_by_status.get('active', 0),
+            'by_status': subscriptions_by_status,
+            'active_by_plan': active_by_plan,
+        },
+        'users': {
+            'total': total_users,
+            'admins': User.objects.filter(role='admin').count(),
+            'with_subscriptions': subscribed_users,
+            'with_active_subscriptions': active_users,
+            'conversion_percent': round(subscribed_users / total_users * 100, 1) if total_users else 0.0,
+        },
+        'payment_retries': queue_metrics(),
+        'catalog_cache': cache_stats(),
+        'generated_at': timezone.now(),
+    }
+
+
+def get_admin_stats(refresh=False):
+    """Статистика из кеша; при промахе (или refresh=True) считается заново"""
+    stats = None if refresh else cache.get(ADMIN_STATS_CACHE_KEY)
+    if stats is None:
+        stats = compute_admin_stats()
+        cache.set(ADMIN_STATS_CACHE_KEY, stats, get_cache_ttl())
+        logger.info("Статистика админ-панели пересчитана")
+    return stats
@@ -0,0 +1,199 @@
+"""
+Задачи Celery (расписание - backend/celery.py). Тяжелые прогоны разбиты на
+независимые части: координатор забирает работу (записи расписания, очередь
+повторов, истекшие подписки, пользователей для напоминаний) и запускает chord
+из задач-частей, которые воркеры на разных машинах выполняют параллельно;
+итоговая задача суммирует счетчики. Повторно взять уже взятое не дают аренды
+в расписании и очереди повторов и уникальность напоминаний.
+
+Без Redis задачи работают на брокере в памяти (memory://) или файловом
+(filesystem://), см. CELERY_* в settings.py.
+"""
+from collections import Counter
+import logging
+import time
+
+from celery import chord, shared_task
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import retry_queue
+from .email_queue import drain_queue, purge_sent
+from .expiry import get_chunk_size as get_expiry_chunk_size, overdue_subscriptions, expire_subscriptions
+from .idempotency import purge_expired_keys
+from .purchases import sweep_stale_purchases
+from .reconciliation import run_reconciliation
+from .reminders import expiring_user_ids, get_chunk_size as get_reminder_chunk_size, purge_reminders, remind_users
+from .renewal_engine import (
+    build_report, get_shard_count, get_workers_per_shard, renew_pending_for_user, renew_shard, retry_claimed,
+    split_into_shards
+)
+from .rollup import update_rollup
+from .schedule import claim_due
+
+logger = logging.getLogger(__name__)
+
+
+def get_retry_fanout():
+    """Сколько пачек очереди повторов забирает один запуск координатора"""
+    return max(1, getattr(settings, 'CELERY_RETRY_FANOUT', 8))
+
+
+def _sum_counters(results):
+    totals = Counter()
+    for result in results:
+        totals.update(result or {})
+    return dict(totals)
+
+
+def _chunks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+# Продление
+
+@shared_task
+def check_subscription_renewals():
+    """Забирает наступившие записи расписания и раздает шарды по user_id воркерам"""
+    shard_count = get_shard_count()
+    shards = split_into_shards(claim_due(), shard_count)
+    if not shards:
+        return None
+    # Ключи JSON - строки, поэтому шард передается списком пар [user_id, [subscription_id, ...]]
+    header = [renew_shard_task.s([[user_id, ids] for user_id, ids in users.items()]) for users in shards.values()]
+    return chord(header)(summarize_renewals.s(shard_count, time.time())).id
+
+
+@shared_task(acks_late=True)
+def renew_shard_task(users):
+    return dict(renew_shard({int(user_id): ids for user_id, ids in users}))
+
+
+@shared_task
+def summarize_renewals(results, shard_count, started):
+    totals = Counter(_sum_counters(results))
+    return build_report(totals, shard_count, get_workers_per_shard(), time.time() - started)
+
+
+@shared_task(acks_late=True)
+def activate_pending_renewals(user_id):
+    """Продлевает подписки пользователя, ждавшие пополнения баланса"""
+    return len(renew_pending_for_user(user_id))
+
+
+@shared_task
+def sweep_pending_purchases():
+    """Возвращает резерв покупок, которые не завершились (упал процесс или запрос)"""
+    return sweep_stale_purchases()
+
+
+# Повторы неудачных платежей
+
+@shared_task
+def retry_failed_payments():
+    """Забирает до CELERY_RETRY_FANOUT пачек очереди повторов и раздает их воркерам"""
+    header = []
+    for _ in range(get_retry_fanout()):
+        claimed = retry_queue.claim_due()
+        if not claimed:
+            break
+        header.append(retry_payments_batch.s([list(row) for row in claimed]))
+    if not header:
+        return None
+    return chord(header)(sum_counters.s('Повторы платежей')).id
+
+
+@shared_task(acks_late=True)
+def retry_payments_batch(claimed):
+    return retry_claimed([tuple(row) for row in claimed])
+
+
+# Закрытие истекших
+
+@shared_task
+def close_expired_subscriptions():
+    """Делит истекшие подписки на пачки по EXPIRY_CHUNK_SIZE и закрывает их параллельно"""
+    ids = list(overdue_subscriptions(timezone.now()).order_by('id').values_list('id', flat=True))
+    if not ids:
+        return None
+    header = [expire_chunk_task.s(chunk) for chunk in _chunks(ids, get_expiry_chunk_size())]
+    return chord(header)(sum_total.s('Закрыто истекших подписок')).id
+
+
+@shared_task(acks_late=True)
+def expire_chunk_task(subscription_ids):
+    return expire_subscriptions(subscription_ids)
+
+
+# Напоминания об окончании
+
+@shared_task
+def send_renewal_notifications():
+    """Раздает пользователей с истекающими подписками пачками по EXPIRY_REMINDER_CHUNK_SIZE"""
+    now = timezone.now()
+    user_ids = expiring_user_ids(now)
+    if not user_ids:
+        purge_reminders(now)
+        return None
+    header = [
+        remind_users_task.s(chunk, now.isoformat())
+        for chunk in _chunks(user_ids, get_reminder_chunk_size())
+    ]
+    return chord(header)(finish_reminders.s(now.isoformat())).id
+
+
+@shared_task(acks_late=True)
+def remind_users_task(user_ids, now):
+    return remind_users(user_ids, parse_datetime(now))
+
+
+@shared_task
+def finish_reminders(results, now):
+    purge_reminders(parse_datetime(now))
+    return sum_counters(results, 'Напоминания об окончании')
+
+
+# Сводка выручки, ключи идемпотентности и сверка балансов: работают по
+# собственным курсорам и отметкам, поэтому на части не делятся
+
+@shared_task
+def update_revenue_rollup():
+    """Досчитывает дневную сводку выручки по измененным транзакциям"""
+    return update_rollup()
+
+
+@shared_task
+def purge_idempotency_keys():
+    """Удаляет просроченные ключи идемпотентности"""
+    return purge_expired_keys()
+
+
+@shared_task
+def reconcile_balances():
+    """Сверяет балансы пользователей с журналом транзакций (только изменения)"""
+    return run_reconciliation()['drifted']
+
+
+# Общие итоговые задачи и очередь писем
+
+@shared_task
+def sum_counters(results, label):
+    totals = _sum_counters(results)
+    logger.info(f"{label}: {totals}")
+    return totals
+
+
+@shared_task
+def sum_total(results, label):
+    total = sum(results)
+    logger.info(f"{label}: {total}")
+    return total
+
+
+@shared_task
+def deliver_outbound_emails():
+    """Отправляет письма из очереди; несколько воркеров делят ее через аренду"""
+    report = drain_queue()
+    purge_sent()
+    return report
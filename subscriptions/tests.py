@@ -1,3 +1,1068 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import catalog_cache
+from .email_queue import claim_batch, drain_queue, enqueue, purge_sent, send_batch
+from .email_service import (
+    payment_failed_context, send_bulk_email, send_email_notification, subscription_expiring_context,
+    subscription_renewed_context
+)
+from .email_templates import DEFAULT_TEMPLATE, clear_registry, get_email_template
+from .expiry import expire_overdue_subscriptions, overdue_subscriptions
+from .idempotency import purge_expired_keys
+from .models import (
+    ExpirationReminder, FailedPayment, IdempotencyKey, OutboundEmail, PromoCode, PromoRedemption, RenewalSchedule, SubscriptionPlan, Transaction, UserSubscription
+)
+from .payment_gateway import FakePaymentGateway, _charge_once, _timeout_result, charge_batches_concurrently
+from .promo import PromoUnavailable, redeem, redeemed_count, shard_promo
+from .purchases import complete_purchase, sweep_stale_purchases
+from .renewal_engine import (
+    PAYMENT_FAILED, PAYMENT_UNKNOWN, RENEWED, SKIPPED, due_subscriptions, finish_renewals, renew_pending_for_user,
+    retry_due_payments, settle_user
+)
+from .retry_queue import claim_due as claim_retries, record_failures, retry_delay
+from .reminders import expiring_user_ids, purge_reminders, remind_users, send_expiration_reminders
+from .reconciliation import drift_report, run_reconciliation
+from .rollup import daily_revenue, update_rollup
+from .schedule import RENEWAL_WINDOW, claim_due, claim_subscriptions, reschedule
+from .stats import ADMIN_STATS_CACHE_KEY
+from users.balance import credit
+from users.models import Notification, User
+from users.notifications import NotificationBuffer
+
+# Задачи Celery проверяются, только если celery установлен (как в backend/__init__.py)
+try:
+    from . import tasks
+except ImportError:
+    tasks = None
+
+
+def _success(amount, key):
+    return {
+        'success': True,
+        'transaction_id': f'FPG_{key}',
+        'amount': amount,
+        'status': 'completed',
+        'message': 'Платеж успешно обработан',
+        'idempotency_key': key,
+    }
+
+
+class ScanIndexTests(TestCase):
+    """Сканы продления и закрытия истекших идут по индексам, а не по всей таблице"""
+
+    def test_renewal_scan_uses_partial_index(self):
+        plan = due_subscriptions().order_by().values_list('id', 'user_id').explain()
+        self.assertIn('usersub_renewal_scan_idx', plan)
+
+    def test_expiry_scan_uses_covering_index(self):
+        plan = overdue_subscriptions(timezone.now()).values_list('id', flat=True).explain()
+        self.assertIn('COVERING INDEX usersub_status_end_idx', plan)
+
+
+# Уведомления пачки буферизуются после коммита ее транзакции - нужны настоящие коммиты
+class ExpiryTests(TransactionTestCase):
+    """Истекшие подписки закрываются пачками одним UPDATE, с уведомлением на каждую"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='expiring')
+        plan = SubscriptionPlan.objects.create(name='Месяц', price=Decimal('100'), duration_days=30)
+        now = timezone.now()
+        self.overdue = [
+            UserSubscription.objects.create(user=self.user, plan=plan, status=status, end_date=now - timedelta(days=1))
+            for status in ('active', 'active', 'pending_renewal', 'active', 'pending_renewal')
+        ]
+        self.current = UserSubscription.objects.create(
+            user=self.user, plan=plan, status='active', end_date=now + timedelta(days=1)
+        )
+        self.canceled = UserSubscription.objects.create(
+            user=self.user, plan=plan, status='canceled', end_date=now - timedelta(days=1)
+        )
+
+    def test_overdue_subscriptions_are_expired_in_chunks(self):
+        self.assertEqual(expire_overdue_subscriptions(chunk_size=2), 5)
+
+        statuses = dict(UserSubscription.objects.values_list('id', 'status'))
+        self.assertEqual({statuses[sub.id] for sub in self.overdue}, {'expired'})
+        self.assertEqual(statuses[self.current.id], 'active')
+        self.assertEqual(statuses[self.canceled.id], 'canceled')
+        self.assertEqual(Notification.objects.filter(user=self.user, title='Подписка истекла').count(), 5)
+        # Закрытые подписки ушли из расписания продлений, действующая осталась
+        self.assertEqual(list(RenewalSchedule.objects.values_list('subscription_id', flat=True)), [self.current.id])
+
+    def test_second_run_finds_nothing(self):
+        expire_overdue_subscriptions()
+        self.assertEqual(expire_overdue_subscriptions(), 0)
+
+
+class AsyncGatewayTests(SimpleTestCase):
+    """Пачки идут в шлюз параллельно; таймаут - не отказ, статус уточняется по ключу"""
+
+    @mock.patch('subscriptions.payment_gateway.random.random', return_value=0.5)
+    @mock.patch('subscriptions.payment_gateway.random.uniform', return_value=0)
+    def test_batches_are_charged_in_order(self, *_):
+        batches = [[(1, 10.0, 'tests:batch:1'), (2, 20.0, 'tests:batch:2')], [(3, 30.0, 'tests:batch:3')]]
+        results = charge_batches_concurrently(batches)
+
+        self.assertEqual([[result['amount'] for result in batch] for batch in results], [[10.0, 20.0], [30.0]])
+        self.assertTrue(all(result['status'] == 'completed' for batch in results for result in batch))
+
+    @mock.patch('subscriptions.payment_gateway.random.random', return_value=0.5)
+    @mock.patch('subscriptions.payment_gateway.random.uniform', return_value=1.0)
+    def test_timeout_is_resolved_by_idempotency_key(self, *_):
+        # Первый платеж шлюз провел раньше, второй до шлюза не дошел
+        charged = _charge_once(1, 10.0, 'tests:timeout:charged')
+        results = charge_batches_concurrently(
+            [[(1, 10.0, 'tests:timeout:charged'), (2, 20.0, 'tests:timeout:lost')]], timeout=0.4
+        )[0]
+
+        self.assertEqual(results[0]['transaction_id'], charged['transaction_id'])
+        self.assertTrue(results[0]['replayed'])
+        self.assertEqual(results[1]['status'], 'failed')
+
+    @mock.patch('subscriptions.payment_gateway.random.uniform', return_value=1.0)
+    def test_unresolved_timeout_stays_unknown(self, _):
+        results = charge_batches_concurrently([[(1, 10.0, 'tests:timeout:unknown')]], timeout=0.1)[0]
+        self.assertEqual(results[0]['status'], 'unknown')
+        self.assertFalse(results[0]['success'])
+
+
+class SettleUserTests(TestCase):
+    """Применение результатов платежей: повтор по тому же ключу не возвращает деньги"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='payer', balance=Decimal('500'))
+        self.plan = SubscriptionPlan.objects.create(name='Месяц', price=Decimal('100'), duration_days=30)
+
+    def _subscription(self, end_date):
+        return UserSubscription.objects.create(user=self.user, plan=self.plan, status='active', end_date=end_date)
+
+    def _settle(self, subscription, payment_result):
+        with NotificationBuffer() as notifications:
+            return settle_user(self.user.id, [(subscription.id, payment_result)], notifications)
+
+    @mock.patch.object(FakePaymentGateway, 'refund_payment')
+    def test_replayed_charge_is_not_refunded(self, refund_payment):
+        # Подписку уже продлил другой прогон, шлюз вернул сохраненный результат
+        sub = self._subscription(timezone.now() + timedelta(days=30))
+        outcomes = self._settle(sub, dict(_success(100.0, 'renewal:replayed'), replayed=True))
+
+        self.assertEqual(outcomes[0]['outcome'], SKIPPED)
+        refund_payment.assert_not_called()
+
+    @mock.patch.object(FakePaymentGateway, 'refund_payment')
+    def test_new_charge_for_changed_subscription_is_refunded(self, refund_payment):
+        sub = self._subscription(timezone.now() + timedelta(days=30))
+        outcomes = self._settle(sub, _success(100.0, 'renewal:new'))
+
+        self.assertEqual(outcomes[0]['outcome'], SKIPPED)
+        refund_payment.assert_called_once_with('FPG_renewal:new', 100.0)
+
+    @mock.patch.object(FakePaymentGateway, 'refund_payment')
+    def test_unknown_payment_is_neither_failed_nor_refunded(self, refund_payment):
+        sub = self._subscription(timezone.now() + timedelta(hours=1))
+        outcomes = self._settle(sub, _timeout_result(100.0, 'renewal:unknown'))
+
+        self.assertEqual(outcomes[0]['outcome'], PAYMENT_UNKNOWN)
+        finish_renewals(outcomes)
+        self.assertFalse(FailedPayment.objects.exists())
+        refund_payment.assert_not_called()
+
+    @mock.patch.object(FakePaymentGateway, 'refund_payment')
+    def test_due_subscription_is_renewed_once(self, refund_payment):
+        sub = self._subscription(timezone.now() + timedelta(hours=1))
+        outcomes = self._settle(sub, _success(100.0, 'renewal:due'))
+
+        self.assertEqual(outcomes[0]['outcome'], RENEWED)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('400'))
+        self.assertEqual(Transaction.objects.filter(transaction_type='subscription_renewal').count(), 1)
+        refund_payment.assert_not_called()
+
+
+class RenewalLeaseTests(TestCase):
+    """Подписку, взятую одним воркером, не берет другой"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='leased', balance=Decimal('500'))
+        plan = SubscriptionPlan.objects.create(name='Месяц', price=Decimal('100'), duration_days=30)
+        self.sub = UserSubscription.objects.create(
+            user=self.user, plan=plan, status='pending_renewal', end_date=timezone.now() - timedelta(hours=1)
+        )
+        # Запись расписания создал сигнал; делаем ее наступившей
+        RenewalSchedule.objects.filter(subscription=self.sub).update(due_at=timezone.now() - timedelta(minutes=1))
+
+    def test_claim_due_excludes_claimed_subscription(self):
+        self.assertEqual(claim_subscriptions([self.sub.id]), [self.sub.id])
+        self.assertEqual(claim_due(), [])
+
+    def test_claim_subscriptions_skips_lease_held_by_run(self):
+        self.assertEqual(claim_due(), [(self.sub.id, self.user.id)])
+        self.assertEqual(claim_subscriptions([self.sub.id]), [])
+
+    def test_expired_lease_can_be_claimed_again(self):
+        claim_due()
+        later = timezone.now() + timedelta(days=1)
+        self.assertEqual(claim_subscriptions([self.sub.id], now=later), [self.sub.id])
+
+    @mock.patch('subscriptions.renewal_engine.charge_batches_concurrently')
+    def test_pending_renewal_skips_leased_subscription(self, charge_batches):
+        claim_due()
+
+        self.assertEqual(renew_pending_for_user(self.user.id), [])
+        charge_batches.assert_not_called()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('500'))
+
+
+class RenewalScheduleTests(TestCase):
+    """Расписание следует за подпиской, а воркер забирает только наступившие записи"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='scheduled')
+        self.plan = SubscriptionPlan.objects.create(name='Месяц', price=Decimal('100'), duration_days=30)
+        self.now = timezone.now()
+
+    def _subscription(self, end_date, **fields):
+        return UserSubscription.objects.create(user=self.user, plan=self.plan, status='active', end_date=end_date, **fields)
+
+    def test_schedule_follows_subscription(self):
+        sub = self._subscription(self.now + timedelta(days=10))
+        self.assertEqual(RenewalSchedule.objects.get(subscription=sub).due_at, sub.end_date - RENEWAL_WINDOW)
+
+        sub.auto_renew = False
+        sub.save()
+        self.assertFalse(RenewalSchedule.objects.filter(subscription=sub).exists())
+
+    def test_claim_due_takes_only_due_records(self):
+        due = self._subscription(self.now + timedelta(hours=1))
+        self._subscription(self.now + timedelta(days=10))
+
+        self.assertEqual(claim_due(now=self.now), [(due.id, self.user.id)])
+        # Взятая запись сдвинута на время аренды
+        self.assertEqual(claim_due(now=self.now), [])
+
+    def test_claim_due_respects_limit(self):
+        subs = [self._subscription(self.now + timedelta(hours=hours)) for hours in (1, 2, 3)]
+
+        self.assertEqual(claim_due(now=self.now, limit=2), [(subs[0].id, self.user.id), (subs[1].id, self.user.id)])
+        self.assertEqual(claim_due(now=self.now), [(subs[2].id, self.user.id)])
+
+    def test_reschedule_releases_lease(self):
+        sub = self._subscription(self.now + timedelta(hours=1))
+        claim_due(now=self.now)
+        reschedule([sub.id], timedelta(hours=1), now=self.now)
+
+        record = RenewalSchedule.objects.get(subscription=sub)
+        self.assertIsNone(record.claimed_until)
+        self.assertEqual(claim_due(now=self.now + timedelta(hours=2)), [(sub.id, self.user.id)])
+
+
+# Тестовая БД SQLite в памяти не ждет блокировок между потоками - продлеваем в одном потоке
+@override_settings(RENEWAL_WORKERS_PER_SHARD=1)
+@mock.patch('subscriptions.payment_gateway.random.uniform', return_value=0)
+class ManualRenewalTests(TransactionTestCase):
+    """Ручной запуск идет через аренду и разбор итогов, как фоновый прогон"""
+
+    def setUp(self):
+        self.admin = User.objects.create(username='admin', role='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        plan = SubscriptionPlan.objects.create(name='Месяц', price=Decimal('100'), duration_days=30)
+        end_date = timezone.now() + timedelta(hours=1)
+        self.users = [User.objects.create(username=f'manual{i}', balance=Decimal('500')) for i in range(2)]
+        self.subs = [
+            UserSubscription.objects.create(user=user, plan=plan, status='active', end_date=end_date)
+            for user in self.users
+        ]
+
+    def test_skips_subscription_leased_by_run(self, _):
+        claim_subscriptions([self.subs[0].id])
+        with mock.patch('subscriptions.payment_gateway.random.random', return_value=0.5):
+            response = self.client.post('/api/subscriptions/run-renewal/')
+
+        statuses = {result['subscription_id']: result['status'] for result in response.data['results']}
+        self.assertEqual(statuses, {self.subs[0].id: 'skipped', self.subs[1].id: 'renewed'})
+        balances = [user.balance for user in User.objects.filter(id__in=[u.id for u in self.users]).order_by('id')]
+        self.assertEqual(balances, [Decimal('500'), Decimal('400')])
+
+    def test_gateway_decline_is_queued_for_retry(self, _):
+        with mock.patch('subscriptions.payment_gateway.random.random', return_value=0.99):
+            response = self.client.post('/api/subscriptions/run-renewal/')
+
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual(FailedPayment.objects.filter(status='pending').count(), 2)
+        # Пока идут повторы, подписок нет в расписании
+        self.assertFalse(RenewalSchedule.objects.exists())
+
+
+@mock.patch('subscriptions.payment_gateway.random.uniform', return_value=0)
+class PurchaseTests(TestCase):
+    """Резерв при покупке либо проводится, либо возвращается целиком - вместе с промокодом"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='shopper', balance=Decimal('500'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.plan = SubscriptionPlan.objects.create(name='Месяц', price=Decimal('100'), duration_days=30)
+        now = timezone.now()
+        self.promo = PromoCode.objects.create(
+            code='HALF', discount_percent=50, max_uses=1,
+            valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1)
+        )
+
+    def _purchase(self, payment_outcome):
+        with mock.patch('subscriptions.payment_gateway.random.random', return_value=payment_outcome):
+            return self.client.post(
+                '/api/subscriptions/purchase/', {'plan_id': self.plan.id, 'promo_code': 'HALF'}, format='json'
+            )
+
+    def _assert_reversed(self):
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('500'))
+        self.assertEqual(Transaction.objects.get(transaction_type='subscription_purchase').status, 'failed')
+        self.assertEqual(UserSubscription.objects.get(user=self.user).status, 'expired')
+        self.assertEqual(redeemed_count(self.promo), 0)
+
+    def test_paid_purchase_activates_subscription(self, _):
+        response = self._purchase(0.5)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['new_balance'], 450.0)
+        self.assertEqual(UserSubscription.objects.get(user=self.user).status, 'active')
+        self.assertEqual(redeemed_count(self.promo), 1)
+
+    def test_declined_payment_returns_reserve(self, _):
+        self._purchase(0.99)
+        self._assert_reversed()
+
+    @mock.patch.object(FakePaymentGateway, 'refund_payment')
+    @mock.patch('subscriptions.views.complete_purchase', side_effect=RuntimeError('db down'))
+    def test_settlement_error_is_compensated(self, _complete, refund_payment, _uniform):
+        response = self._purchase(0.5)
+
+        self.assertEqual(response.status_code, 500)
+        self._assert_reversed()
+        refund_payment.assert_called_once()
+
+    @mock.patch('subscriptions.views.complete_purchase', side_effect=SystemExit)
+    def test_stale_purchase_is_swept_once(self, _complete, _uniform):
+        # Процесс упал между платежом и фиксацией - резерв остался занят
+        with self.assertRaises(SystemExit):
+            self._purchase(0.5)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('450'))
+
+        self.assertEqual(sweep_stale_purchases(), 0)
+        later = timezone.now() + timedelta(days=1)
+        self.assertEqual(sweep_stale_purchases(later), 1)
+        self.assertEqual(sweep_stale_purchases(later), 0)
+        self._assert_reversed()
+
+        # Опоздавшая фиксация уже ничего не активирует
+        purchase = Transaction.objects.get(transaction_type='subscription_purchase')
+        self.assertFalse(complete_purchase(purchase, _success(50.0, 'late')))
+
+
+class CursorPaginationTests(TestCase):
+    """Страницы идут по курсору (created_at, id): без пропусков и повторов, даже при вставках"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='paged')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        transactions = [self._transaction() for _ in range(5)]
+        self.ids = [transaction.id for transaction in transactions]
+        # Одинаковое время создания в середине списка: порядок держится на id
+        Transaction.objects.filter(id__in=self.ids[1:4]).update(created_at=transactions[1].created_at)
+
+    def _transaction(self):
+        return Transaction.objects.create(
+            user=self.user, amount=Decimal('10'), transaction_type='deposit', status='completed'
+        )
+
+    def _walk(self, url, before_next=None):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+            if before_next:
+                before_next()
+                before_next = None
+        return seen
+
+    def test_pages_cover_list_once(self):
+        seen = self._walk('/api/subscriptions/transactions/?page_size=2')
+        self.assertEqual(sorted(seen), sorted(str(transaction_id) for transaction_id in self.ids))
+
+    def test_new_rows_do_not_shift_next_page(self):
+        seen = self._walk('/api/subscriptions/transactions/?page_size=2', before_next=self._transaction)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(set(seen), {str(transaction_id) for transaction_id in self.ids})
+
+    def test_page_size_is_capped(self):
+        with mock.patch('subscriptions.pagination.CreatedAtCursorPagination.max_page_size', 3):
+            response = self.client.get('/api/subscriptions/transactions/?page_size=100')
+        self.assertEqual(len(response.data['results']), 3)
+
+
+class TransactionListRevalidationTests(TestCase):
+    """Первая страница истории перепроверяется по ETag: 304, пока новых записей нет"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='history')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self._transaction('Пополнение 1')
+
+    def _transaction(self, description):
+        return Transaction.objects.create(
+            user=self.user, amount=Decimal('10'), transaction_type='deposit', status='completed',
+            description=description
+        )
+
+    def test_first_page_is_revalidated(self):
+        url = '/api/subscriptions/transactions/?page_size=1'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self._transaction('Пополнение 2')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['description'] for item in response.data['results']], ['Пополнение 2'])
+        self.assertIsNotNone(response.data['next'])
+
+
+class RevenueRollupTests(TestCase):
+    """Сводка по дням досчитывается только за дни, где транзакции менялись после отметки"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='rollup')
+        self.now = timezone.now()
+        self.today = timezone.localdate(self.now)
+        self.yesterday = self.today - timedelta(days=1)
+        self.old = self._transaction('subscription_purchase', '100', self.now - timedelta(days=1))
+        self._transaction('subscription_renewal', '50', self.now)
+        self._transaction('refund', '20', self.now)
+
+    def _transaction(self, transaction_type, amount, created_at):
+        transaction = Transaction.objects.create(
+            user=self.user, amount=Decimal(amount), transaction_type=transaction_type, status='completed'
+        )
+        Transaction.objects.filter(id=transaction.id).update(created_at=created_at)
+        return transaction
+
+    def _revenue(self):
+        return {row['day']: (row['revenue'], row['refunds'], row['failed']) for row in daily_revenue(self.yesterday, self.today)}
+
+    def test_days_are_rolled_up(self):
+        self.assertEqual(update_rollup(now=self.now + timedelta(hours=1)), 2)
+        self.assertEqual(self._revenue(), {
+            self.yesterday: (Decimal('100'), 0, 0),
+            self.today: (Decimal('50'), Decimal('20'), 0),
+        })
+
+    def test_only_changed_days_are_rebuilt(self):
+        update_rollup(now=self.now + timedelta(hours=1))
+        Transaction.objects.filter(id=self.old.id).update(status='failed', updated_at=self.now + timedelta(hours=2))
+
+        self.assertEqual(update_rollup(now=self.now + timedelta(hours=3)), 1)
+        self.assertEqual(self._revenue()[self.yesterday], (0, 0, 1))
+
+    def test_recent_changes_wait_for_safety_lag(self):
+        # Изменения моложе ROLLUP_SAFETY_LAG_SECONDS могут быть еще не закоммичены
+        self.assertEqual(update_rollup(now=self.now), 0)
+        self.assertEqual(self._revenue(), {})
+
+
+class ReconciliationTests(TestCase):
+    """Сверка балансов с журналом: инкрементальный запуск смотрит только изменившихся и расхождения"""
+
+    def setUp(self):
+        self.start = timezone.now() + timedelta(minutes=5)
+        self.consistent, self.changed, self.drifted = [
+            User.objects.create(username=name, balance=Decimal(balance))
+            for name, balance in (('consistent', '100'), ('changed', '100'), ('drifted', '150'))
+        ]
+        for user in (self.consistent, self.changed, self.drifted):
+            self._transaction(user, 'deposit', '100')
+
+    def _transaction(self, user, transaction_type, amount, updated_at=None):
+        transaction = Transaction.objects.create(
+            user=user, amount=Decimal(amount), transaction_type=transaction_type, status='completed'
+        )
+        if updated_at:
+            Transaction.objects.filter(id=transaction.id).update(updated_at=updated_at)
+        return transaction
+
+    def test_full_run_finds_drift(self):
+        result = run_reconciliation(now=self.start, chunk_size=2)
+
+        self.assertEqual((result['checked'], result['drifted']), (3, 1))
+        self.assertEqual([(row.user_id, row.drift) for row in drift_report()], [(self.drifted.id, Decimal('50'))])
+
+    def test_incremental_run_checks_changed_and_drifted_users(self):
+        run_reconciliation(now=self.start)
+        # Покупка после отметки: баланс и журнал изменились согласованно
+        self._transaction(self.changed, 'subscription_purchase', '40', updated_at=self.start + timedelta(minutes=1))
+        User.objects.filter(id=self.changed.id).update(balance=Decimal('60'))
+        User.objects.filter(id=self.drifted.id).update(balance=Decimal('100'))
+
+        result = run_reconciliation(now=self.start + timedelta(minutes=5))
+        self.assertEqual((result['checked'], result['drifted']), (2, 0))
+        self.assertFalse(drift_report().exists())
+
+
+class AdminStatsTests(TestCase):
+    """Дашборд считается агрегатами (выручка - по дневной сводке) и кешируется"""
+
+    def setUp(self):
+        cache.delete(ADMIN_STATS_CACHE_KEY)
+        self.addCleanup(cache.delete, ADMIN_STATS_CACHE_KEY)
+        self.admin = User.objects.create(username='stats_admin', role='admin')
+        self.customer = User.objects.create(username='stats_customer')
+        plan = SubscriptionPlan.objects.create(name='Год', price=Decimal('1000'), duration_days=365)
+        self.subscription = UserSubscription.objects.create(user=self.customer, plan=plan, status='active')
+        UserSubscription.objects.create(user=self.customer, plan=plan, status='expired')
+        for transaction_type, amount in (('subscription_purchase', '1000'), ('refund', '300'), ('deposit', '5000')):
+            Transaction.objects.create(
+                user=self.customer, subscription=self.subscription, amount=Decimal(amount),
+                transaction_type=transaction_type, status='completed'
+            )
+        update_rollup(now=timezone.now() + timedelta(hours=1))
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_stats_are_aggregated(self):
+        stats = self.client.get('/api/subscriptions/admin-stats/').data
+
+        self.assertEqual(
+            (stats['revenue']['total'], stats['revenue']['refunded'], stats['revenue']['net']),
+            (Decimal('1000'), Decimal('300'), Decimal('700'))
+        )
+        self.assertEqual(stats['subscriptions']['by_status'], {'active': 1, 'expired': 1})
+        self.assertEqual(stats['subscriptions']['active_by_plan'][0]['plan_name'], 'Год')
+        self.assertEqual((stats['users']['total'], stats['users']['with_active_subscriptions']), (2, 1))
+
+    def test_stats_are_cached_until_refresh(self):
+        first = self.client.get('/api/subscriptions/admin-stats/').data
+        UserSubscription.objects.filter(id=self.subscription.id).update(status='canceled')
+
+        self.assertEqual(self.client.get('/api/subscriptions/admin-stats/').data, first)
+        refreshed = self.client.get('/api/subscriptions/admin-stats/?refresh=1').data
+        self.assertEqual(refreshed['subscriptions']['active'], 0)
+
+    def test_only_admin_sees_stats(self):
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/api/subscriptions/admin-stats/').status_code, 403)
+
+
+class RetryDelayTests(SimpleTestCase):
+
+    @override_settings(PAYMENT_RETRY_BASE_SECONDS=100, PAYMENT_RETRY_MAX_DELAY_SECONDS=1000)
+    def test_delay_doubles_with_jitter_and_cap(self):
+        for attempt, delay in ((1, 100), (3, 400), (10, 1000)):
+            seconds = retry_delay(attempt).total_seconds()
+            self.assertTrue(delay / 2 <= seconds <= delay, (attempt, seconds))
+
+
+@override_settings(RENEWAL_WORKERS_PER_SHARD=1, PAYMENT_RETRY_MAX_ATTEMPTS=3)
+@mock.patch('subscriptions.payment_gateway.random.uniform', return_value=0)
+class RetryQueueTests(TransactionTestCase):
+    """Отклоненные продления повторяются с арендой; после лимита попыток - abandoned и уведомление"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='retried', balance=Decimal('500'))
+        plan = SubscriptionPlan.objects.create(name='Месяц', price=Decimal('100'), duration_days=30)
+        self.sub = UserSubscription.objects.create(
+            user=self.user, plan=plan, status='active', end_date=timezone.now() + timedelta(hours=1)
+        )
+        record_failures([(self.sub.id, self.user.id, Decimal('100'), 'Отклонено')])
+        self._make_due()
+
+    def _make_due(self):
+        FailedPayment.objects.update(next_attempt=timezone.now() - timedelta(seconds=1))
+
+    def test_failure_is_queued_once_and_unscheduled(self, _):
+        self.assertEqual(record_failures([(self.sub.id, self.user.id, Decimal('100'), 'Снова')]), 0)
+        self.assertEqual(FailedPayment.objects.count(), 1)
+        self.assertFalse(RenewalSchedule.objects.filter(subscription=self.sub).exists())
+
+    def test_claimed_retry_is_leased(self, _):
+        self.assertEqual(len(claim_retries()), 1)
+        self.assertEqual(claim_retries(), [])
+
+    def test_successful_retry_renews_and_resolves(self, _):
+        with mock.patch('subscriptions.payment_gateway.random.random', return_value=0.5):
+            totals = retry_due_payments()
+
+        self.assertEqual(totals, {RENEWED: 1})
+        self.assertEqual(FailedPayment.objects.get().status, 'resolved')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('400'))
+
+    # random.uniform подменен ради задержек шлюза, поэтому задержку повтора задаем явно
+    @mock.patch('subscriptions.retry_queue.retry_delay', return_value=timedelta(minutes=5))
+    def test_retries_are_abandoned_after_limit(self, *_):
+        with mock.patch('subscriptions.payment_gateway.random.random', return_value=0.99):
+            self.assertEqual(retry_due_payments(), {PAYMENT_FAILED: 1})
+            # Следующая попытка отложена
+            self.assertEqual(retry_due_payments(), {})
+            self._make_due()
+            totals = retry_due_payments()
+
+        self.assertEqual(totals, {PAYMENT_FAILED: 1, 'abandoned': 1})
+        failed_payment = FailedPayment.objects.get()
+        self.assertEqual((failed_payment.status, failed_payment.attempt_count), ('abandoned', 3))
+        self.assertTrue(Notification.objects.filter(user=self.user, title='Не удалось продлить подписку').exists())
+
+
+class ConditionalGetTests(TestCase):
+    """ETag по count и max(updated_at): 304 без сериализации, пока данные не менялись"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='polling', balance=Decimal('10'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.plan = SubscriptionPlan.objects.create(name='Месяц', price=Decimal('100'), duration_days=30)
+        catalog_cache.reset_cache()
+        self.addCleanup(catalog_cache.reset_cache)
+
+    def _revalidate(self, url, change):
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response
+
+    def test_plan_list(self):
+        self.plan.price = Decimal('90')
+        response = self._revalidate('/api/subscriptions/plans/', self.plan.save)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertIn('Authorization', response['Vary'])
+
+    def test_subscription_list_follows_nested_plan(self):
+        UserSubscription.objects.create(user=self.user, plan=self.plan, status='active')
+        self.plan.name = 'Месяц+'
+        response = self._revalidate('/api/subscriptions/my-subscriptions/', self.plan.save)
+        self.assertIn('Месяц+', response.content.decode())
+
+    def test_balance(self):
+        def deposit():
+            credit(self.user.id, Decimal('5'), 'deposit')
+            # force_authenticate держит объект пользователя; при JWT он читается заново
+            self.user.refresh_from_db()
+
+        self._revalidate('/api/auth/balance/', deposit)
+
+
+class PromoRedemptionTests(TestCase):
+    """Лимит промокода не превышается, даже если покупатели держат устаревшую копию"""
+
+    def setUp(self):
+        self.users = [User.objects.create(username=f'buyer{i}') for i in range(4)]
+        now = timezone.now()
+        self.promo = PromoCode.objects.create(
+            code='SALE', discount_percent=10, max_uses=3,
+            valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1)
+        )
+
+    def test_limit_holds_for_stale_copies(self):
+        # Все покупатели прочитали промокод до первой покупки (как из кеша каталога)
+        copies = [PromoCode.objects.get(id=self.promo.id) for _ in self.users]
+        for user, promo in zip(self.users[:3], copies):
+            redeem(promo, user.id)
+
+        with self.assertRaises(PromoUnavailable):
+            redeem(copies[3], self.users[3].id)
+        self.assertEqual(redeemed_count(self.promo), 3)
+        self.assertEqual(PromoRedemption.objects.count(), 3)
+
+    def test_limit_holds_across_shards(self):
+        redeem(self.promo, self.users[0].id)
+        promo = shard_promo(self.promo, 2)
+        for user in self.users[1:3]:
+            redeem(promo, user.id)
+
+        with self.assertRaises(PromoUnavailable):
+            redeem(promo, self.users[3].id)
+        self.assertEqual(redeemed_count(promo), 3)
+
+    def test_same_user_can_redeem_again(self):
+        redeem(self.promo, self.users[0].id)
+        redeem(self.promo, self.users[0].id)
+        self.assertEqual(redeemed_count(self.promo), 2)
+
+
+class CatalogCacheTests(TestCase):
+    """Тарифы читаются из кеша; сохранение сбрасывает его, наружу отдаются копии"""
+
+    def setUp(self):
+        self.plan = SubscriptionPlan.objects.create(name='Месяц', price=Decimal('100'), duration_days=30)
+        catalog_cache.reset_cache()
+        self.addCleanup(catalog_cache.reset_cache)
+
+    def test_repeated_reads_skip_database(self):
+        catalog_cache.get_plan(self.plan.id)
+        catalog_cache.get_active_plans()
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog_cache.get_plan(self.plan.id).name, 'Месяц')
+            self.assertEqual([plan.id for plan in catalog_cache.get_active_plans()], [self.plan.id])
+
+    def test_missing_plan_is_cached(self):
+        self.assertIsNone(catalog_cache.get_plan(self.plan.id + 1))
+        with self.assertNumQueries(0):
+            self.assertIsNone(catalog_cache.get_plan(self.plan.id + 1))
+
+    def test_save_invalidates_after_commit(self):
+        catalog_cache.get_plan(self.plan.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plan.is_active = False
+            self.plan.save()
+
+        self.assertIsNone(catalog_cache.get_plan(self.plan.id))
+
+    def test_callers_get_copies(self):
+        catalog_cache.get_plan(self.plan.id).price = Decimal('1')
+        self.assertEqual(catalog_cache.get_plan(self.plan.id).price, Decimal('100'))
+
+
+class PromoCacheTests(TestCase):
+    """Погашение сбрасывает в кеше каталога только свой промокод"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='cached')
+        now = timezone.now()
+        for code in ('ONE', 'TWO'):
+            PromoCode.objects.create(
+                code=code, discount_percent=10, max_uses=5,
+                valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1)
+            )
+        catalog_cache.reset_cache()
+        self.addCleanup(catalog_cache.reset_cache)
+
+    def test_redemption_invalidates_only_its_code(self):
+        promo = catalog_cache.get_promo('ONE')
+        catalog_cache.get_promo('TWO')
+        with self.captureOnCommitCallbacks(execute=True):
+            redeem(promo, self.user.id)
+
+        self.assertEqual(catalog_cache.get_promo('ONE').used_count, 1)
+        catalog_cache.get_promo('TWO')
+        stats = catalog_cache.cache_stats()
+        self.assertEqual((stats['misses'], stats['local_hits']), (3, 1))
+
+
+class EmailQueueTests(TestCase):
+    """Пачка писем идет через одно соединение, ошибка одного письма не трогает остальные"""
+
+    def setUp(self):
+        self.emails = [enqueue(f'user{i}@example.com', 'Тема', 'Текст') for i in range(4)]
+
+    def test_connection_is_reopened_once_after_error(self):
+        connection = mock.Mock()
+        connection.send_messages.side_effect = [1, OSError('connection reset'), 1, 1]
+
+        self.assertEqual(send_batch(self.emails, connection), (3, 1))
+        self.assertEqual((connection.close.call_count, connection.open.call_count), (1, 1))
+        failed = OutboundEmail.objects.get(id=self.emails[1].id)
+        self.assertEqual((failed.status, failed.attempt_count), ('pending', 1))
+        self.assertEqual(OutboundEmail.objects.filter(status='sent').count(), 3)
+
+    @override_settings(
+        EMAIL_QUEUE_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+        EMAIL_QUEUE_BATCH_SIZE=3, EMAIL_QUEUE_RATE_PER_SECOND=0
+    )
+    def test_queue_is_drained_in_batches(self):
+        report = drain_queue()
+
+        self.assertEqual(report, {'sent': 4, 'failed': 0, 'batches': 2})
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [email.to_email for email in self.emails])
+        self.assertEqual(drain_queue()['sent'], 0)
+
+    def test_claimed_emails_are_leased(self):
+        self.assertEqual(len(claim_batch(limit=3)), 3)
+        self.assertEqual([email.id for email in claim_batch()], [self.emails[3].id])
+        self.assertEqual(claim_batch(), [])
+
+    @override_settings(EMAIL_QUEUE_MAX_ATTEMPTS=2)
+    def test_email_fails_after_max_attempts(self):
+        connection = mock.Mock()
+        connection.send_messages.side_effect = OSError('mailbox unavailable')
+        send_batch(self.emails[:1], connection)
+        self.assertEqual(OutboundEmail.objects.get(id=self.emails[0].id).status, 'pending')
+
+        send_batch([OutboundEmail.objects.get(id=self.emails[0].id)], connection)
+        self.assertEqual(OutboundEmail.objects.get(id=self.emails[0].id).status, 'failed')
+
+    def test_old_sent_emails_are_purged(self):
+        OutboundEmail.objects.filter(id=self.emails[0].id).update(
+            status='sent', sent_at=timezone.now() - timedelta(days=30)
+        )
+        OutboundEmail.objects.filter(id=self.emails[1].id).update(status='sent', sent_at=timezone.now())
+
+        self.assertEqual(purge_sent(days=7), 1)
+        self.assertEqual(OutboundEmail.objects.count(), 3)
+
+    def test_rest_of_batch_waits_for_lease_if_reopen_fails(self):
+        connection = mock.Mock()
+        connection.send_messages.side_effect = OSError('connection reset')
+        connection.open.side_effect = OSError('connection refused')
+
+        self.assertEqual(send_batch(self.emails, connection), (0, 1))
+        self.assertEqual(connection.send_messages.call_count, 1)
+        self.assertEqual(OutboundEmail.objects.filter(attempt_count=0).count(), 3)
+
+
+class EmailTemplateTests(TestCase):
+    """Шаблоны писем компилируются один раз, пачка получателей рендерится в одном контексте"""
+
+    def setUp(self):
+        clear_registry()
+        self.addCleanup(clear_registry)
+
+    def test_template_is_compiled_once(self):
+        template = get_email_template('payment_failed')
+        self.assertIs(get_email_template('payment_failed'), template)
+        self.assertEqual(get_email_template('no_such_email').name, DEFAULT_TEMPLATE)
+
+    def test_text_part_is_not_escaped(self):
+        subject, text, html = get_email_template('payment_failed').render(
+            payment_failed_context('Про <план>', 'Недостаточно средств')
+        )
+
+        self.assertEqual(subject, 'Ошибка продления подписки Про <план>')
+        self.assertIn('Про <план>', text)
+        self.assertNotIn('<li>', text)
+        self.assertIn('Про &lt;план&gt;', html)
+
+    def test_recipients_do_not_share_context(self):
+        rendered = get_email_template('subscription_expiring').render_many([
+            subscription_expiring_context('Месяц', 3, '20.10.2026'),
+            subscription_expiring_context('Год', 1, '18.10.2026'),
+        ])
+
+        self.assertEqual([subject for subject, _, _ in rendered], [
+            'Подписка Месяц истекает через 3 дн.', 'Подписка Год истекает через 1 дн.'
+        ])
+        self.assertNotIn('Месяц', rendered[1][1])
+
+    def test_explicit_subject_overrides_template(self):
+        self.assertTrue(send_email_notification('user@example.com', 'Своя тема', 'notification', {'message': 'Привет', 'code': 'X1'}))
+
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.subject, 'Своя тема')
+        self.assertIn('- code: X1', email.body_text)
+
+    @override_settings(EMAIL_QUEUE_BATCH_SIZE=2)
+    def test_bulk_email_is_rendered_in_batches(self):
+        recipients = [
+            (f'user{i}@example.com', subscription_renewed_context(f'План {i}', '01.11.2026', 100)) for i in range(5)
+        ]
+        template = get_email_template('subscription_renewed')
+        with mock.patch.object(template, 'render_many', wraps=template.render_many) as render_many:
+            self.assertEqual(send_bulk_email('subscription_renewed', recipients), 5)
+
+        self.assertEqual([len(call.args[0]) for call in render_many.call_args_list], [2, 2, 1])
+        email = OutboundEmail.objects.get(to_email='user4@example.com')
+        self.assertEqual(email.subject, 'Подписка План 4 продлена')
+
+
+# Уведомления пачки буферизуются после коммита ее транзакции - нужны настоящие коммиты
+class ExpirationReminderTests(TransactionTestCase):
+    """Напоминания по горизонтам: одно письмо на пользователя, без повторов"""
+
+    def setUp(self):
+        self.now = timezone.now()
+        plan = SubscriptionPlan.objects.create(name='Месяц', price=Decimal('100'), duration_days=30)
+        self.digest_user = User.objects.create(username='digest', email='digest@example.com')
+        self.silent_user = User.objects.create(username='silent')
+        far_user = User.objects.create(username='far', email='far@example.com')
+
+        def subscription(user, days):
+            return UserSubscription.objects.create(
+                user=user, plan=plan, status='active', end_date=self.now + timedelta(days=days)
+            )
+
+        self.soon, self.later = subscription(self.digest_user, 2), subscription(self.digest_user, 6)
+        subscription(self.silent_user, 1)
+        subscription(far_user, 10)
+
+    def test_user_subscriptions_are_joined_into_one_email(self):
+        report = send_expiration_reminders(now=self.now, chunk_size=1)
+
+        self.assertEqual(report, {'users': 2, 'reminders': 3, 'emails': 1})
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.to_email, email.template_name), ('digest@example.com', 'subscription_expiring_digest'))
+        self.assertEqual(Notification.objects.filter(notification_type='subscription_expiring').count(), 2)
+        self.assertEqual(
+            dict(ExpirationReminder.objects.filter(user=self.digest_user).values_list('subscription_id', 'horizon_days')),
+            {self.soon.id: 3, self.later.id: 7}
+        )
+
+    def test_reminders_are_not_repeated(self):
+        send_expiration_reminders(now=self.now)
+        self.assertEqual(send_expiration_reminders(now=self.now + timedelta(hours=1)), {'users': 0, 'reminders': 0, 'emails': 0})
+
+        # Через три с половиной дня вторая подписка попала в меньший горизонт, дальняя - в больший,
+        # ближние уже истекли
+        later = self.now + timedelta(days=3, hours=12)
+        self.assertEqual(send_expiration_reminders(now=later), {'users': 2, 'reminders': 2, 'emails': 2})
+        self.assertEqual(
+            list(ExpirationReminder.objects.filter(subscription=self.later).values_list('horizon_days', flat=True).order_by('horizon_days')),
+            [3, 7]
+        )
+
+    def test_worker_reminds_only_given_users(self):
+        self.assertEqual(expiring_user_ids(now=self.now), [self.digest_user.id, self.silent_user.id])
+
+        self.assertEqual(remind_users([self.silent_user.id], now=self.now), {'users': 1, 'reminders': 1, 'emails': 0})
+        self.assertEqual(list(ExpirationReminder.objects.values_list('user_id', flat=True)), [self.silent_user.id])
+
+    def test_reminders_for_past_end_dates_are_purged(self):
+        send_expiration_reminders(now=self.now)
+        self.assertEqual(purge_reminders(now=self.now + timedelta(days=3)), 2)
+        self.assertEqual(list(ExpirationReminder.objects.values_list('subscription_id', flat=True)), [self.later.id])
+
+
+class IdempotencyKeyTests(TestCase):
+    """Повтор платежного запроса с тем же Idempotency-Key не выполняется второй раз"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='retrying', balance=Decimal('0'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _deposit(self, amount, key='deposit-1'):
+        return self.client.post('/api/auth/deposit/', {'amount': amount}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replay_returns_saved_response(self):
+        first = self._deposit('100')
+        second = self._deposit('100')
+
+        self.assertEqual(second.status_code, first.status_code)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('100'))
+
+    def test_key_reused_with_other_body_is_rejected(self):
+        self._deposit('100')
+        self.assertEqual(self._deposit('200').status_code, 422)
+
+    def test_key_in_progress_conflicts(self):
+        self._deposit('100')
+        # Первый запрос будто еще выполняется
+        IdempotencyKey.objects.update(status='in_progress')
+
+        self.assertEqual(self._deposit('100').status_code, 409)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('100'))
+
+    @mock.patch('subscriptions.payment_gateway.random.random', return_value=0.5)
+    @mock.patch('subscriptions.payment_gateway.random.uniform', return_value=0)
+    def test_server_error_releases_key(self, *_):
+        plan = SubscriptionPlan.objects.create(name='Месяц', price=Decimal('100'), duration_days=30)
+        User.objects.filter(id=self.user.id).update(balance=Decimal('100'))
+
+        def purchase():
+            return self.client.post(
+                '/api/subscriptions/purchase/', {'plan_id': plan.id}, format='json', HTTP_IDEMPOTENCY_KEY='buy-1'
+            )
+
+        with mock.patch('subscriptions.views.complete_purchase', side_effect=RuntimeError), \
+                mock.patch.object(FakePaymentGateway, 'refund_payment'):
+            self.assertEqual(purchase().status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        self.assertEqual(purchase().status_code, 201)
+
+    def test_expired_keys_are_purged(self):
+        self._deposit('100')
+        self.assertEqual(purge_expired_keys(), 0)
+        self.assertEqual(purge_expired_keys(now=timezone.now() + timedelta(days=2)), 1)
+
+
+class IdempotentChargeTests(TestCase):
+
+    @mock.patch('subscriptions.payment_gateway.random.random', return_value=0.5)
+    def test_same_key_is_charged_once(self, _):
+        first = _charge_once(1, 100.0, 'tests:charge-once')
+        second = _charge_once(1, 100.0, 'tests:charge-once')
+
+        self.assertNotIn('replayed', first)
+        self.assertTrue(second['replayed'])
+        self.assertEqual(second['transaction_id'], first['transaction_id'])
+
+
+# Брокер memory:// в тестах: задачи и chord выполняются сразу при вызове (CELERY_TASK_ALWAYS_EAGER);
+# продление в одном потоке, как в ManualRenewalTests
+@skipUnless(tasks, 'celery не установлен')
+@override_settings(RENEWAL_WORKERS_PER_SHARD=1, RENEWAL_SHARD_COUNT=2)
+@mock.patch('subscriptions.payment_gateway.random.uniform', return_value=0)
+class CeleryTaskTests(TransactionTestCase):
+    """Координаторы раздают работу частями, а итоговые задачи суммируют счетчики"""
+
+    def setUp(self):
+        self.plan = SubscriptionPlan.objects.create(name='Месяц', price=Decimal('100'), duration_days=30)
+        self.now = timezone.now()
+        self.users = [
+            User.objects.create(username=f'celery{i}', email=f'celery{i}@example.com', balance=Decimal('500'))
+            for i in range(3)
+        ]
+
+    def _subscriptions(self, end_date, status='active'):
+        return [
+            UserSubscription.objects.create(user=user, plan=self.plan, status=status, end_date=end_date)
+            for user in self.users
+        ]
+
+    def test_beat_schedule_names_registered_tasks(self, _):
+        from backend.celery import app
+
+        for entry in app.conf.beat_schedule.values():
+            self.assertIn(entry['task'], app.tasks)
+
+    def test_renewals_are_fanned_out_by_shard(self, _):
+        subs = self._subscriptions(self.now + timedelta(hours=1))
+        with mock.patch('subscriptions.payment_gateway.random.random', return_value=0.5):
+            tasks.check_subscription_renewals.delay()
+
+        end_dates = set(UserSubscription.objects.values_list('end_date', flat=True))
+        self.assertEqual(end_dates, {subs[0].end_date + timedelta(days=30)})
+        self.assertEqual(set(User.objects.values_list('balance', flat=True)), {Decimal('400')})
+        self.assertIsNone(tasks.check_subscription_renewals.delay().result)
+
+    @override_settings(EXPIRY_CHUNK_SIZE=2)
+    def test_expired_subscriptions_are_closed_in_chunks(self, _):
+        self._subscriptions(self.now - timedelta(days=1))
+
+        with mock.patch.object(tasks.expire_chunk_task, 'run', wraps=tasks.expire_chunk_task.run) as expire_chunk:
+            tasks.close_expired_subscriptions.delay()
+
+        self.assertEqual(expire_chunk.call_count, 2)
+        self.assertEqual(set(UserSubscription.objects.values_list('status', flat=True)), {'expired'})
+
+    @override_settings(EXPIRY_REMINDER_CHUNK_SIZE=2)
+    def test_reminders_are_sent_by_user_chunks(self, _):
+        self._subscriptions(self.now + timedelta(days=2))
+
+        tasks.send_renewal_notifications.delay()
+        self.assertEqual(ExpirationReminder.objects.count(), 3)
+        self.assertEqual(OutboundEmail.objects.filter(template_name='subscription_expiring').count(), 3)
+
+        # Повторный запуск ничего не отправляет
+        tasks.send_renewal_notifications.delay()
+        self.assertEqual(OutboundEmail.objects.count(), 3)
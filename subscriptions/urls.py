@@ -7,7 +7,7 @@ from .views import (
     RefundRequestView, RefundPolicyView,
     TestRenewSubscriptionView, UpdateEndDateView, ManualRenewalCheckView,
     SendTestEmailView, AdminSubscriptionViewSet, AdminTransactionViewSet,
-    NotificationViewSet,
+    NotificationViewSet, AdminStatsView, AdminAnalyticsView,
 )
 
 router = DefaultRouter()
@@ -23,6 +23,8 @@ urlpatterns = [
     path('', include(router.urls)),
     path('purchase/', PurchaseSubscriptionView.as_view(), name='purchase-subscription'),
     path('balance/', UserBalanceView.as_view(), name='user-balance'),
+    path('admin-stats/', AdminStatsView.as_view(), name='admin-stats'),
+    path('admin-analytics/', AdminAnalyticsView.as_view(), name='admin-analytics'),
 
     # Возвраты
     path('refund-request/', RefundRequestView.as_view(), name='refund-request'),
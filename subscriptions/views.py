@@ -1,4 +1,5 @@
 from django.shortcuts import render
+from django.http import HttpResponse, Http404
 
 # Create your views here.
 
@@ -15,25 +16,59 @@ from .serializers import (
     SubscriptionPlanSerializer, UserSubscriptionSerializer,
     TransactionSerializer, PromoCodeSerializer, SubscriptionPurchaseSerializer
 )
+from .pagination import CreatedAtCursorPagination
+from .idempotency import idempotent
+from .catalog_cache import get_active_plans, get_active_promos
+from .conditional import ConditionalGetMixin, conditional, make_etag
+from .promo import redeem, PromoUnavailable
+from .purchases import complete_purchase, reverse_purchase
 from .payment_gateway import FakePaymentGateway
+from .renewal_engine import (
+    renew_now,
+    RENEWED, INSUFFICIENT_FUNDS, PAYMENT_FAILED, PAYMENT_UNKNOWN, SKIPPED
+)
+from .stats import get_admin_stats
+from .rollup import daily_revenue, rollup_rows, write_csv, get_checkpoint
 from users.models import User
 from users.models import Notification
-from datetime import timedelta
+from users.notifications import NotificationBuffer, mark_read, unread_count
+from users.balance import credit, debit, InsufficientFunds
+from datetime import date, timedelta
 from .email_service import send_test_email
 from users.serializers import NotificationSerializer
 
 logger = logging.getLogger(__name__)
 
 
-class SubscriptionPlanViewSet(viewsets.ReadOnlyModelViewSet):
+class CatalogCacheMixin:
+    """Список и карточка отдаются из кеша каталога (catalog_cache), а не из БД"""
+    cached_list = None
+    
+    def get_queryset(self):
+        # Список объектов вместо QuerySet: фильтров и пагинации у каталога нет
+        return self.cached_list()
+    
+    def get_object(self):
+        lookup = str(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        for obj in self.cached_list():
+            if str(obj.pk) == lookup:
+                self.check_object_permissions(self.request, obj)
+                return obj
+        raise Http404
+
+
+class SubscriptionPlanViewSet(ConditionalGetMixin, CatalogCacheMixin, viewsets.ReadOnlyModelViewSet):
     queryset = SubscriptionPlan.objects.filter(is_active=True)
     serializer_class = SubscriptionPlanSerializer
     permission_classes = [permissions.AllowAny]
+    cached_list = staticmethod(get_active_plans)
 
 
-class UserSubscriptionViewSet(viewsets.ModelViewSet):
+class UserSubscriptionViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = UserSubscriptionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # В ответ входит вложенный тариф
+    etag_fields = ('updated_at', 'plan__updated_at')
     
     def get_queryset(self):
         return UserSubscription.objects.filter(user=self.request.user)
@@ -148,6 +183,7 @@ class PurchaseSubscriptionView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = SubscriptionPurchaseSerializer
     
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -165,146 +201,157 @@ class PurchaseSubscriptionView(generics.CreateAPIView):
             discount_percent = promo.discount_percent
             price = plan.price * (100 - discount_percent) / 100
         
-        # Проверяем, достаточно ли средств у пользователя
-        if user.balance < price:
+        # Фаза 1: короткая транзакция - резервируем средства и создаем pending-записи
+        try:
+            with db_transaction.atomic():
+                # Создание подписки в статусе pending
+                subscription = UserSubscription.objects.create(
+                    user=user,
+                    plan=plan,
+                    status='pending'
+                )
+                
+                # Занимаем использование промокода условным UPDATE: лимит не превысится
+                if promo:
+                    redeem(promo, user.id, subscription)
+                
+                # Создание транзакции
+                transaction = Transaction.objects.create(
+                    user=user,
+                    subscription=subscription,
+                    amount=price,
+                    transaction_type='subscription_purchase',
+                    status='pending',
+                    description=f'Покупка подписки {plan.name}' + (f' (скидка {discount_percent}%)' if promo else '')
+                )
+                
+                # Резервируем средства условным списанием: при ошибке платежа вернем
+                user.balance = debit(user.id, price, 'subscription_purchase', transaction, transaction.description)
+        except InsufficientFunds:
+            user.refresh_from_db(fields=['balance'])
             return Response({
                 'success': False,
                 'message': f'Недостаточно средств на балансе. Необходимо: {price} руб., доступно: {user.balance} руб.'
             }, status=status.HTTP_402_PAYMENT_REQUIRED)
+        except PromoUnavailable as e:
+            return Response({'promo_code': [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
         
-        with db_transaction.atomic():
-            # Создание подписки в статусе pending
-            subscription = UserSubscription.objects.create(
-                user=user,
-                plan=plan,
-                status='pending'
-            )
-            
-            # Создание транзакции
-            transaction = Transaction.objects.create(
-                user=user,
-                subscription=subscription,
-                amount=price,
-                transaction_type='subscription_purchase',
-                status='pending',
-                description=f'Покупка подписки {plan.name}' + (f' (скидка {discount_percent}%)' if promo else '')
-            )
-            
-            # Обработка платежа через фейковый шлюз
+        # Обработка платежа через фейковый шлюз - вне транзакции БД,
+        # чтобы ожидание шлюза не держало блокировку записи
+        try:
             payment_result = FakePaymentGateway.process_payment(
                 amount=float(price),
                 user_id=user.id,
                 description=f"Подписка: {plan.name}"
             )
-            
-            # Обновление статуса транзакции
-            transaction.payment_data = payment_result
+        except Exception as e:
+            logger.error(f"Ошибка обращения к платежному шлюзу: {e}")
+            payment_result = {'success': False, 'message': 'Платежная система недоступна'}
+        
+        # Фаза 2: фиксируем результат или компенсируем резерв. Ошибка фиксации тоже
+        # компенсируется; если процесс упадет, резерв вернет sweep_stale_purchases
+        try:
+            if payment_result['success'] and not complete_purchase(transaction, payment_result):
+                # Покупку уже отменил уборщик зависших покупок - возвращаем платеж
+                FakePaymentGateway.refund_payment(payment_result['transaction_id'], float(price))
+                payment_result = dict(payment_result, success=False, message='Время ожидания покупки истекло')
+            if not payment_result['success']:
+                reverse_purchase(transaction, payment_result, f'Возврат резерва: {plan.name}')
+                user.refresh_from_db(fields=['balance'])
+        except Exception as e:
+            logger.error(f"Ошибка фиксации покупки {transaction.id}: {e}")
+            reverse_purchase(transaction, payment_result, f'Возврат резерва: {plan.name}')
             if payment_result['success']:
-                # Списание средств с баланса пользователя
-                user.balance -= price
-                user.save()
-                
-                transaction.status = 'completed'
-                
-                # Активация подписки
-                subscription.status = 'active'
-                subscription.start_date = timezone.now()
-                subscription.end_date = timezone.now() + timezone.timedelta(days=plan.duration_days)
-                
-                # Увеличиваем счетчик использования промокода
-                if promo:
-                    promo.used_count += 1
-                    promo.save()
-                
-                subscription.save()
-                transaction.save()
-                
-                # Создаем уведомление об успешной покупке
-                try:
-                    Notification.objects.create(
-                        user=user,
-                        notification_type='payment_success',
-                        title='Подписка оформлена',
-                        message=f'Вы успешно подписались на тариф "{plan.name}" за {price} руб. Подписка активна до {subscription.end_date.strftime("%d.%m.%Y")}',
-                        is_read=False,
-                        data={
-                            'subscription_id': subscription.id,
-                            'plan_name': subscription.plan.name,
-                            'amount': str(price),
-                            'end_date': subscription.end_date.isoformat(),
-                            'discount_percent': discount_percent if promo else 0
-                        }
-                    )
-                    
-                    # Логируем email уведомление
-                    logger.info("=" * 60)
-                    logger.info("EMAIL УВЕДОМЛЕНИЕ (симуляция):")
-                    logger.info(f"Кому: {user.email}")
-                    logger.info(f"Тема: Подписка на {plan.name} оформлена!")
-                    logger.info(f"Сообщение: Вы успешно подписались на тариф '{plan.name}'")
-                    logger.info(f"Сумма: {price} руб." + (f" (скидка {discount_percent}%)" if promo else ""))
-                    logger.info(f"Статус: Активна до {subscription.end_date.strftime('%d.%m.%Y')}")
-                    logger.info(f"Новый баланс: {user.balance} руб.")
-                    logger.info("=" * 60)
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка при создании уведомления: {e}")
-                
-                logger.info(f"Подписка активирована для пользователя {user.username}, сумма: {price}")
-                
-                return Response({
-                    'success': True,
-                    'message': 'Подписка успешно оформлена',
-                    'subscription_id': subscription.id,
-                    'transaction_id': transaction.id,
-                    'end_date': subscription.end_date,
-                    'new_balance': float(user.balance)
-                }, status=status.HTTP_201_CREATED)
-            else:
-                transaction.status = 'failed'
-                subscription.status = 'expired'
-                subscription.save()
-                transaction.save()
+                FakePaymentGateway.refund_payment(payment_result['transaction_id'], float(price))
+            return Response({
+                'success': False,
+                'message': 'Не удалось завершить покупку, средства возвращены на баланс'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        if payment_result['success']:
+            # Создаем уведомление об успешной покупке
+            try:
+                Notification.objects.create(
+                    user=user,
+                    notification_type='payment_success',
+                    title='Подписка оформлена',
+                    message=f'Вы успешно подписались на тариф "{plan.name}" за {price} руб. Подписка активна до {subscription.end_date.strftime("%d.%m.%Y")}',
+                    is_read=False,
+                    data={
+                        'subscription_id': subscription.id,
+                        'plan_name': subscription.plan.name,
+                        'amount': str(price),
+                        'end_date': subscription.end_date.isoformat(),
+                        'discount_percent': discount_percent if promo else 0
+                    }
+                )
                 
-                # Создаем уведомление об ошибке
-                try:
-                    Notification.objects.create(
-                        user=user,
-                        notification_type='payment_failed',
-                        title='Ошибка оплаты',
-                        message=f'Не удалось оплатить подписку "{plan.name}". Причина: {payment_result["message"]}',
-                        is_read=False,
-                        data={
-                            'plan_name': plan.name,
-                            'amount': str(price),
-                            'error': payment_result["message"]
-                        }
-                    )
-                    
-                    logger.error(f"Ошибка платежа для пользователя {user.username}: {payment_result['message']}")
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка при создании уведомления об ошибке: {e}")
+                # Логируем email уведомление
+                logger.info("=" * 60)
+                logger.info("EMAIL УВЕДОМЛЕНИЕ (симуляция):")
+                logger.info(f"Кому: {user.email}")
+                logger.info(f"Тема: Подписка на {plan.name} оформлена!")
+                logger.info(f"Сообщение: Вы успешно подписались на тариф '{plan.name}'")
+                logger.info(f"Сумма: {price} руб." + (f" (скидка {discount_percent}%)" if promo else ""))
+                logger.info(f"Статус: Активна до {subscription.end_date.strftime('%d.%m.%Y')}")
+                logger.info(f"Новый баланс: {user.balance} руб.")
+                logger.info("=" * 60)
                 
-                return Response({
-                    'success': False,
-                    'message': f'Ошибка платежа: {payment_result["message"]}',
-                    'transaction_id': transaction.id
-                }, status=status.HTTP_402_PAYMENT_REQUIRED)
+            except Exception as e:
+                logger.error(f"Ошибка при создании уведомления: {e}")
+            
+            logger.info(f"Подписка активирована для пользователя {user.username}, сумма: {price}")
+            
+            return Response({
+                'success': True,
+                'message': 'Подписка успешно оформлена',
+                'subscription_id': subscription.id,
+                'transaction_id': transaction.id,
+                'end_date': subscription.end_date,
+                'new_balance': float(user.balance)
+            }, status=status.HTTP_201_CREATED)
+        
+        # Создаем уведомление об ошибке
+        try:
+            Notification.objects.create(
+                user=user,
+                notification_type='payment_failed',
+                title='Ошибка оплаты',
+                message=f'Не удалось оплатить подписку "{plan.name}". Причина: {payment_result["message"]}',
+                is_read=False,
+                data={
+                    'plan_name': plan.name,
+                    'amount': str(price),
+                    'error': payment_result["message"]
+                }
+            )
+            
+            logger.error(f"Ошибка платежа для пользователя {user.username}: {payment_result['message']}")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при создании уведомления об ошибке: {e}")
+        
+        return Response({
+            'success': False,
+            'message': f'Ошибка платежа: {payment_result["message"]}',
+            'transaction_id': transaction.id
+        }, status=status.HTTP_402_PAYMENT_REQUIRED)
 
 
-class TransactionViewSet(viewsets.ReadOnlyModelViewSet):
+class TransactionViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = TransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
     
     def get_queryset(self):
         return Transaction.objects.filter(user=self.request.user)
 
 
-class PromoCodeViewSet(viewsets.ReadOnlyModelViewSet):
+class PromoCodeViewSet(ConditionalGetMixin, CatalogCacheMixin, viewsets.ReadOnlyModelViewSet):
     queryset = PromoCode.objects.filter(is_active=True)
     serializer_class = PromoCodeSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cached_list = staticmethod(get_active_promos)
 
 
 class UserBalanceView(generics.GenericAPIView):
@@ -356,8 +403,8 @@ class MarkNotificationReadView(generics.GenericAPIView):
                 id=notification_id,
                 user=request.user
             )
-            notification.is_read = True
-            notification.save()
+            # Условный UPDATE: счетчик непрочитанных уменьшится только при реальном изменении
+            mark_read(request.user.id, notification.id)
             
             return Response({'success': True})
             
@@ -373,10 +420,7 @@ class MarkAllNotificationsReadView(generics.GenericAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def post(self, request):
-        updated = Notification.objects.filter(
-            user=request.user,
-            is_read=False
-        ).update(is_read=True)
+        updated = mark_read(request.user.id)
         
         return Response({
             'success': True,
@@ -427,10 +471,14 @@ class RefundRequestView(generics.CreateAPIView):
         # По умолчанию - без возврата
         return 0, "Возврат невозможен по истечении срока"
     
+    @idempotent
     def post(self, request, *args, **kwargs):
         transaction_id = request.data.get('transaction_id')
         refund_reason = request.data.get('reason', '')
         
+        # Уведомления пишутся одним bulk_create после коммита транзакции
+        notifications = NotificationBuffer()
+        
         try:
             with db_transaction.atomic():
                 # Блокируем транзакцию для предотвращения повторных возвратов
@@ -499,8 +547,10 @@ class RefundRequestView(generics.CreateAPIView):
                     
                     # Возвращаем средства на баланс пользователя
                     user = request.user
-                    user.balance += Decimal(str(refund_amount))
-                    user.save()
+                    user.balance = credit(
+                        user.id, Decimal(str(refund_amount)), 'refund',
+                        refund_transaction, refund_transaction.description
+                    )
                     
                     # Обновляем подписку если есть
                     if transaction.subscription:
@@ -512,7 +562,7 @@ class RefundRequestView(generics.CreateAPIView):
                             subscription.save()
                             
                             # Создаем уведомление об отмене
-                            Notification.objects.create(
+                            notifications.add(
                                 user=request.user,
                                 notification_type='subscription_canceled',
                                 title='Подписка отменена',
@@ -533,7 +583,7 @@ class RefundRequestView(generics.CreateAPIView):
                                 subscription.save()
                                 
                                 # Создаем уведомление об изменении срока
-                                Notification.objects.create(
+                                notifications.add(
                                     user=request.user,
                                     notification_type='subscription_modified',
                                     title='Срок подписки изменен',
@@ -548,13 +598,13 @@ class RefundRequestView(generics.CreateAPIView):
                     
                     # Создаем уведомление о возврате
                     try:
-                        Notification.objects.create(
+                        notifications.add(
                             user=request.user,
                             notification_type='refund_processed',
                             title='Возврат средств',
                             message=f'Возврат средств в размере {refund_amount:.2f} RUB успешно обработан. {refund_reason_text}',
                             data={
-                                'transaction_id': refund_transaction.id,
+                                'transaction_id': str(refund_transaction.id),
                                 'refund_amount': refund_amount,
                                 'original_amount': float(transaction.amount),
                                 'refund_percentage': (refund_amount / float(transaction.amount)) * 100 if transaction.amount > 0 else 0
@@ -609,6 +659,8 @@ class RefundRequestView(generics.CreateAPIView):
                 {'error': 'Внутренняя ошибка сервера при обработке возврата'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+        finally:
+            notifications.flush()
             
 
 class RefundPolicyView(generics.RetrieveAPIView):
@@ -640,6 +692,7 @@ class TestRenewSubscriptionView(generics.GenericAPIView):
     """Тестовое продление подписки"""
     permission_classes = [permissions.IsAuthenticated]
     
+    @idempotent
     def post(self, request, subscription_id):
         try:
             subscription = UserSubscription.objects.get(
@@ -770,102 +823,76 @@ class ManualRenewalCheckView(generics.GenericAPIView):
             end_date__lte=renewal_date,
             end_date__gt=timezone.now()
         ).select_related('user', 'plan')
+        subscriptions = {subscription.id: subscription for subscription in subscriptions}
+        
+        # Тот же путь, что и у прогона: аренда, пакетные платежи, очередь повторов и перенос
+        outcomes = renew_now(list(subscriptions), description='Ручное продление (админ)')
         
         results = []
         renewed_count = 0
         failed_count = 0
         
-        for subscription in subscriptions:
-            try:
-                # Проверяем баланс пользователя
-                if subscription.user.balance < subscription.plan.price:
-                    results.append({
-                        'subscription_id': subscription.id,
-                        'user': subscription.user.username,
-                        'plan': subscription.plan.name,
-                        'status': 'failed',
-                        'error': 'Недостаточно средств на балансе',
-                        'message': f'Баланс: {subscription.user.balance}, требуется: {subscription.plan.price}'
-                    })
-                    failed_count += 1
-                    continue
-                
-                # Имитация платежа
-                payment_result = FakePaymentGateway.process_payment(
-                    amount=float(subscription.plan.price),
-                    user_id=subscription.user.id,
-                    description=f"Ручное продление: {subscription.plan.name}"
-                )
-                
-                if payment_result['success']:
-                    # Списание средств
-                    subscription.user.balance -= subscription.plan.price
-                    subscription.user.save()
-                    
-                    # Продлеваем подписку
-                    new_end_date = subscription.end_date + timedelta(days=subscription.plan.duration_days)
-                    subscription.end_date = new_end_date
-                    subscription.save()
-                    
-                    # Создаем транзакцию
-                    Transaction.objects.create(
-                        user=subscription.user,
-                        subscription=subscription,
-                        amount=subscription.plan.price,
-                        transaction_type='subscription_renewal',
-                        status='completed',
-                        description='Ручное продление (админ)',
-                        payment_data=payment_result
-                    )
-                    
-                    # Создаем уведомление
-                    try:
-                        Notification.objects.create(
-                            user=subscription.user,
-                            notification_type='subscription_renewal',
-                            title='Подписка продлена',
-                            message=f'Ваша подписка "{subscription.plan.name}" автоматически продлена до {new_end_date.strftime("%d.%m.%Y")}',
-                            data={
-                                'subscription_id': subscription.id,
-                                'plan_name': subscription.plan.name,
-                                'new_end_date': new_end_date.isoformat(),
-                                'amount': str(subscription.plan.price),
-                                'new_balance': float(subscription.user.balance)
-                            }
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка при создании уведомления: {e}")
-                    
-                    results.append({
-                        'subscription_id': subscription.id,
-                        'user': subscription.user.username,
-                        'plan': subscription.plan.name,
-                        'status': 'renewed',
-                        'new_end_date': new_end_date.isoformat(),
-                        'new_balance': float(subscription.user.balance),
-                        'message': 'Успешно продлено'
-                    })
-                    renewed_count += 1
-                    
-                else:
-                    results.append({
-                        'subscription_id': subscription.id,
-                        'user': subscription.user.username,
-                        'plan': subscription.plan.name,
-                        'status': 'failed',
-                        'error': payment_result['message'],
-                        'message': 'Ошибка платежа'
-                    })
-                    failed_count += 1
-                    
-            except Exception as e:
+        # Подписки, которые сейчас продлевает прогон или ждут в очереди повторов
+        processed = {outcome['subscription_id'] for outcome in outcomes}
+        for subscription in subscriptions.values():
+            if subscription.id not in processed:
                 results.append({
                     'subscription_id': subscription.id,
+                    'user': subscription.user.username,
+                    'plan': subscription.plan.name,
+                    'status': 'skipped',
+                    'message': 'Подписка уже обрабатывается (прогон продления или очередь повторов)'
+                })
+        
+        for outcome in outcomes:
+            subscription = subscriptions[outcome['subscription_id']]
+            result = {
+                'subscription_id': subscription.id,
+                'user': subscription.user.username,
+                'plan': subscription.plan.name,
+            }
+            
+            if outcome['outcome'] == RENEWED:
+                result.update({
+                    'status': 'renewed',
+                    'new_end_date': outcome['new_end_date'].isoformat(),
+                    'new_balance': float(outcome['new_balance']),
+                    'message': 'Успешно продлено'
+                })
+                renewed_count += 1
+            elif outcome['outcome'] == INSUFFICIENT_FUNDS:
+                result.update({
+                    'status': 'failed',
+                    'error': 'Недостаточно средств на балансе',
+                    'message': f'Баланс: {outcome["balance"]}, требуется: {outcome["price"]}'
+                })
+                failed_count += 1
+            elif outcome['outcome'] == PAYMENT_FAILED:
+                result.update({
+                    'status': 'failed',
+                    'error': outcome['error'],
+                    'message': 'Ошибка платежа'
+                })
+                failed_count += 1
+            elif outcome['outcome'] == SKIPPED:
+                result.update({
+                    'status': 'skipped',
+                    'message': 'Подписка изменилась во время обработки'
+                })
+            elif outcome['outcome'] == PAYMENT_UNKNOWN:
+                result.update({
+                    'status': 'pending',
+                    'message': 'Шлюз не ответил, платеж будет перепроверен с тем же ключом'
+                })
+            else:
+                result.update({
                     'status': 'error',
-                    'error': str(e),
+                    'error': outcome.get('error', ''),
                     'message': 'Исключение при обработке'
                 })
                 failed_count += 1
+            
+            results.append(result)
         
         return Response({
             'success': True,
@@ -897,7 +924,7 @@ class SendTestEmailView(generics.GenericAPIView):
             if success:
                 return Response({
                     'success': True,
-                    'message': f'Тестовый email отправлен на {email}'
+                    'message': f'Тестовый email поставлен в очередь на {email}'
                 })
             else:
                 return Response({
@@ -915,26 +942,79 @@ class AdminSubscriptionViewSet(viewsets.ReadOnlyModelViewSet):
     """API для администраторов (получение всех подписок)"""
     serializer_class = UserSubscriptionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
     
     def get_queryset(self):
         # Проверяем, что пользователь администратор
         if self.request.user.role != 'admin' and not self.request.user.is_superuser:
             return UserSubscription.objects.none()
         
-        return UserSubscription.objects.all().select_related('user', 'plan').order_by('-created_at')
+        return UserSubscription.objects.all().select_related('user', 'plan')
 
 
 class AdminTransactionViewSet(viewsets.ReadOnlyModelViewSet):
     """API для администраторов (получение всех транзакций)"""
     serializer_class = TransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
     
     def get_queryset(self):
         # Проверяем, что пользователь администратор
         if self.request.user.role != 'admin' and not self.request.user.is_superuser:
             return Transaction.objects.none()
         
-        return Transaction.objects.all().select_related('user').order_by('-created_at')
+        return Transaction.objects.all().select_related('user')
+
+
+class AdminStatsView(generics.GenericAPIView):
+    """Сводная статистика для дашборда админ-панели (?refresh=1 - пересчитать без кеша)"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        if not (request.user.role == 'admin' or request.user.is_superuser):
+            return Response(
+                {'error': 'Требуются права администратора'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        refresh = request.query_params.get('refresh') in ('1', 'true')
+        return Response(get_admin_stats(refresh=refresh))
+
+
+class AdminAnalyticsView(generics.GenericAPIView):
+    """
+    Выручка по дням из дневной сводки. Параметры: start, end (YYYY-MM-DD,
+    по умолчанию последние 30 дней), export=csv - выгрузка сводки в CSV.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        if not (request.user.role == 'admin' or request.user.is_superuser):
+            return Response(
+                {'error': 'Требуются права администратора'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        try:
+            end = date.fromisoformat(request.query_params['end']) if 'end' in request.query_params else timezone.localdate()
+            start = date.fromisoformat(request.query_params['start']) if 'start' in request.query_params else end - timedelta(days=29)
+        except ValueError:
+            return Response({'error': 'Даты в формате YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        if start > end:
+            return Response({'error': 'start позже end'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if request.query_params.get('export') == 'csv':
+            response = HttpResponse(content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = f'attachment; filename="revenue_{start}_{end}.csv"'
+            write_csv(rollup_rows(start, end), response)
+            return response
+        
+        return Response({
+            'start': start,
+            'end': end,
+            'as_of': get_checkpoint(),
+            'days': daily_revenue(start, end),
+        })
 
 
 class MySubscriptionsView(generics.ListAPIView):
@@ -946,24 +1026,31 @@ class MySubscriptionsView(generics.ListAPIView):
         return UserSubscription.objects.filter(user=self.request.user).select_related('plan')
     
 
-class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
+class NotificationViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """API для просмотра уведомлений пользователя"""
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
     
     def get_queryset(self):
-        return Notification.objects.filter(user=self.request.user).order_by('-created_at')
+        return Notification.objects.filter(user=self.request.user)
 
     @action(detail=True, methods=['post'], url_path='mark-as-read')
     def mark_as_read(self, request, pk=None):
         """Помечает конкретное уведомление как прочитанное"""
         notification = self.get_object()
-        notification.is_read = True
-        notification.save()
+        mark_read(request.user.id, notification.id)
         return Response({'status': 'notification marked as read'})
 
     @action(detail=False, methods=['post'], url_path='mark-all-as-read')
     def mark_all_as_read(self, request):
         """Помечает все уведомления пользователя как прочитанные"""
-        Notification.objects.filter(user=request.user, is_read=False).update(is_read=True)
-        return Response({'status': 'all notifications marked as read'})
\ No newline at end of file
+        mark_read(request.user.id)
+        return Response({'status': 'all notifications marked as read'})
+
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        """Число непрочитанных уведомлений - чтение счетчика, для частого опроса"""
+        count = unread_count(request.user.id)
+        return conditional(request, make_etag(request.user.id, count), None,
+                           lambda: Response({'unread_count': count}))
\ No newline at end of file
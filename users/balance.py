@@ -0,0 +1,83 @@
+"""
+Изменение баланса пользователя. Зачисление и списание - один условный UPDATE
+(balance = balance - x WHERE balance >= x) без чтения записи и без блокировки:
+одновременные операции не затирают друг друга, а баланс не уходит в минус.
+Каждое изменение добавляет запись в журнал (BalanceLedgerEntry) в той же транзакции.
+"""
+from decimal import Decimal
+import logging
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import User, BalanceLedgerEntry
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientFunds(Exception):
+    """На балансе меньше списываемой суммы"""
+
+
+class BalanceChanged(Exception):
+    """Баланс изменился после того, как его прочитали"""
+
+
+def _to_decimal(amount):
+    amount = amount if isinstance(amount, Decimal) else Decimal(str(amount))
+    if amount <= 0:
+        raise ValueError(f"Сумма должна быть больше 0: {amount}")
+    return amount
+
+
+def _apply(user_id, delta, rows, entry_type, transaction_obj, description):
+    if not rows:
+        if not User.objects.filter(id=user_id).exists():
+            raise User.DoesNotExist(f"Пользователь {user_id} не найден")
+        raise InsufficientFunds(f"Недостаточно средств у пользователя {user_id} для списания {-delta}")
+
+    # После UPDATE строка заблокирована до конца транзакции - читаем свое значение
+    balance_after = User.objects.filter(id=user_id).values_list('balance', flat=True).get()
+    BalanceLedgerEntry.objects.create(
+        user_id=user_id,
+        entry_type=entry_type,
+        amount=delta,
+        balance_after=balance_after,
+        transaction=transaction_obj,
+        description=description[:255]
+    )
+    return balance_after
+
+
+def credit(user_id, amount, entry_type, transaction_obj=None, description=''):
+    """Зачисляет amount на баланс. Возвращает новый баланс"""
+    amount = _to_decimal(amount)
+    with transaction.atomic():
+        rows = User.objects.filter(id=user_id).update(balance=F('balance') + amount)
+        return _apply(user_id, amount, rows, entry_type, transaction_obj, description)
+
+
+def debit(user_id, amount, entry_type, transaction_obj=None, description=''):
+    """
+    Списывает amount, если на балансе достаточно средств, иначе InsufficientFunds.
+    Возвращает новый баланс.
+    """
+    amount = _to_decimal(amount)
+    with transaction.atomic():
+        rows = User.objects.filter(id=user_id, balance__gte=amount).update(balance=F('balance') - amount)
+        return _apply(user_id, -amount, rows, entry_type, transaction_obj, description)
+
+
+def set_balance(user_id, expected, new_balance, entry_type, transaction_obj=None, description=''):
+    """
+    Устанавливает баланс new_balance, только если он все еще равен expected
+    (тому, что видел администратор), иначе BalanceChanged: одновременное списание
+    или пополнение не затирается. В журнал идет разница. Возвращает новый баланс.
+    """
+    with transaction.atomic():
+        rows = User.objects.filter(id=user_id, balance=expected).update(balance=new_balance)
+        if not rows:
+            if not User.objects.filter(id=user_id).exists():
+                raise User.DoesNotExist(f"Пользователь {user_id} не найден")
+            raise BalanceChanged(f"Баланс пользователя {user_id} изменился: ожидался {expected}")
+        return _apply(user_id, new_balance - expected, rows, entry_type, transaction_obj, description)
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0008_idempotency_keys"),
+        ("users", "0003_notification_pagination_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BalanceLedgerEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "entry_type",
+                    models.CharField(
+                        choices=[
+                            ("deposit", "Пополнение"),
+                            ("subscription_purchase", "Покупка подписки"),
+                            ("purchase_reversal", "Возврат резерва покупки"),
+                            ("subscription_renewal", "Продление подписки"),
+                            ("refund", "Возврат средств"),
+                            ("admin_adjustment", "Корректировка администратором"),
+                        ],
+                        max_length=30,
+                    ),
+                ),
+                (
+                    "amount",
+                    models.DecimalField(
+                        decimal_places=2,
+                        help_text="Со знаком: + зачисление, - списание",
+                        max_digits=12,
+                    ),
+                ),
+                ("balance_after", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("description", models.CharField(blank=True, max_length=255)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "transaction",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="ledger_entries",
+                        to="subscriptions.transaction",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="ledger_entries",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["user", "created_at"], name="ledger_user_created_idx"
+                    )
+                ],
+            },
+        ),
+    ]
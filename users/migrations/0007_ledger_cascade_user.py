@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0006_notification_counter"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="balanceledgerentry",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="ledger_entries",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
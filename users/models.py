@@ -31,10 +31,70 @@ class Notification(models.Model):
     message = models.TextField()
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     data = models.JSONField(default=dict, blank=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Курсорная пагинация уведомлений пользователя
+            models.Index(fields=['user', 'created_at', 'id'], name='notification_user_created_idx'),
+            # Подсчет непрочитанных, если счетчика NotificationCounter еще нет
+            models.Index(fields=['user'], condition=models.Q(is_read=False), name='notification_unread_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.user.username} - {self.notification_type}"
\ No newline at end of file
+        return f"{self.user.username} - {self.notification_type}"
+
+class NotificationCounter(models.Model):
+    """Число непрочитанных уведомлений пользователя (см. users/notifications.py)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    unread = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.unread}"
+
+
+class BalanceLedgerEntry(models.Model):
+    """
+    Неизменяемая запись журнала баланса: одна строка на каждое изменение
+    User.balance. Пишется только через users.balance. Удаляется только вместе
+    с пользователем, как и его транзакции.
+    """
+    TYPE_CHOICES = (
+        ('deposit', 'Пополнение'),
+        ('subscription_purchase', 'Покупка подписки'),
+        ('purchase_reversal', 'Возврат резерва покупки'),
+        ('subscription_renewal', 'Продление подписки'),
+        ('refund', 'Возврат средств'),
+        ('admin_adjustment', 'Корректировка администратором'),
+    )
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ledger_entries')
+    entry_type = models.CharField(max_length=30, choices=TYPE_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, help_text="Со знаком: + зачисление, - списание")
+    balance_after = models.DecimalField(max_digits=10, decimal_places=2)
+    transaction = models.ForeignKey(
+        'subscriptions.Transaction', on_delete=models.SET_NULL,
+        null=True, blank=True, related_name='ledger_entries'
+    )
+    description = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='ledger_user_created_idx'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Запись журнала баланса нельзя изменить")
+        super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        raise ValueError("Запись журнала баланса нельзя удалить")
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.amount} ({self.entry_type})"
@@ -0,0 +1,125 @@
+"""
+Буфер уведомлений для фоновых задач: вместо Notification.objects.create на каждую
+строку уведомления копятся и пишутся одним bulk_create на пачку.
+
+Здесь же счетчик непрочитанных (NotificationCounter): он меняется при создании
+уведомлений и пометке прочитанными, поэтому узнать число непрочитанных - одно
+чтение по первичному ключу.
+"""
+from collections import Counter
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.dispatch import Signal
+
+from .models import Notification, NotificationCounter
+
+logger = logging.getLogger(__name__)
+
+# bulk_create не шлет post_save: буфер сообщает о записанной пачке сам
+notifications_created = Signal()  # аргумент notifications - список уведомлений
+
+
+def increment_unread(notifications):
+    """Прибавляет непрочитанные из списка уведомлений к счетчикам их пользователей"""
+    per_user = Counter(notification.user_id for notification in notifications if not notification.is_read)
+    for user_id, count in per_user.items():
+        # Нет строки счетчика - его создаст unread_count() подсчетом по индексу
+        NotificationCounter.objects.filter(user_id=user_id).update(unread=F('unread') + count)
+
+
+def decrement_unread(user_id, count):
+    if count:
+        NotificationCounter.objects.filter(user_id=user_id).update(unread=F('unread') - count)
+
+
+def mark_read(user_id, notification_id=None):
+    """
+    Помечает прочитанным одно уведомление (или все) и уменьшает счетчик на
+    число реально измененных строк. Возвращает это число.
+    """
+    unread = Notification.objects.filter(user_id=user_id, is_read=False)
+    if notification_id is not None:
+        unread = unread.filter(id=notification_id)
+    with transaction.atomic():
+        # update() не трогает auto_now - updated_at ставим сами (ETag списка)
+        updated = unread.update(is_read=True, updated_at=timezone.now())
+        decrement_unread(user_id, updated)
+    return updated
+
+
+def unread_count(user_id):
+    """Число непрочитанных: из счетчика, а если его нет - подсчетом и созданием счетчика"""
+    unread = NotificationCounter.objects.filter(user_id=user_id).values_list('unread', flat=True).first()
+    if unread is None:
+        with transaction.atomic():
+            counter, _ = NotificationCounter.objects.get_or_create(
+                user_id=user_id,
+                defaults={'unread': Notification.objects.filter(user_id=user_id, is_read=False).count()}
+            )
+        unread = counter.unread
+    return max(unread, 0)
+
+
+class NotificationBuffer:
+    """
+    Копит уведомления и записывает их пачками по batch_size.
+
+    Уведомление, добавленное внутри transaction.atomic(), попадает в буфер только
+    после коммита этой транзакции (при откате оно отбрасывается). Буфер можно
+    использовать из нескольких потоков. При выходе из with остаток записывается.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or getattr(settings, 'NOTIFICATION_BATCH_SIZE', 500)
+        self.written = 0
+        self.statements = 0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+    def add(self, notification_type='', title='', message='', data=None, **fields):
+        """Добавляет уведомление; принимает те же поля, что и Notification (user или user_id)"""
+        notification = Notification(
+            notification_type=notification_type,
+            title=title,
+            message=message,
+            data=data or {},
+            **fields
+        )
+        if connection.in_atomic_block:
+            transaction.on_commit(lambda: self._append(notification))
+        else:
+            self._append(notification)
+        return notification
+
+    def _append(self, notification):
+        with self._lock:
+            self._pending.append(notification)
+            ready = len(self._pending) >= self.batch_size
+        if ready:
+            self.flush()
+
+    def flush(self):
+        """Записывает накопленные уведомления пачками по batch_size"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            Notification.objects.bulk_create(batch)
+            notifications_created.send(sender=Notification, notifications=batch)
+            with self._lock:
+                self.written += len(batch)
+                self.statements += 1
+        return len(pending)
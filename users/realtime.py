@@ -0,0 +1,160 @@
+"""
+Доставка новых уведомлений в реальном времени (server-sent events).
+
+Брокер живет в памяти процесса: post_save уведомления публикует его всем
+открытым потокам этого пользователя. Каждый поток - корутина под ASGI, ожидание
+на asyncio.Queue почти ничего не стоит, поэтому тысячи простаивающих клиентов
+держат соединения дешево. Уведомления, созданные в другом процессе (воркер
+фоновых задач), поток подбирает запросом к БД раз в heartbeat; по Last-Event-ID
+клиент после переподключения получает пропущенное.
+"""
+import asyncio
+from collections import defaultdict
+import json
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+
+def get_heartbeat():
+    return getattr(settings, 'NOTIFICATION_STREAM_HEARTBEAT_SECONDS', 20)
+
+
+def get_queue_size():
+    return getattr(settings, 'NOTIFICATION_STREAM_QUEUE_SIZE', 100)
+
+
+def serialize(notification):
+    from .serializers import NotificationSerializer
+    return NotificationSerializer(notification).data
+
+
+class Subscription:
+    """Очередь одного открытого потока; наполняется из любого потока через его event loop"""
+
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def offer(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать - дочитает пропущенное из БД
+            self.overflowed = True
+
+
+class NotificationBroker:
+    """Раздача уведомлений подписчикам по user_id в пределах процесса"""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(asyncio.get_running_loop(), get_queue_size())
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def has_subscribers(self, user_id):
+        return user_id in self._subscribers
+
+    def publish(self, user_id, payload):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, payload)
+            except RuntimeError:
+                # Event loop уже закрыт - поток отписывается сам
+                pass
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+broker = NotificationBroker()
+
+
+def publish_notifications(notifications):
+    """Публикует уведомления открытым потокам (вызывается после коммита)"""
+    for notification in notifications:
+        if broker.has_subscribers(notification.user_id):
+            broker.publish(notification.user_id, serialize(notification))
+
+
+def format_event(payload):
+    data = json.dumps(payload, cls=DjangoJSONEncoder, ensure_ascii=False)
+    return f"id: {payload['id']}\nevent: notification\ndata: {data}\n\n"
+
+
+@sync_to_async
+def _latest_id(user_id):
+    return Notification.objects.filter(user_id=user_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+@sync_to_async
+def _missed_since(user_id, last_id, limit):
+    """Уведомления пользователя с id больше last_id, по возрастанию"""
+    notifications = Notification.objects.filter(user_id=user_id, id__gt=last_id).order_by('id')[:limit]
+    return [serialize(notification) for notification in notifications]
+
+
+async def event_stream(user_id, last_id=None):
+    """
+    Асинхронный генератор SSE. Сначала подписывается, затем дочитывает пропущенное
+    из БД, чтобы уведомление, созданное между ними, не потерялось (дубли из
+    очереди отсекаются по id). Без last_id поток начинается с текущего момента.
+    """
+    # Подписка и точка отсчета - до первого yield: генератор продолжается только
+    # по запросу следующего куска, и все созданное до этого оказалось бы "старым"
+    subscription = broker.subscribe(user_id)
+    limit = get_queue_size()
+    try:
+        if last_id is None:
+            last_id = await _latest_id(user_id)
+        catch_up = True
+        yield f"retry: {get_heartbeat() * 1000}\n\n"
+        while True:
+            if catch_up or subscription.overflowed:
+                subscription.overflowed = False
+                while True:
+                    missed = await _missed_since(user_id, last_id, limit)
+                    for payload in missed:
+                        last_id = payload['id']
+                        yield format_event(payload)
+                    if len(missed) < limit:
+                        break
+                catch_up = False
+
+            try:
+                payload = await asyncio.wait_for(subscription.queue.get(), get_heartbeat())
+            except asyncio.TimeoutError:
+                # Уведомления из других процессов приходят только через БД
+                yield ": ping\n\n"
+                catch_up = True
+                continue
+
+            if payload['id'] > last_id:
+                last_id = payload['id']
+                yield format_event(payload)
+    finally:
+        broker.unsubscribe(user_id, subscription)
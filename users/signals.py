@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import User, Notification, NotificationCounter
+from .notifications import notifications_created, increment_unread
+from .realtime import publish_notifications
+
+
+@receiver(post_save, sender=User)
+def create_notification_counter(sender, instance, created, raw=False, **kwargs):
+    """Счетчик заводится вместе с пользователем, чтобы инкременты не терялись"""
+    if created and not raw:
+        NotificationCounter.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Notification)
+def count_created_notification(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        increment_unread([instance])
+        # Открытым SSE-потокам - только после коммита, иначе клиент увидит откатанное
+        transaction.on_commit(lambda: publish_notifications([instance]))
+
+
+@receiver(notifications_created)
+def count_buffered_notifications(sender, notifications, **kwargs):
+    increment_unread(notifications)
+    transaction.on_commit(lambda: publish_notifications(notifications))
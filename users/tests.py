@@ -1,3 +1,210 @@
-from django.test import TestCase
+import asyncio
+from decimal import Decimal
+import json
 
-# Create your tests here.
+from django.db import transaction
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from .balance import BalanceChanged, InsufficientFunds, credit, debit, set_balance
+from .models import BalanceLedgerEntry, Notification, NotificationCounter, User
+from .notifications import NotificationBuffer, mark_read, unread_count
+from .realtime import broker, event_stream
+
+
+class BalanceTests(TestCase):
+    """Условное списание: баланс не уходит в минус, журнал пишется только при изменении"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='wallet', balance=Decimal('100'))
+
+    def test_debit_without_funds_keeps_balance(self):
+        with self.assertRaises(InsufficientFunds):
+            debit(self.user.id, Decimal('150'), 'subscription_purchase')
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('100'))
+        self.assertFalse(BalanceLedgerEntry.objects.exists())
+
+    def test_debit_checks_current_balance_not_stale_copy(self):
+        # Оба списания видят в памяти 100, но второе проверяется по строке в БД
+        stale = User.objects.get(id=self.user.id)
+        self.assertEqual(debit(self.user.id, Decimal('60'), 'subscription_purchase'), Decimal('40'))
+        self.assertEqual(stale.balance, Decimal('100'))
+
+        with self.assertRaises(InsufficientFunds):
+            debit(stale.id, Decimal('60'), 'subscription_purchase')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('40'))
+
+    def test_every_change_is_journaled(self):
+        credit(self.user.id, Decimal('50'), 'deposit')
+        debit(self.user.id, Decimal('30'), 'subscription_purchase')
+
+        entries = list(BalanceLedgerEntry.objects.order_by('id').values_list('amount', 'balance_after'))
+        self.assertEqual(entries, [(Decimal('50'), Decimal('150')), (Decimal('-30'), Decimal('120'))])
+
+    def test_debit_rejects_non_positive_amount(self):
+        with self.assertRaises(ValueError):
+            debit(self.user.id, Decimal('0'), 'subscription_purchase')
+
+    def test_user_with_history_can_be_deleted(self):
+        credit(self.user.id, Decimal('10'), 'deposit')
+        self.user.delete()
+        self.assertFalse(BalanceLedgerEntry.objects.exists())
+
+
+class NotificationBufferTests(TestCase):
+    """Уведомления пишутся пачками и только после коммита транзакции, в которой добавлены"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='reader')
+
+    def test_notifications_are_written_in_batches(self):
+        buffer = NotificationBuffer(batch_size=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                buffer.add(user_id=self.user.id, notification_type='payment_success', title=f'Платеж {i}')
+        self.assertEqual(Notification.objects.count(), 4)
+
+        buffer.flush()
+        self.assertEqual((buffer.written, buffer.statements), (5, 3))
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 5)
+
+    def test_rolled_back_notification_is_dropped(self):
+        with self.captureOnCommitCallbacks(execute=True), NotificationBuffer() as buffer:
+            buffer.add(user_id=self.user.id, title='Сохранится')
+            try:
+                with transaction.atomic():
+                    buffer.add(user_id=self.user.id, title='Откатится')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        buffer.flush()
+
+        self.assertEqual(list(Notification.objects.values_list('title', flat=True)), ['Сохранится'])
+
+
+class UnreadCounterTests(TestCase):
+    """Счетчик непрочитанных следует за созданием уведомлений и пометкой прочитанными"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='counted')
+        self.notifications = [
+            Notification.objects.create(user=self.user, title=f'Уведомление {i}') for i in range(2)
+        ]
+
+    def test_counter_follows_changes(self):
+        buffer = NotificationBuffer()
+        with self.captureOnCommitCallbacks(execute=True):
+            buffer.add(user_id=self.user.id, title='Из буфера')
+        buffer.flush()
+        self.assertEqual(unread_count(self.user.id), 3)
+
+        self.assertEqual(mark_read(self.user.id, self.notifications[0].id), 1)
+        # Повторная пометка ничего не меняет и не уводит счетчик вниз
+        self.assertEqual(mark_read(self.user.id, self.notifications[0].id), 0)
+        self.assertEqual(unread_count(self.user.id), 2)
+
+        mark_read(self.user.id)
+        self.assertEqual(unread_count(self.user.id), 0)
+
+    def test_missing_counter_is_rebuilt(self):
+        NotificationCounter.objects.filter(user=self.user).delete()
+        self.assertEqual(unread_count(self.user.id), 2)
+        self.assertTrue(NotificationCounter.objects.filter(user=self.user, unread=2).exists())
+
+    def test_endpoint_revalidates_by_count(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = '/api/subscriptions/notifications/unread-count/'
+        response = client.get(url)
+        self.assertEqual(response.data, {'unread_count': 2})
+
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        mark_read(self.user.id)
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).data, {'unread_count': 0})
+
+
+def _event_ids(chunks):
+    return [json.loads(chunk.split('data: ', 1)[1])['id'] for chunk in chunks if chunk.startswith('id:')]
+
+
+# Поток читает БД из других потоков (sync_to_async) - данные должны быть закоммичены
+@override_settings(NOTIFICATION_STREAM_HEARTBEAT_SECONDS=0.2)
+class NotificationStreamTests(TransactionTestCase):
+    """SSE-поток: пропущенное по Last-Event-ID, новые уведомления сразу и без дублей"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='listener')
+        self.first, self.second = [Notification.objects.create(user=self.user, title=f'№{i}') for i in range(2)]
+
+    async def _read(self, stream, count):
+        return [await asyncio.wait_for(stream.__anext__(), 2) for _ in range(count)]
+
+    def test_missed_notifications_are_replayed(self):
+        async def scenario():
+            stream = event_stream(self.user.id, last_id=self.first.id)
+            try:
+                return await self._read(stream, 3)
+            finally:
+                await stream.aclose()
+
+        retry, event, ping = async_to_sync(scenario)()
+        self.assertTrue(retry.startswith('retry:'))
+        self.assertEqual(_event_ids([event]), [self.second.id])
+        self.assertEqual(ping, ': ping\n\n')
+
+    def test_new_notification_is_delivered_once(self):
+        async def scenario():
+            stream = event_stream(self.user.id)
+            try:
+                await self._read(stream, 1)
+                created = await sync_to_async(Notification.objects.create)(user=self.user, title='Новое')
+                # Событие из очереди брокера и дочитка из БД после ping не дублируют друг друга
+                return created, await self._read(stream, 3)
+            finally:
+                await stream.aclose()
+
+        created, chunks = async_to_sync(scenario)()
+        self.assertEqual(_event_ids(chunks), [created.id])
+        self.assertEqual(broker.connection_count(), 0)
+
+    def test_stream_requires_token(self):
+        self.assertEqual(self.client.get('/api/auth/notifications/stream/').status_code, 401)
+
+
+class AdminSetBalanceTests(TestCase):
+    """Установка баланса администратором не затирает изменения, которых он не видел"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='customer', balance=Decimal('100'))
+        admin = User.objects.create(username='boss', role='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+
+    def _update(self, **data):
+        return self.client.post(f'/api/auth/admin/users/{self.user.id}/update/', data, format='json')
+
+    def test_balance_is_set_from_seen_value(self):
+        response = self._update(balance='250.50', expected_balance='100.00')
+
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('250.50'))
+        self.assertEqual(BalanceLedgerEntry.objects.get().amount, Decimal('150.50'))
+
+    def test_concurrent_change_is_not_overwritten(self):
+        # Пока администратор смотрел на 100, пользователь потратил 30
+        debit(self.user.id, Decimal('30'), 'subscription_purchase')
+        response = self._update(balance='200', expected_balance='100')
+
+        self.assertEqual(response.status_code, 409)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('70'))
+
+    def test_set_balance_checks_expected_value(self):
+        with self.assertRaises(BalanceChanged):
+            set_balance(self.user.id, Decimal('90'), Decimal('0'), 'admin_adjustment')
+        self.assertEqual(set_balance(self.user.id, Decimal('100'), Decimal('0'), 'admin_adjustment'), Decimal('0'))
@@ -3,7 +3,7 @@ from .views import (
     RegisterView, LoginView, UserProfileView, 
     get_user_balance, deposit_funds, get_user_profile_full,
     get_user_balance_admin, adjust_balance_admin,
-    AdminUserViewSet, AdminUpdateUserView
+    AdminUserViewSet, AdminUpdateUserView, notification_stream
 )
 
 urlpatterns = [
@@ -16,6 +16,9 @@ urlpatterns = [
     path('deposit/', deposit_funds, name='deposit_funds'),
     path('profile/full/', get_user_profile_full, name='profile_full'),
     
+    # Поток новых уведомлений (server-sent events, нужен ASGI-сервер)
+    path('notifications/stream/', notification_stream, name='notification_stream'),
+    
     # Админские эндпоинты
     path('admin/users/', AdminUserViewSet.as_view({'get': 'list'}), name='admin_users'),
     path('admin/users/<int:user_id>/update/', AdminUpdateUserView.as_view(), name='admin_update_user'),
@@ -6,12 +6,22 @@ from rest_framework import generics, permissions, viewsets, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.decorators import api_view, permission_classes
 from django.contrib.auth import authenticate
 from django.db import transaction as db_transaction  
+from django.http import JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
 from .serializers import RegisterSerializer, UserSerializer, UserBalanceSerializer, DepositSerializer
 from .models import User, Notification  
 from subscriptions.models import Transaction 
+from subscriptions.idempotency import idempotent
+from subscriptions.conditional import conditional, make_etag
+from .balance import credit, debit, set_balance, BalanceChanged, InsufficientFunds
+from .realtime import event_stream
+from decimal import Decimal
 import logging
 
 logger = logging.getLogger(__name__)
@@ -76,19 +86,44 @@ class AdminUpdateUserView(generics.GenericAPIView):
             new_balance = request.data.get('balance')
             is_active = request.data.get('is_active')
             
+            update_fields = []
             if new_role and new_role in ['user', 'admin']:
                 user.role = new_role
+                update_fields.append('role')
             
             if new_balance is not None:
                 try:
-                    user.balance = float(new_balance)
-                except:
+                    new_balance = Decimal(str(new_balance))
+                    # Баланс, который видел администратор; без него - прочитанный сейчас
+                    expected_balance = Decimal(str(request.data.get('expected_balance', user.balance)))
+                except (ArithmeticError, ValueError, TypeError):
                     return Response({'error': 'Неверный формат баланса'}, status=400)
+                if new_balance < 0:
+                    return Response({'error': 'Баланс не может быть отрицательным'}, status=400)
             
             if is_active is not None:
                 user.is_active = bool(is_active)
+                update_fields.append('is_active')
             
-            user.save()
+            with db_transaction.atomic():
+                if update_fields:
+                    user.save(update_fields=update_fields)
+                
+                # Баланс меняется условным UPDATE от того значения, что видел администратор:
+                # если его успели изменить (покупка, пополнение), запрос отклоняется
+                if new_balance is not None and new_balance != expected_balance:
+                    difference = new_balance - expected_balance
+                    description = f'Установка баланса администратором: {new_balance} руб.'
+                    transaction = Transaction.objects.create(
+                        user=user,
+                        amount=abs(difference),
+                        transaction_type='deposit' if difference > 0 else 'payment',
+                        status='completed',
+                        description=description
+                    )
+                    user.balance = set_balance(
+                        user.id, expected_balance, new_balance, 'admin_adjustment', transaction, description
+                    )
             
             return Response({
                 'success': True,
@@ -98,6 +133,8 @@ class AdminUpdateUserView(generics.GenericAPIView):
             
         except User.DoesNotExist:
             return Response({'error': 'Пользователь не найден'}, status=404)
+        except BalanceChanged:
+            return Response({'error': 'Баланс пользователя изменился, повторите запрос'}, status=409)
 
 # ========== Функции для работы с балансом ==========
 
@@ -106,11 +143,15 @@ class AdminUpdateUserView(generics.GenericAPIView):
 def get_user_balance(request):
     """Получить баланс пользователя (быстрый запрос)"""
     try:
+        # ETag из полей ответа: пользователь уже загружен аутентификацией,
+        # при неизменном балансе клиент получает 304 без сериализации
+        user = request.user
+        etag = make_etag(user.id, user.username, user.email, user.balance)
+        
         # Проверяем, есть ли сериализатор UserBalanceSerializer
         try:
             from .serializers import UserBalanceSerializer
-            serializer = UserBalanceSerializer(request.user)
-            return Response(serializer.data)
+            return conditional(request, etag, None, lambda: Response(UserBalanceSerializer(user).data))
         except ImportError:
             # Альтернатива если сериализатора нет
             return Response({
@@ -128,10 +169,11 @@ def get_user_balance(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@idempotent
 def deposit_funds(request):
     """Пополнение баланса пользователя"""
     # Импортируем задачу здесь, чтобы избежать кругового импорта
-    from subscriptions.background_tasks import check_subscription_renewals
+    from subscriptions.background_tasks import activate_pending_renewals
     try:
         from .serializers import DepositSerializer
         serializer = DepositSerializer(data=request.data)
@@ -140,12 +182,11 @@ def deposit_funds(request):
             return Response(serializer.errors, status=400)
         
         amount = serializer.validated_data['amount']
+        if amount <= 0:
+            return Response({'error': 'Сумма должна быть больше 0'}, status=400)
         
         with db_transaction.atomic():  
             user = request.user
-            old_balance = user.balance
-            user.balance += amount
-            user.save()
             
             transaction = Transaction.objects.create(
                 user=user,
@@ -155,6 +196,10 @@ def deposit_funds(request):
                 description=f'Пополнение баланса на {amount} руб.'
             )
             
+            # Зачисление одним UPDATE: параллельные пополнения не затирают друг друга
+            user.balance = credit(user.id, amount, 'deposit', transaction, transaction.description)
+            old_balance = user.balance - amount
+            
             # Создаем уведомление
             Notification.objects.create(
                 user=user,
@@ -175,9 +220,11 @@ def deposit_funds(request):
             logger.info(f"Новый баланс: {user.balance} руб.")
             logger.info(f"{'='*50}")
             
-            # Запускаем проверку продления подписок
-            # Это активирует подписки, которые ждали денег (pending_renewal)
-            check_subscription_renewals()
+            # Подписки этого пользователя, которые ждали денег (pending_renewal),
+            # продлеваются фоновой задачей после коммита пополнения
+            if user.subscriptions.filter(status='pending_renewal', auto_renew=True).exists():
+                user_id = user.id
+                db_transaction.on_commit(lambda: activate_pending_renewals(user_id))
             
             return Response({
                 'success': True,
@@ -199,17 +246,17 @@ def deposit_funds(request):
                 return Response({'error': 'Сумма должна быть больше 0'}, status=400)
             
             user = request.user
-            old_balance = user.balance
-            user.balance += amount
-            user.save()
             
-            transaction = Transaction.objects.create(
-                user=user,
-                amount=amount,
-                transaction_type='deposit',
-                status='completed',
-                description=f'Пополнение баланса на {amount} руб.'
-            )
+            with db_transaction.atomic():
+                transaction = Transaction.objects.create(
+                    user=user,
+                    amount=amount,
+                    transaction_type='deposit',
+                    status='completed',
+                    description=f'Пополнение баланса на {amount} руб.'
+                )
+                user.balance = credit(user.id, amount, 'deposit', transaction, transaction.description)
+            old_balance = user.balance - Decimal(str(amount))
             
             return Response({
                 'success': True,
@@ -283,38 +330,38 @@ def adjust_balance_admin(request, user_id):
             return Response({'error': 'Укажите сумму'}, status=400)
         
         try:
-            amount = float(amount)
-        except (ValueError, TypeError):
+            amount = Decimal(str(amount))
+        except (ArithmeticError, ValueError, TypeError):
             return Response({'error': 'Неверный формат суммы'}, status=400)
+        if amount <= 0:
+            return Response({'error': 'Сумма должна быть больше 0'}, status=400)
         
-        with db_transaction.atomic():
-            old_balance = user.balance
-            
-            if action == 'add':
-                user.balance += amount
-                transaction_type = 'deposit'
-                description = f'Начисление администратором: {amount} руб. Причина: {reason}'
-            elif action == 'subtract':
-                if user.balance < amount:
-                    return Response(
-                        {'error': 'Недостаточно средств на балансе'},
-                        status=400
-                    )
-                user.balance -= amount
-                transaction_type = 'payment'
-                description = f'Списание администратором: {amount} руб. Причина: {reason}'
-            else:
-                return Response({'error': 'Неверное действие'}, status=400)
-            
-            user.save()
-            
-            transaction = Transaction.objects.create(
-                user=user,
-                amount=amount,
-                transaction_type=transaction_type,
-                status='completed',
-                description=description
-            )
+        if action == 'add':
+            transaction_type = 'deposit'
+            description = f'Начисление администратором: {amount} руб. Причина: {reason}'
+        elif action == 'subtract':
+            transaction_type = 'payment'
+            description = f'Списание администратором: {amount} руб. Причина: {reason}'
+        else:
+            return Response({'error': 'Неверное действие'}, status=400)
+        
+        try:
+            with db_transaction.atomic():
+                transaction = Transaction.objects.create(
+                    user=user,
+                    amount=amount,
+                    transaction_type=transaction_type,
+                    status='completed',
+                    description=description
+                )
+                
+                # Условный UPDATE: списание не уведет баланс в минус даже при гонке
+                if action == 'add':
+                    user.balance = credit(user.id, amount, 'admin_adjustment', transaction, description)
+                    old_balance = user.balance - amount
+                else:
+                    user.balance = debit(user.id, amount, 'admin_adjustment', transaction, description)
+                    old_balance = user.balance + amount
             
             # Создаем уведомление для пользователя
             Notification.objects.create(
@@ -333,11 +380,60 @@ def adjust_balance_admin(request, user_id):
                 'message': f'Баланс пользователя {user.username} изменен',
                 'old_balance': float(old_balance),
                 'new_balance': float(user.balance),
-                'difference': amount if action == 'add' else -amount,
+                'difference': float(amount if action == 'add' else -amount),
                 'action': action,
                 'reason': reason,
                 'transaction_id': transaction.id
             })
+        except InsufficientFunds:
+            return Response(
+                {'error': 'Недостаточно средств на балансе'},
+                status=400
+            )
             
     except User.DoesNotExist:
-        return Response({'error': 'Пользователь не найден'}, status=404)
\ No newline at end of file
+        return Response({'error': 'Пользователь не найден'}, status=404)
+
+# ========== Поток уведомлений (SSE) ==========
+
+@sync_to_async
+def _authenticate_stream(request):
+    """
+    JWT из заголовка Authorization или параметра ?token= (EventSource в браузере
+    не умеет ставить заголовки). Возвращает пользователя или None.
+    """
+    raw_token = request.GET.get('token')
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        raw_token = header[len('Bearer '):]
+    if not raw_token:
+        return None
+    authentication = JWTAuthentication()
+    try:
+        user = authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return user if user.is_active else None
+
+
+async def notification_stream(request):
+    """
+    Новые уведомления пользователя как server-sent events. Работает под ASGI
+    (uvicorn backend.asgi:application); после обрыва клиент присылает Last-Event-ID
+    (или ?last_id=) и получает пропущенное.
+    """
+    user = await _authenticate_stream(request)
+    if user is None:
+        return JsonResponse({'error': 'Требуется авторизация'}, status=401)
+    
+    last_id = request.headers.get('Last-Event-ID') or request.GET.get('last_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return JsonResponse({'error': 'Неверный Last-Event-ID'}, status=400)
+    
+    response = StreamingHttpResponse(event_stream(user.id, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Не буферизовать поток в nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response